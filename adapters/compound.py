@@ -5,6 +5,7 @@ from httputil import get_json, to_float
 
 SUMMARY_URL = "https://v3-api.compound.finance/market/{network}/{comet}/summary"
 REWARDS_URL = "https://v3-api.compound.finance/market/all-networks/all-contracts/rewards/dapp-data"
+REWARDS_CACHE_TTL = 900
 
 MARKETS = [
     {
@@ -37,8 +38,9 @@ def _fetch_borrow_apr(network: str, comet: str) -> float:
 def _fetch_rewards_map() -> Dict[str, float]:
     """
     Returns a map of "chain_id:comet_lower" -> borrow_rewards_apr for WETH markets.
+    Reward rates move slowly, so the response is cached across cycles.
     """
-    data = get_json(REWARDS_URL)
+    data = get_json(REWARDS_URL, cache_ttl=REWARDS_CACHE_TTL)
 
     rewards: Dict[str, float] = {}
     for entry in data:
@@ -1,17 +1,30 @@
-from typing import Dict, List
+import math
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 from Crypto.Hash import keccak
 
-from httputil import post_json
+from httputil import DeadlineExceeded
+from rpcpool import RpcPool, endpoints_from_env
 
 
 # ── RPC + VaultLens ──────────────────────────────────────────────────────────
 # Euler's REST API is behind Cloudflare. All data is now fetched on-chain via
-# their RPC proxy and the VaultLens contract (getVaultInfoFull).
+# their RPC proxy: borrow APYs from the VaultLens contract (getVaultInfoFull),
+# caps and totals from the vaults' own narrow views (caps, totalAssets,
+# totalBorrows). Every read for a chain is packed into a single Multicall3
+# aggregate3 eth_call, so all values come from the same block.
 
 EULER_RPC_URL = "https://app.euler.finance/api/rpc/{chain_id}"
+# Extra endpoints per chain: EULER_RPC_URLS_<chain_id>, comma-separated, e.g.
+# EULER_RPC_URLS_1="https://app.euler.finance/api/rpc/1,https://eth.example".
+# Any standard JSON-RPC node works; calls go to the fastest endpoint.
 EULER_APY_SCALE = 1e27  # ray
 
+# Multicall3 is deployed at the same address on every chain we use.
+MULTICALL3 = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
 # VaultLens addresses per chain (from euler-xyz/euler-interfaces)
 VAULT_LENS = {
     1:     "0xA18D79deB85C414989D7297F23e5391703Ea66aB",
@@ -28,10 +41,6 @@ VAULT_LENS = {
 # and decoded values become garbage. The range guards in the field extractors
 # below will surface that as a clear engine error rather than silently
 # polluting the alert stream.
-_W_TOTAL_BORROWED = 16
-_W_TOTAL_ASSETS   = 17
-_W_SUPPLY_CAP     = 26
-_W_BORROW_CAP     = 27
 # irmInfo is a dynamic struct; its offset lives at word 40.
 _W_IRM_OFFSET     = 40
 
@@ -135,6 +144,10 @@ PAIRED_CAPS = [
     },
 ]
 
+# The hand-listed Ethereum pairs; discovery rebuilds PAIRED_CAPS from these
+# plus the pairs it currently finds.
+SENTORA_PAIRS = list(PAIRED_CAPS)
+
 
 # ── ABI helpers ──────────────────────────────────────────────────────────────
 
@@ -144,62 +157,624 @@ def _keccak256(data: bytes) -> bytes:
     return k.digest()
 
 
-_GET_VAULT_INFO_FULL_SELECTOR = _keccak256(b"getVaultInfoFull(address)")[:4].hex()
+def _selector(signature: str) -> bytes:
+    return _keccak256(signature.encode())[:4]
+
+
+_GET_VAULT_INFO_FULL = _selector("getVaultInfoFull(address)")
+_CAPS                = _selector("caps()")
+_TOTAL_ASSETS        = _selector("totalAssets()")
+_TOTAL_BORROWS       = _selector("totalBorrows()")
+_AGGREGATE3          = _selector("aggregate3((address,bool,bytes)[])")
+_GET_BLOCK_NUMBER    = _selector("getBlockNumber()")
+_INTEREST_RATE       = _selector("interestRate()")
+_ASSET               = _selector("asset()")
+_SYMBOL              = _selector("symbol()")
+_LTV_LIST            = _selector("LTVList()")
+_VERIFIED_ARRAY      = _selector("verifiedArray()")
+
+
+def _word(n: int) -> bytes:
+    return n.to_bytes(32, "big")
+
+
+def _uint(raw: memoryview, at: int) -> int:
+    return int.from_bytes(raw[at : at + 32], "big")
+
+
+def _address_word(address: str) -> bytes:
+    return bytes.fromhex(address.lower().replace("0x", "").zfill(64))
+
+
+def _encode_call(vault_address: str) -> bytes:
+    return _GET_VAULT_INFO_FULL + _address_word(vault_address)
+
+
+class _Words:
+    """
+    Read-only view of ABI return data as 32-byte words.
+
+    Nothing is decoded up front: indexing converts just that word to an int,
+    straight from the underlying buffer. The field extractors touch a handful
+    of words out of 100+, following the dynamic offsets as they go.
+    """
+
+    __slots__ = ("_buf",)
+
+    def __init__(self, data: memoryview):
+        self._buf = data
+
+    def __len__(self) -> int:
+        return len(self._buf) // 32
+
+    def __getitem__(self, i: int) -> int:
+        if not 0 <= i < len(self):
+            raise IndexError(f"ABI word {i} out of range ({len(self)} words)")
+        return int.from_bytes(self._buf[32 * i : 32 * i + 32], "big")
+
 
+def _encode_aggregate3(calls: List[Tuple[str, bytes]]) -> bytes:
+    """Calldata for aggregate3(Call3[]), Call3 = (target, allowFailure=true, callData)."""
+    tuples = []
+    for target, data in calls:
+        padded = data + b"\0" * (-len(data) % 32)
+        tuples.append(_address_word(target) + _word(1) + _word(0x60) + _word(len(data)) + padded)
 
-def _encode_call(vault_address: str) -> str:
-    addr = vault_address.lower().replace("0x", "").zfill(64)
-    return "0x" + _GET_VAULT_INFO_FULL_SELECTOR + addr
+    heads, offset = [], 32 * len(tuples)
+    for t in tuples:
+        heads.append(_word(offset))
+        offset += len(t)
+    return _AGGREGATE3 + _word(0x20) + _word(len(tuples)) + b"".join(heads) + b"".join(tuples)
 
 
-def _decode_words(hex_result: str) -> List[int]:
-    raw = hex_result[2:]  # strip 0x
-    return [int(raw[i : i + 64], 16) for i in range(0, len(raw), 64)]
+def _decode_aggregate3(raw: memoryview) -> List[Optional[memoryview]]:
+    """
+    Return data of each Result(success, returnData), as views into `raw`;
+    None where the call failed.
+    """
+    array_at = _uint(raw, 0)
+    count = _uint(raw, array_at)
+    items_at = array_at + 32
+
+    out: List[Optional[memoryview]] = []
+    for i in range(count):
+        item = items_at + _uint(raw, items_at + 32 * i)
+        data_at = item + _uint(raw, item + 32)
+        length = _uint(raw, data_at)
+        out.append(raw[data_at + 32 : data_at + 32 + length] if _uint(raw, item) else None)
+    return out
+
+
+def _resolve_amount_cap(raw: int) -> int:
+    """
+    Decode an EVK AmountCap (uint16): 10-bit mantissa and 6-bit decimal
+    exponent, scaled by 100. 0 means no cap.
+    """
+    if raw == 0:
+        return 2 ** 256 - 1
+    return 10 ** (raw & 63) * (raw >> 6) // 100
+
+
+def _abi_address(raw: memoryview, at: int = 0) -> str:
+    return "0x" + bytes(raw[at + 12 : at + 32]).hex()
+
+
+def _abi_address_array(raw: memoryview) -> List[str]:
+    start = _uint(raw, 0)
+    if start + 32 > len(raw):
+        raise ValueError(f"address[] offset {start} past {len(raw)} bytes")
+    n = _uint(raw, start)
+    if start + 32 * (n + 1) > len(raw):
+        raise ValueError(f"address[] of {n} past {len(raw)} bytes")
+    return [_abi_address(raw, start + 32 * (i + 1)) for i in range(n)]
 
 
-# ── RPC batch caller ────────────────────────────────────────────────────────
+def _abi_string(raw: memoryview) -> str:
+    if len(raw) == 32:  # a few old tokens return bytes32 symbols
+        return bytes(raw).rstrip(b"\0").decode("utf-8", "replace")
+    start = _uint(raw, 0)
+    return bytes(raw[start + 32 : start + 32 + _uint(raw, start)]).decode("utf-8", "replace")
 
-def _rpc_batch(chain_id: int, vault_addresses: List[str]) -> Dict[str, List[int]]:
+
+# ── RPC calls ────────────────────────────────────────────────────────────────
+
+_rpc_pools: Dict[int, RpcPool] = {}
+
+
+def _rpc_pool(chain_id: int) -> RpcPool:
+    pool = _rpc_pools.get(chain_id)
+    if pool is None:
+        urls = endpoints_from_env(
+            f"EULER_RPC_URLS_{chain_id}", [EULER_RPC_URL.format(chain_id=chain_id)]
+        )
+        pool = _rpc_pools.setdefault(chain_id, RpcPool(urls))
+    return pool
+
+
+# A block number, a tag such as "latest", or an EIP-1898 {"blockHash": ...} object.
+Block = Union[int, str, Dict[str, Any]]
+
+
+def _aggregate3(
+    chain_id: int,
+    calls: List[Tuple[str, bytes]],
+    block: Block = "latest",
+) -> Tuple[int, List[Optional[memoryview]]]:
+    """
+    Run `calls` (target, calldata) in one Multicall3 eth_call at `block`.
+    Returns the block number the reads came from and each call's return data
+    (None for a call that reverted).
+    """
+    data = _encode_aggregate3([(MULTICALL3, _GET_BLOCK_NUMBER)] + calls)
+    payload = {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "method": "eth_call",
+        "params": [
+            {"to": MULTICALL3, "data": "0x" + data.hex()},
+            hex(block) if isinstance(block, int) else block,   # a tag or an EIP-1898 object
+        ],
+    }
+    resp = _rpc_pool(chain_id).call(payload, timeout=30)
+    if "error" in resp:
+        raise RuntimeError(f"Multicall3 error on chain {chain_id}: {resp['error']}")
+
+    # The one copy of the payload; everything below is a view into it.
+    results = _decode_aggregate3(memoryview(bytes.fromhex(resp["result"][2:])))
+    if len(results) != len(calls) + 1 or results[0] is None:
+        raise RuntimeError(f"Malformed Multicall3 response on chain {chain_id}")
+    return int.from_bytes(results[0], "big"), results[1:]
+
+
+# Large reads are split into several aggregate3 calls. The chunk size, in
+# sub-calls, adapts per chain: halved when a chunk fails (providers reject
+# oversized payloads or run out of gas) or takes longer than
+# CHUNK_TARGET_SECONDS, and grown when chunks come back well inside it.
+# Growth only goes halfway to the smallest size that has failed, and a failure
+# falls back no lower than the largest size that has worked, so the size
+# settles just under a provider's limit instead of bouncing off it.
+MIN_CHUNK_CALLS = 10
+MAX_CHUNK_CALLS = 1000
+INITIAL_CHUNK_CALLS = 200
+CHUNK_TARGET_SECONDS = 3.0
+
+_chunk_calls: Dict[int, int] = {}
+_chunk_ceiling: Dict[int, int] = {}
+_chunk_floor: Dict[int, int] = {}
+
+
+def _aggregate3_chunked(
+    chain_id: int,
+    calls: List[Tuple[str, bytes]],
+    block: Block = "latest",
+) -> List[Optional[memoryview]]:
+    out: List[Optional[memoryview]] = []
+    i = 0
+    while i < len(calls):
+        size = _chunk_calls.get(chain_id, INITIAL_CHUNK_CALLS)
+        chunk = calls[i : i + size]
+        start = time.monotonic()
+        try:
+            _, returns = _aggregate3(chain_id, chunk, block)
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            if len(chunk) <= MIN_CHUNK_CALLS:
+                raise
+            _chunk_ceiling[chain_id] = min(len(chunk), _chunk_ceiling.get(chain_id, MAX_CHUNK_CALLS + 1))
+            floor = _chunk_floor.get(chain_id, 0)
+            if floor >= len(chunk):
+                floor = _chunk_floor[chain_id] = 0   # the limit has tightened
+            _chunk_calls[chain_id] = max(MIN_CHUNK_CALLS, len(chunk) // 2, floor)
+            continue
+
+        elapsed = time.monotonic() - start
+        _chunk_floor[chain_id] = max(len(chunk), _chunk_floor.get(chain_id, 0))
+        if elapsed > CHUNK_TARGET_SECONDS:
+            _chunk_calls[chain_id] = max(MIN_CHUNK_CALLS, size // 2)
+        elif elapsed < CHUNK_TARGET_SECONDS / 2 and len(chunk) == size:
+            ceiling = _chunk_ceiling.get(chain_id, MAX_CHUNK_CALLS + 1)
+            _chunk_calls[chain_id] = min(MAX_CHUNK_CALLS, size + size // 2, (size + ceiling) // 2)
+        out.extend(returns)
+        i += len(chunk)
+    return out
+
+
+def _vault_info_full(
+    chain_id: int,
+    vault_addresses: List[str],
+    block: Block = "latest",
+) -> Dict[str, _Words]:
     """
-    Batch eth_call for getVaultInfoFull on each vault.
-    Returns {lowercase_vault_address: decoded_words}.
+    getVaultInfoFull for each vault in one aggregate3 call.
+    Returns {lowercase_vault_address: words}.
     """
     lens = VAULT_LENS.get(chain_id)
     if not lens:
         raise RuntimeError(f"No VaultLens address for chain {chain_id}")
 
-    batch = []
+    _, returns = _aggregate3(chain_id, [(lens, _encode_call(v)) for v in vault_addresses], block)
+
+    results: Dict[str, _Words] = {}
+    for vault, data in zip(vault_addresses, returns):
+        if data is None:
+            raise RuntimeError(f"getVaultInfoFull reverted for vault {vault} on chain {chain_id}")
+        if len(data) < 32:
+            raise RuntimeError(f"Empty response for vault {vault} on chain {chain_id}")
+        results[vault.lower()] = _Words(data)
+    return results
+
+
+def _vault_caps(
+    chain_id: int,
+    vault_addresses: List[str],
+    block: Block = "latest",
+) -> Dict[str, Dict[str, int]]:
+    """
+    caps(), totalAssets() and totalBorrows() for each vault in one aggregate3
+    call: 4 words of return data per vault instead of the full VaultLens struct.
+    Returns {lowercase_vault_address: {total_assets, total_borrows, supply_cap, borrow_cap}}
+    with caps resolved to token amounts.
+    """
+    calls = []
+    for vault in vault_addresses:
+        calls += [(vault, _CAPS), (vault, _TOTAL_ASSETS), (vault, _TOTAL_BORROWS)]
+    _, returns = _aggregate3(chain_id, calls, block)
+
+    results: Dict[str, Dict[str, int]] = {}
     for i, vault in enumerate(vault_addresses):
-        batch.append({
-            "jsonrpc": "2.0",
-            "method": "eth_call",
-            "params": [{"to": lens, "data": _encode_call(vault)}, "latest"],
-            "id": i + 1,
-        })
+        caps, assets, borrows = returns[3 * i : 3 * i + 3]
+        if caps is None or assets is None or borrows is None:
+            raise RuntimeError(f"Cap reads reverted for vault {vault} on chain {chain_id}")
+        results[vault.lower()] = {
+            "total_assets": _uint(assets, 0),
+            "total_borrows": _uint(borrows, 0),
+            "supply_cap": _resolve_amount_cap(_uint(caps, 0)),
+            "borrow_cap": _resolve_amount_cap(_uint(caps, 32)),
+        }
+    return results
+
+
+# ── Change detection ─────────────────────────────────────────────────────────
+# Vault state only moves when a transaction touches the vault, and every
+# state change emits at least one event from the vault address. So after a
+# first full read at block B, the next cycle asks eth_getLogs for events from
+# the tracked vaults in (B, head] and re-reads only the vaults that logged
+# something, pinned at head; the rest keep their decoded values. A quiet
+# cycle costs eth_blockNumber plus one empty eth_getLogs.
+#
+# Interest accrues without events, so cached values drift slowly; a full
+# re-read is forced every FULL_REFRESH_SECONDS, and whenever the log range
+# would exceed MAX_LOG_RANGE_BLOCKS (RPCs cap it) or eth_getLogs fails.
+
+FULL_REFRESH_SECONDS = 3600
+MAX_LOG_RANGE_BLOCKS = 2000
+
+# Reads trail the head by this many blocks, so every endpoint behind a pool
+# or load-balanced proxy has almost certainly seen the block being read.
+CONFIRMATIONS = 2
+
+# One state per (chain_id, reader name), whatever vaults it is asked for:
+# vaults no longer asked for are dropped from it, and a newly listed vault
+# forces a full re-read, so the state follows the vault set as it changes.
+# (chain_id, reader name) -> {"block", "refreshed_at", "vaults", "results"}
+_last_reads: Dict[Tuple[int, str], Dict[str, Any]] = {}
+
+
+def _rpc(chain_id: int, method: str, params: list) -> Any:
+    resp = _rpc_pool(chain_id).call(
+        {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}, timeout=30
+    )
+    if "error" in resp:
+        raise RuntimeError(f"{method} error on chain {chain_id}: {resp['error']}")
+    return resp["result"]
+
+
+def _pinned(block: Dict[str, Any]) -> Dict[str, Any]:
+    """EIP-1898 block parameter: the read fails rather than landing on another block."""
+    return {"blockHash": block["hash"], "requireCanonical": True}
+
+
+def _block_with_logs(
+    chain_id: int,
+    vault_addresses: List[str],
+    from_block: Optional[int],
+    to_block: int,
+) -> Tuple[Optional[Dict[str, Any]], set]:
+    """
+    Header of `to_block` and the vaults that logged in [from_block, to_block],
+    asked in one batch so the same node answers both. A node that has not
+    seen `to_block` yet returns no header: (None, set()), and its empty logs
+    must not be trusted.
+    """
+    batch = [{"jsonrpc": "2.0", "id": 0, "method": "eth_getBlockByNumber", "params": [hex(to_block), False]}]
+    if from_block is not None:
+        batch.append({"jsonrpc": "2.0", "id": 1, "method": "eth_getLogs", "params": [{
+            "fromBlock": hex(from_block),
+            "toBlock": hex(to_block),
+            "address": vault_addresses,
+        }]})
+    by_id = {r.get("id"): r for r in _rpc_pool(chain_id).call(batch, timeout=30)}
+    for r in by_id.values():
+        if "error" in r:
+            raise RuntimeError(f"batch error on chain {chain_id}: {r['error']}")
+    block = by_id[0].get("result")
+    if block is None:
+        return None, set()
+    logs = by_id[1]["result"] if from_block is not None else []
+    return block, {log["address"].lower() for log in logs}
+
+
+def _read_changed(
+    chain_id: int,
+    vault_addresses: List[str],
+    reader: Callable[..., Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    reader(chain_id, vaults, block) results for every vault, re-reading only
+    the vaults that emitted events since the previous call for this chain and
+    reader. Every read is pinned to the hash of a block CONFIRMATIONS behind
+    the head, and state only advances to a block whose logs were actually
+    served.
+    """
+    key = (chain_id, reader.__name__)
+    wanted = {v.lower() for v in vault_addresses}
+    state = _last_reads.get(key)
+    target = int(_rpc(chain_id, "eth_blockNumber", []), 16) - CONFIRMATIONS
+    now = time.monotonic()
+
+    if state is not None and wanted <= state["vaults"]:
+        if wanted != state["vaults"]:
+            results = {v: r for v, r in state["results"].items() if v in wanted}
+            state.update(vaults=wanted, results=results)
+        if target <= state["block"]:
+            return state["results"]  # no new block (or a lagging endpoint)
+        if now - state["refreshed_at"] < FULL_REFRESH_SECONDS and target - state["block"] <= MAX_LOG_RANGE_BLOCKS:
+            try:
+                block, changed = _block_with_logs(chain_id, vault_addresses, state["block"] + 1, target)
+            except Exception:
+                block = changed = None
+            if block is None and changed is not None:
+                return state["results"]  # that node is behind; try again next cycle
+            if block is not None:
+                stale = [v for v in vault_addresses if v.lower() in changed]
+                results = dict(state["results"])
+                if stale:
+                    results.update(reader(chain_id, stale, _pinned(block)))
+                state.update(block=target, results=results)
+                return results
+
+    block, _ = _block_with_logs(chain_id, vault_addresses, None, target)
+    results = reader(chain_id, vault_addresses, _pinned(block) if block is not None else target)
+    _last_reads[key] = {"block": target, "refreshed_at": now, "vaults": wanted, "results": results}
+    return results
 
-    url = EULER_RPC_URL.format(chain_id=chain_id)
-    responses = post_json(url, json=batch, timeout=30)
-
-    results: Dict[str, List[int]] = {}
-    for resp in responses:
-        idx = resp["id"] - 1
-        if "error" in resp:
-            raise RuntimeError(
-                f"RPC error for vault {vault_addresses[idx]}: {resp['error']}"
-            )
-        result = resp.get("result", "0x")
-        if result == "0x" or len(result) < 66:
-            raise RuntimeError(
-                f"Empty response for vault {vault_addresses[idx]} on chain {chain_id}"
-            )
-        results[vault_addresses[idx].lower()] = _decode_words(result)
 
+# ── Vault discovery ──────────────────────────────────────────────────────────
+# EULER_DISCOVER="<chain_id>:<perspective>:<label>,..." follows every vault a
+# perspective contract verifies (verifiedArray()), on top of the vaults listed
+# above. Each vault that accepts collateral gets a borrow APY metric, and each
+# (collateral, debt) pair from its LTVList() gets supply/borrow cap
+# utilization metrics plus a PAIRED_CAPS entry, keyed like the hand-written
+# ones: euler:<label>:<collateral>:<debt>:supply:cap_util, where each vault is
+# <symbol>-<first six hex digits of its address>. The vault list and
+# metadata are refreshed every DISCOVERY_REFRESH_SECONDS.
+#
+# Every perspective on a chain is read in one change-detected batch. Each
+# time a perspective is discovered, its pairs replace the ones it had before,
+# and PAIRED_CAPS is rebuilt from them, so delisted pairs stop being
+# evaluated. The engine re-reads PAIRED_CAPS each cycle. In
+# ADAPTER_EXECUTION=process mode the rebuild happens in the worker process,
+# so discovered pairs get their metrics but no paired alerts.
+
+DISCOVERY_REFRESH_SECONDS = 3600
+
+# EVK's year length, the one VaultLens compounds borrowAPY over.
+SECONDS_PER_YEAR = 365.2425 * 86400
+
+
+def _parse_discovery(raw: str) -> List[Tuple[int, str, str]]:
+    out = []
+    for entry in filter(None, (e.strip() for e in raw.split(","))):
+        chain_id, perspective, label = entry.split(":")
+        out.append((int(chain_id), perspective, label))
+    return out
+
+
+DISCOVERY = _parse_discovery(os.getenv("EULER_DISCOVER", ""))
+
+# (chain_id, perspective) -> {"at": monotonic, "vaults": {vault: {"symbol", "slug", "collaterals"}}}
+_discovered: Dict[Tuple[int, str], Dict[str, Any]] = {}
+
+# (chain_id, perspective) -> the PAIRED_CAPS entries it produced last time
+_discovered_pairs: Dict[Tuple[int, str], List[Dict]] = {}
+
+
+def _discover(chain_id: int, perspective: str) -> Dict[str, Dict[str, Any]]:
+    """Vaults verified by `perspective` plus their collaterals, with asset symbols."""
+    cached = _discovered.get((chain_id, perspective))
+    if cached is not None and time.monotonic() - cached["at"] < DISCOVERY_REFRESH_SECONDS:
+        return cached["vaults"]
+
+    _, (listed,) = _aggregate3(chain_id, [(perspective, _VERIFIED_ARRAY)])
+    if listed is None:
+        raise RuntimeError(f"verifiedArray() reverted on perspective {perspective}")
+    vaults = [v.lower() for v in _abi_address_array(listed)]
+
+    returns = _aggregate3_chunked(chain_id, [(v, _LTV_LIST) for v in vaults])
+    collaterals: Dict[str, List[str]] = {}
+    for vault, r in zip(vaults, returns):
+        try:
+            collaterals[vault] = [c.lower() for c in _abi_address_array(r)] if r is not None else []
+        except ValueError as e:
+            print(f"[euler] skipping collaterals of {vault} on chain {chain_id}: {e}")
+            collaterals[vault] = []
+    everything = list(dict.fromkeys(vaults + [c for cs in collaterals.values() for c in cs]))
+
+    assets = [
+        _abi_address(r) if r is not None and len(r) >= 32 else None
+        for r in _aggregate3_chunked(chain_id, [(v, _ASSET) for v in everything])
+    ]
+    unique_assets = list(dict.fromkeys(a for a in assets if a))
+    symbols = {}
+    for a, r in zip(unique_assets, _aggregate3_chunked(chain_id, [(a, _SYMBOL) for a in unique_assets])):
+        try:
+            symbols[a] = _abi_string(r) if r is not None else a[:8]
+        except (IndexError, ValueError):
+            symbols[a] = a[:8]
+
+    # Slugs always carry the vault's address prefix, so a key never changes
+    # when another vault for the same asset shows up later.
+    info: Dict[str, Dict[str, Any]] = {}
+    for vault, asset in zip(everything, assets):
+        symbol = symbols.get(asset, vault[:8])
+        info[vault] = {
+            "symbol": symbol,
+            "slug": f"{symbol.lower()}-{vault[2:8]}",
+            "collaterals": collaterals.get(vault, []),
+        }
+
+    _discovered[(chain_id, perspective)] = {"at": time.monotonic(), "vaults": info}
+    return info
+
+
+def _spy_to_apy(spy: int) -> float:
+    return math.expm1(SECONDS_PER_YEAR * math.log1p(spy / EULER_APY_SCALE))
+
+
+def _vault_states(
+    chain_id: int,
+    vault_addresses: List[str],
+    block: Block = "latest",
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Caps, totals and borrow APY per vault, via chunked aggregate3 calls.
+    Vaults whose reads revert or come back short (not an EVK vault, say) are
+    logged and left out.
+    """
+    selectors = (_CAPS, _TOTAL_ASSETS, _TOTAL_BORROWS, _INTEREST_RATE)
+    calls = [(v, s) for v in vault_addresses for s in selectors]
+    returns = _aggregate3_chunked(chain_id, calls, block)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for i, vault in enumerate(vault_addresses):
+        caps, assets, borrows, rate = returns[4 * i : 4 * i + 4]
+        if caps is None or assets is None or borrows is None or len(caps) < 64 or len(assets) < 32 or len(borrows) < 32:
+            print(f"[euler] skipping vault {vault} on chain {chain_id}: cap reads reverted or did not decode")
+            continue
+        if rate is not None and len(rate) < 32:
+            rate = None
+        results[vault.lower()] = {
+            "total_assets": _uint(assets, 0),
+            "total_borrows": _uint(borrows, 0),
+            "supply_cap": _resolve_amount_cap(_uint(caps, 0)),
+            "borrow_cap": _resolve_amount_cap(_uint(caps, 32)),
+            "borrow_apy": _spy_to_apy(_uint(rate, 0)) if rate is not None else None,
+        }
     return results
 
 
+def _discovered_metrics(chain_id: int, perspectives: List[Tuple[str, str]]) -> List[Dict]:
+    """
+    Metrics of every (perspective, label) followed on `chain_id`. Their vaults
+    are read together, so the chain keeps one change-detection state however
+    many perspectives it follows. A perspective that cannot be discovered is
+    logged and skipped; the previous pairs it produced are kept.
+    """
+    infos = {}
+    for perspective, label in perspectives:
+        try:
+            infos[(perspective, label)] = _discover(chain_id, perspective)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"[euler] discovery on chain {chain_id} perspective {perspective} failed: {e!r}")
+
+    vaults = sorted({v for info in infos.values() for v in info})
+    states = _read_changed(chain_id, vaults, _vault_states) if vaults else {}
+
+    metrics: List[Dict] = []
+    for (perspective, label), info in infos.items():
+        perspective_metrics, pairs = _perspective_metrics(chain_id, info, states, label)
+        metrics.extend(perspective_metrics)
+        _discovered_pairs[(chain_id, perspective)] = pairs
+
+    PAIRED_CAPS[:] = SENTORA_PAIRS + list({
+        pair["supply_key"]: pair
+        for pairs in _discovered_pairs.values()
+        for pair in pairs
+    }.values())
+    return metrics
+
+
+def _perspective_metrics(
+    chain_id: int,
+    info: Dict[str, Dict[str, Any]],
+    states: Dict[str, Dict[str, Any]],
+    label: str,
+) -> Tuple[List[Dict], List[Dict]]:
+    """Rate and cap metrics of one perspective's vaults, and its pairs."""
+    market = label.title()
+
+    metrics: List[Dict] = []
+    pairs: List[Dict] = []
+    for vault, meta in info.items():
+        if not meta["collaterals"] or vault not in states:
+            continue
+        apy = states[vault]["borrow_apy"]
+        if apy is None or not 0 <= apy <= _MAX_PLAUSIBLE_APY:
+            print(f"[euler] skipping rate of vault {vault} on chain {chain_id}: borrow APY {apy} not plausible")
+        else:
+            metrics.append({
+                "key": f"euler:{label}:{meta['slug']}:borrow:rate",
+                "name": f"Euler {market} {meta['symbol']} Borrow APY",
+                "value": apy,
+                "unit": "rate",
+                "adapter": "euler",
+            })
+
+        for coll in meta["collaterals"]:
+            if coll not in states:
+                continue
+            c = info[coll]
+            pair = {
+                "asset": f"{c['slug']}:{meta['slug']}",
+                "pair_name": f"Euler {market} {c['symbol']}/{meta['symbol']}",
+                "collateral_vault_id": coll,
+                "debt_vault_id": vault,
+                "supply_key": f"euler:{label}:{c['slug']}:{meta['slug']}:supply:cap_util",
+                "borrow_key": f"euler:{label}:{c['slug']}:{meta['slug']}:borrow:cap_util",
+                "name_supply": f"Euler {market} {c['symbol']}/{meta['symbol']} Supply Cap Utilization",
+                "name_borrow": f"Euler {market} {c['symbol']}/{meta['symbol']} Borrow Cap Utilization",
+                "adapter": "euler",
+            }
+            try:
+                supply_ratio = _supply_cap_ratio(states[coll])
+                borrow_ratio = _borrow_cap_ratio(states[vault])
+            except RuntimeError as e:
+                print(f"[euler] skipping pair {pair['asset']} on chain {chain_id}: {e}")
+                continue
+            pairs.append(pair)
+            metrics.append({
+                "key": pair["supply_key"],
+                "name": pair["name_supply"],
+                "value": supply_ratio,
+                "unit": "ratio",
+                "adapter": "euler",
+            })
+            metrics.append({
+                "key": pair["borrow_key"],
+                "name": pair["name_borrow"],
+                "value": borrow_ratio,
+                "unit": "ratio",
+                "adapter": "euler",
+            })
+    return metrics, pairs
+
+
 # ── Field extractors ─────────────────────────────────────────────────────────
 
-def _borrow_apy(words: List[int]) -> float:
+def _borrow_apy(words: _Words) -> float:
     """
     Navigate VaultInfoFull → irmInfo → interestRateInfo[0].borrowAPY.
 
@@ -246,12 +821,12 @@ def _cap_ratio(used: int, cap: int, label: str) -> float:
     return min(raw, 1.0)
 
 
-def _supply_cap_ratio(words: List[int]) -> float:
-    return _cap_ratio(words[_W_TOTAL_ASSETS], words[_W_SUPPLY_CAP], "supply")
+def _supply_cap_ratio(vault: Dict[str, int]) -> float:
+    return _cap_ratio(vault["total_assets"], vault["supply_cap"], "supply")
 
 
-def _borrow_cap_ratio(words: List[int]) -> float:
-    return _cap_ratio(words[_W_TOTAL_BORROWED], words[_W_BORROW_CAP], "borrow")
+def _borrow_cap_ratio(vault: Dict[str, int]) -> float:
+    return _cap_ratio(vault["total_borrows"], vault["borrow_cap"], "borrow")
 
 
 # ── Public fetch ─────────────────────────────────────────────────────────────
@@ -262,13 +837,15 @@ def fetch() -> List[Dict]:
     - USDC borrow APY (Avalanche, 9Summits market)
     - USDC borrow APY (Avalanche, Turtle market)
     - Sentora paired cap utilization (Ethereum)
+    - Rates and paired caps of vaults discovered via EULER_DISCOVER
     """
     metrics: List[Dict] = []
 
     # ── Avalanche: borrow APY for 9Summits + Turtle USDC vaults ──────────
-    avax_vaults = _rpc_batch(
+    avax_vaults = _read_changed(
         AVALANCHE_CHAIN_ID,
         [NINESUMMITS_USDC_VAULT_ID, TURTLE_USDC_VAULT_ID],
+        _vault_info_full,
     )
 
     ninesummits_words = avax_vaults[NINESUMMITS_USDC_VAULT_ID.lower()]
@@ -292,28 +869,42 @@ def fetch() -> List[Dict]:
     # ── Ethereum: Sentora paired cap metrics ─────────────────────────────
     unique_vault_ids = list({
         vid
-        for pair in PAIRED_CAPS
+        for pair in SENTORA_PAIRS
         for vid in (pair["collateral_vault_id"], pair["debt_vault_id"])
     })
-    eth_vaults = _rpc_batch(ETHEREUM_CHAIN_ID, unique_vault_ids)
+    eth_vaults = _read_changed(ETHEREUM_CHAIN_ID, unique_vault_ids, _vault_caps)
 
-    for pair in PAIRED_CAPS:
-        coll_words = eth_vaults[pair["collateral_vault_id"].lower()]
-        debt_words = eth_vaults[pair["debt_vault_id"].lower()]
+    for pair in SENTORA_PAIRS:
+        coll = eth_vaults[pair["collateral_vault_id"].lower()]
+        debt = eth_vaults[pair["debt_vault_id"].lower()]
 
         metrics.append({
             "key": pair["supply_key"],
             "name": pair["name_supply"],
-            "value": _supply_cap_ratio(coll_words),
+            "value": _supply_cap_ratio(coll),
             "unit": "ratio",
             "adapter": "euler",
         })
         metrics.append({
             "key": pair["borrow_key"],
             "name": pair["name_borrow"],
-            "value": _borrow_cap_ratio(debt_words),
+            "value": _borrow_cap_ratio(debt),
             "unit": "ratio",
             "adapter": "euler",
         })
 
+    # ── Discovered vaults (EULER_DISCOVER) ───────────────────────────────
+    # Discovery is best effort: a chain whose vaults cannot be read is logged
+    # and skipped rather than failing the hand-listed metrics above.
+    by_chain: Dict[int, List[Tuple[str, str]]] = {}
+    for chain_id, perspective, label in DISCOVERY:
+        by_chain.setdefault(chain_id, []).append((perspective, label))
+    for chain_id, perspectives in by_chain.items():
+        try:
+            metrics.extend(_discovered_metrics(chain_id, perspectives))
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            print(f"[euler] discovery on chain {chain_id} failed: {e!r}")
+
     return metrics
@@ -1,8 +1,12 @@
 import base64
 import os
-from datetime import datetime, timedelta, timezone
+import struct
+import time
+from typing import Optional
 
-from httputil import get_json, post_json
+from httputil import configure_host
+from rpcpool import RpcPool, endpoints_from_env
+from solstream import ws_url
 
 
 # Kamino Ethena Market and its reserves.
@@ -16,115 +20,340 @@ RESERVES = {
     "EDf6dGbVnCCABbNhE3mp5i1jV2JhDAVmTWb1ztij1Yhs": "PYUSD",
 }
 
-LIVE_URL = f"https://api.kamino.finance/kamino-market/{MARKET}/reserves/metrics"
+PUBLIC_SOLANA_RPC_URL = "https://api.mainnet-beta.solana.com"
+SOLANA_RPC_URL = os.getenv("SOLANA_RPC_URL", PUBLIC_SOLANA_RPC_URL)
 
-SOLANA_RPC_URL = os.getenv("SOLANA_RPC_URL", "https://api.mainnet-beta.solana.com")
+# The public RPC allows 40 requests per 10s per IP for any single method.
+# Other endpoints are left to adaptive limiting.
+configure_host(PUBLIC_SOLANA_RPC_URL, rate=4, burst=10)
 
-# Byte offset of ReserveConfig.utilizationLimitBlockBorrowingAbovePct (u8, a
-# percent; 0 means no limit) into the klend Reserve account data, including the
-# 8-byte Anchor discriminator. Derived from the klend IDL
-# (Kamino-Finance/klend-sdk src/idl/klend.json: ReserveConfig sits at +4848,
-# the field at +645 within it) and validated on-chain on 2026-06-03: the
-# borrowLimit at the adjacent computed offset read back the governance cap
-# exactly. The field is followed by large reserved padding, so existing offsets
-# hold across program upgrades (new fields land in padding).
-_UTIL_LIMIT_OFFSET = 5501
+# SOLANA_RPC_URLS (comma-separated) lists interchangeable endpoints; calls go
+# to the fastest and are hedged to the next one (see rpcpool.py).
+SOLANA_RPC_URLS = endpoints_from_env("SOLANA_RPC_URLS", [SOLANA_RPC_URL])
+_RPC = RpcPool(SOLANA_RPC_URLS)
 
+# klend Reserve account layout. Offsets are into the account data, including
+# the 8-byte Anchor discriminator, and follow the klend IDL (Kamino-Finance/
+# klend-sdk src/idl/klend.json): ReserveLiquidity starts at 128 and
+# ReserveConfig at 8 + 4848. The utilization limit offset was validated
+# on-chain on 2026-06-03, where the borrowLimit at its computed offset read
+# back the governance cap exactly. Each struct is followed by large reserved
+# padding, so these offsets hold across program upgrades (new fields land in
+# padding).
+_AVAILABLE_AMOUNT_OFFSET = 224            # liquidity.availableAmount, u64
+_BORROWED_AMOUNT_SF_OFFSET = 232          # liquidity.borrowedAmountSf, u128 with 60 fractional bits
+_MINT_DECIMALS_OFFSET = 272               # liquidity.mintDecimals, u64
+_PROTOCOL_FEES_SF_OFFSET = 344            # liquidity.accumulatedProtocolFeesSf, u128
+_REFERRER_FEES_SF_OFFSET = 360            # liquidity.accumulatedReferrerFeesSf, u128
+_PENDING_REFERRER_FEES_SF_OFFSET = 376    # liquidity.pendingReferrerFeesSf, u128
+_STATUS_OFFSET = 4856                     # config.status, u8: 0 active, 1 obsolete, 2 hidden
+_DEPOSIT_LIMIT_OFFSET = 5016              # config.depositLimit, u64
+_BORROW_LIMIT_OFFSET = 5024               # config.borrowLimit, u64
+_TOKEN_NAME_OFFSET = 5032                 # config.tokenInfo.name, [u8; 32], NUL-padded
+_UTIL_LIMIT_OFFSET = 5501                 # config.utilizationLimitBlockBorrowingAbovePct, u8 percent; 0 = none
 
-def _history_url(reserve: str) -> str:
-    return (
-        f"https://api.kamino.finance/kamino-market/{MARKET}"
-        f"/reserves/{reserve}/metrics/history"
-    )
+_SF_SCALE = 2 ** 60
 
+# getMultipleAccounts takes one dataSlice for every account and at most 100
+# accounts per call. The slice spans every field above, so one read per
+# reserve covers the whole computation.
+_RESERVE_SLICE_OFFSET = _AVAILABLE_AMOUNT_OFFSET
+_RESERVE_SLICE_LENGTH = _UTIL_LIMIT_OFFSET + 1 - _RESERVE_SLICE_OFFSET
+MAX_ACCOUNTS_PER_CALL = 100
 
-def _iso(dt: datetime) -> str:
-    return dt.isoformat().replace("+00:00", "Z")
 
+def _layout(fields: list[tuple[str, int, str]]) -> struct.Struct:
+    """A little-endian struct over the reserve slice, padding between `fields`."""
+    fmt, at = "<", _RESERVE_SLICE_OFFSET
+    for _, offset, code in fields:
+        fmt += (f"{offset - at}x" if offset > at else "") + code
+        at = offset + struct.calcsize("<" + code)
+    end = _RESERVE_SLICE_OFFSET + _RESERVE_SLICE_LENGTH
+    return struct.Struct(fmt + (f"{end - at}x" if end > at else ""))
 
-def _fetch_history_metrics(reserve: str, symbol: str) -> dict:
+
+# u128 fields unpack as two u64 halves, low first.
+_RESERVE_FIELDS = [
+    ("available", _AVAILABLE_AMOUNT_OFFSET, "Q"),
+    ("borrowed_sf", _BORROWED_AMOUNT_SF_OFFSET, "QQ"),
+    ("decimals", _MINT_DECIMALS_OFFSET, "Q"),
+    ("protocol_fees_sf", _PROTOCOL_FEES_SF_OFFSET, "QQ"),
+    ("referrer_fees_sf", _REFERRER_FEES_SF_OFFSET, "QQ"),
+    ("pending_referrer_fees_sf", _PENDING_REFERRER_FEES_SF_OFFSET, "QQ"),
+    ("status", _STATUS_OFFSET, "B"),
+    ("deposit_limit", _DEPOSIT_LIMIT_OFFSET, "Q"),
+    ("borrow_limit", _BORROW_LIMIT_OFFSET, "Q"),
+    ("name", _TOKEN_NAME_OFFSET, "32s"),
+    ("util_limit_pct", _UTIL_LIMIT_OFFSET, "B"),
+]
+_RESERVE_LAYOUT = _layout(_RESERVE_FIELDS)
+
+
+def _fetch_reserve_slices(reserves: list[str]) -> dict[str, bytes]:
+    """
+    The reserve-account bytes in [_RESERVE_SLICE_OFFSET, +_RESERVE_SLICE_LENGTH)
+    for every reserve, in one getMultipleAccounts call per 100 reserves.
+    """
+    slices = {}
+    for i in range(0, len(reserves), MAX_ACCOUNTS_PER_CALL):
+        chunk = reserves[i : i + MAX_ACCOUNTS_PER_CALL]
+        payload = {
+            "jsonrpc": "2.0",
+            "id": 1,
+            "method": "getMultipleAccounts",
+            "params": [
+                chunk,
+                {
+                    "encoding": "base64",
+                    "dataSlice": {"offset": _RESERVE_SLICE_OFFSET, "length": _RESERVE_SLICE_LENGTH},
+                },
+            ],
+        }
+        resp = _RPC.call(payload, timeout=15)
+        values = (resp.get("result") or {}).get("value") or []
+        if len(values) != len(chunk):
+            raise RuntimeError(f"Kamino getMultipleAccounts returned {len(values)} of {len(chunk)} reserves")
+        for reserve, value in zip(chunk, values):
+            if not value:
+                raise RuntimeError(f"Kamino reserve {reserve} not found on-chain")
+            slices[reserve] = base64.b64decode(value["data"][0])
+    return slices
+
+
+def _unpack_reserves(slices: list[bytes]) -> list[dict]:
+    """
+    The raw on-chain fields of each reserve slice, named as in _RESERVE_FIELDS
+    with u128 halves joined. All slices are unpacked in one pass over a joined
+    buffer.
+    """
+    for data in slices:
+        if len(data) < _RESERVE_SLICE_LENGTH:
+            raise RuntimeError(f"Kamino reserve slice is {len(data)} bytes, expected {_RESERVE_SLICE_LENGTH}")
+    buffer = b"".join(data[:_RESERVE_SLICE_LENGTH] for data in slices)
+
+    out = []
+    for values in _RESERVE_LAYOUT.iter_unpack(buffer):
+        raw, at = {}, 0
+        for name, _, code in _RESERVE_FIELDS:
+            if code == "QQ":
+                raw[name] = values[at] | values[at + 1] << 64
+                at += 2
+            else:
+                raw[name] = values[at]
+                at += 1
+        out.append(raw)
+    return out
+
+
+def _implausible(raw: dict) -> Optional[str]:
+    """Why a reserve's raw fields look misread, or None if they look sane."""
+    if raw["decimals"] > 18:
+        return f"mint decimals {raw['decimals']} implausible; layout may have changed"
+    if raw["util_limit_pct"] > 100:
+        return f"utilization limit {raw['util_limit_pct']}% implausible; layout may have changed"
+    return None
+
+
+def _scaled(raw: dict) -> dict:
     """
-    History endpoint is the only source for reserveBorrowLimit (cap).
-    Cap changes only via governance, so an hourly sample is plenty.
+    The fields borrowable liquidity depends on, in token units. total_supply
+    matches the API's totalSupply: liquidity in the vault plus borrows, minus
+    fees owed to the protocol and referrers.
     """
-    now = datetime.now(timezone.utc)
-    params = {
-        "frequency": "hour",
-        "start": _iso(now - timedelta(hours=3)),
-        "end": _iso(now),
+    scale = 10 ** raw["decimals"]
+    sf_scale = _SF_SCALE * scale
+    borrows = raw["borrowed_sf"] / sf_scale
+    fees = (raw["protocol_fees_sf"] + raw["referrer_fees_sf"] + raw["pending_referrer_fees_sf"]) / sf_scale
+    return {
+        "symbol": raw["name"].rstrip(b"\0").decode("utf-8", "replace"),
+        "status": raw["status"],
+        "decimals": raw["decimals"],
+        "available": raw["available"] / scale,
+        "total_borrows": borrows,
+        "total_supply": raw["available"] / scale + borrows - fees,
+        "deposit_limit": raw["deposit_limit"] / scale,
+        "borrow_limit": raw["borrow_limit"] / scale,
+        "util_limit_pct": raw["util_limit_pct"],
     }
-    payload = get_json(_history_url(reserve), params=params, timeout=15)
-    history = payload.get("history") or []
-    if not history:
-        raise RuntimeError(f"Kamino {symbol} history empty")
-    return history[-1]["metrics"]
 
 
-def _fetch_live_reserves() -> dict:
-    reserves = get_json(LIVE_URL, timeout=15)
-    return {r.get("reserve"): r for r in reserves}
+def _decode_reserves(slices: dict[str, bytes]) -> dict[str, dict]:
+    """
+    The active reserves among `slices`, decoded. Status and plausibility are
+    checked on the raw fields before anything is scaled: retired reserves may
+    hold anything, and decimals read from a shifted layout can be any u64,
+    which 10 ** decimals would never finish computing. An implausible active
+    reserve is logged and skipped instead of failing the whole market.
+    """
+    out = {}
+    for reserve, raw in zip(slices, _unpack_reserves(list(slices.values()))):
+        if raw["status"] != 0:
+            continue
+        problem = _implausible(raw)
+        if problem:
+            print(f"[kamino] skipping reserve {reserve}: {problem}")
+            continue
+        out[reserve] = _scaled(raw)
+    return out
+
+
+# ── Market discovery ─────────────────────────────────────────────────────────
+# KAMINO_MARKETS="<market pubkey>:<label>,..." tracks every active reserve in
+# each listed klend market, found with getProgramAccounts filtered on the
+# Reserve account size and its lendingMarket field. The reserve set is cached
+# for DISCOVERY_TTL_SECONDS; in between, the cached reserves are re-read with
+# getMultipleAccounts. Metric keys follow the hand-picked ones above, with the
+# first four characters of the reserve pubkey appended to the symbol:
+# kamino:<label>:<symbol>-<pubkey prefix>:borrow:available. Reserves in RESERVES are skipped
+# when their market is also being discovered.
+
+KLEND_PROGRAM_ID = "KLend2g3cP87fffoy8q1mQqGKjrxjC8boSyAYavgmjD"
+RESERVE_ACCOUNT_SIZE = 8624
+_LENDING_MARKET_OFFSET = 32               # lendingMarket, Pubkey
+
+DISCOVERY_TTL_SECONDS = 3600
 
 
-def _fetch_util_limit_pct(reserve: str, symbol: str) -> int:
+def _parse_markets(raw: str) -> dict[str, str]:
+    out = {}
+    for entry in filter(None, (e.strip() for e in raw.split(","))):
+        market, label = entry.split(":")
+        out[market] = label
+    return out
+
+
+MARKETS = _parse_markets(os.getenv("KAMINO_MARKETS", ""))
+
+# market -> {"at": monotonic, "reserves": [pubkey, ...]}
+_discovered: dict[str, dict] = {}
+
+
+def _discover_market(market: str) -> tuple[list[str], dict[str, bytes]]:
     """
-    Read utilizationLimitBlockBorrowingAbovePct from the on-chain reserve.
-    The UI's "Liq. Available" caps borrows at this percent of deposits, and the
-    metrics API does not expose it. 0 means no limit.
+    Reserve pubkeys in `market`, cached for DISCOVERY_TTL_SECONDS. Returns the
+    slices getProgramAccounts already read alongside, or {} on a cache hit.
     """
+    cached = _discovered.get(market)
+    if cached is not None and time.monotonic() - cached["at"] < DISCOVERY_TTL_SECONDS:
+        return cached["reserves"], {}
+
     payload = {
         "jsonrpc": "2.0",
         "id": 1,
-        "method": "getAccountInfo",
+        "method": "getProgramAccounts",
         "params": [
-            reserve,
-            {"encoding": "base64", "dataSlice": {"offset": _UTIL_LIMIT_OFFSET, "length": 1}},
+            KLEND_PROGRAM_ID,
+            {
+                "encoding": "base64",
+                "dataSlice": {"offset": _RESERVE_SLICE_OFFSET, "length": _RESERVE_SLICE_LENGTH},
+                "filters": [
+                    {"dataSize": RESERVE_ACCOUNT_SIZE},
+                    {"memcmp": {"offset": _LENDING_MARKET_OFFSET, "bytes": market}},
+                ],
+            },
         ],
     }
-    resp = post_json(SOLANA_RPC_URL, json=payload, timeout=15)
-    value = (resp.get("result") or {}).get("value")
-    if not value:
-        raise RuntimeError(f"Kamino {symbol} reserve account not found on-chain")
-    return base64.b64decode(value["data"][0])[0]
-
-
-def _borrowable(reserve: str, symbol: str, live_by_reserve: dict) -> float:
-    hist = _fetch_history_metrics(reserve, symbol)
-    decimals = int(hist["decimals"])
-    cap = int(hist["reserveBorrowLimit"]) / 10 ** decimals
-
-    live = live_by_reserve.get(reserve)
-    if live is None:
-        raise RuntimeError(f"Kamino {symbol} reserve not found in live metrics")
-    total_supply = float(live["totalSupply"])
-    total_borrows = float(live["totalBorrow"])
-    # totalSupply - totalBorrow underestimates on-chain liquidity by
-    # accumulatedProtocolFees (~5 figures on a ~$250M reserve), which
-    # is immaterial: the cap is the binding constraint in normal state.
-    on_chain = max(0.0, total_supply - total_borrows)
-
-    constraints = [on_chain, cap - total_borrows]
-    # Borrowing is blocked above util_pct% of deposits, so the headroom this
-    # leaves is its own constraint (binds before the cap on PYUSD).
-    util_pct = _fetch_util_limit_pct(reserve, symbol)
-    if util_pct:
-        constraints.append(util_pct / 100.0 * total_supply - total_borrows)
+    resp = _RPC.call(payload, timeout=30)
+    accounts = resp.get("result")
+    if not accounts:
+        raise RuntimeError(f"Kamino market {market} has no reserves on-chain")
+
+    slices = {a["pubkey"]: base64.b64decode(a["account"]["data"][0]) for a in accounts}
+    reserves = sorted(slices)
+    _discovered[market] = {"at": time.monotonic(), "reserves": reserves}
+    return reserves, slices
+
+
+def _market_metrics(market: str, label: str) -> list[dict]:
+    reserves, slices = _discover_market(market)
+    if not slices:
+        slices = _fetch_reserve_slices(reserves)
+    decoded = _decode_reserves({r: slices[r] for r in reserves})
 
+    market_name = label.title()
+
+    metrics = []
+    for reserve, data in decoded.items():
+        # A market can list several reserves for one token, so the pubkey
+        # prefix is always part of the key; it stays put when one is added.
+        slug = f"{data['symbol'].lower() or reserve[:6].lower()}-{reserve[:4].lower()}"
+        _tracked[reserve] = (
+            f"kamino:{label}:{slug}:borrow:available",
+            f"Kamino {market_name} {data['symbol'] or reserve[:6]} Borrowable",
+        )
+        metrics.append(_metric(reserve, data))
+    return metrics
+
+
+def _borrowable(reserve: dict) -> float:
+    # Borrows are bounded by the liquidity in the vault, by the governance
+    # borrow cap, and (when set) by blocking borrows above util_limit_pct% of
+    # deposits, which binds before the cap on PYUSD.
+    total_supply = reserve["total_supply"]
+    total_borrows = reserve["total_borrows"]
+    constraints = [reserve["available"], reserve["borrow_limit"] - total_borrows]
+    if reserve["util_limit_pct"]:
+        constraints.append(reserve["util_limit_pct"] / 100.0 * total_supply - total_borrows)
     return max(0.0, min(constraints))
 
 
-def fetch() -> list[dict]:
-    live_by_reserve = _fetch_live_reserves()
+# reserve pubkey -> (metric key, metric name), for every reserve fetch() has
+# reported on. Streaming maps account updates back to metrics through this.
+_tracked: dict[str, tuple[str, str]] = {}
+
 
+def _metric(reserve: str, data: dict) -> dict:
+    key, name = _tracked[reserve]
+    return {
+        "key": key,
+        "name": name,
+        "value": _borrowable(data),
+        "unit": "available",
+        "adapter": "kamino",
+    }
+
+
+def fetch() -> list[dict]:
     metrics = []
-    for reserve, symbol in RESERVES.items():
-        borrowable = _borrowable(reserve, symbol, live_by_reserve)
-        metrics.append(
-            {
-                "key": f"kamino:ethena:{symbol.lower()}:borrow:available",
-                "name": f"Kamino Ethena {symbol} Borrowable",
-                "value": borrowable,
-                "unit": "available",
-                "adapter": "kamino",
-            }
+    for market, label in MARKETS.items():
+        metrics.extend(_market_metrics(market, label))
+
+    # Hand-picked reserves, unless their market is discovered above. They are
+    # reported by the same rule as discovered ones, here and when streamed:
+    # only while active and plausibly decoded.
+    hand_picked = {} if MARKET in MARKETS else RESERVES
+    decoded = _decode_reserves(_fetch_reserve_slices(list(hand_picked)))
+    for reserve, symbol in hand_picked.items():
+        _tracked[reserve] = (
+            f"kamino:ethena:{symbol.lower()}:borrow:available",
+            f"Kamino Ethena {symbol} Borrowable",
         )
+        if reserve in decoded:
+            metrics.append(_metric(reserve, decoded[reserve]))
     return metrics
+
+
+# ── Streaming ────────────────────────────────────────────────────────────────
+# KAMINO_STREAM=1 replaces polling with accountSubscribe on every tracked
+# reserve (see solstream.py): the engine stops scheduling this adapter and the
+# bot feeds decoded updates to engine.ingest. Each (re)connect first runs a
+# normal fetch() cycle, which refreshes the reserve set and covers anything
+# missed while disconnected; so does every STREAM_REFRESH_SECONDS while
+# connected, picking up reserves discovered since.
+
+STREAMING = os.getenv("KAMINO_STREAM", "0") == "1"
+STREAM_URL = os.getenv("SOLANA_WS_URL", ws_url(SOLANA_RPC_URLS[0]))
+STREAM_DEBOUNCE_SECONDS = float(os.getenv("KAMINO_STREAM_DEBOUNCE_SECONDS", "2"))
+# How often the tracked reserve set is refreshed while the socket stays up.
+STREAM_REFRESH_SECONDS = DISCOVERY_TTL_SECONDS
+
+
+def stream_accounts() -> list[str]:
+    """Reserve accounts to subscribe to; populated by the last fetch()."""
+    return list(_tracked)
+
+
+def metrics_from_accounts(updates: dict[str, bytes]) -> list[dict]:
+    """Metrics for pushed reserve accounts (full account data, not slices)."""
+    decoded = _decode_reserves({r: data[_RESERVE_SLICE_OFFSET:] for r, data in updates.items() if r in _tracked})
+    return [_metric(reserve, data) for reserve, data in decoded.items()]
@@ -0,0 +1,100 @@
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import db
+
+
+# Awaitable wrappers over db.py for coroutines on the Discord event loop.
+#
+# Every call runs on a small dedicated executor, never on the loop thread and
+# never on asyncio's shared default executor (which run_once also uses). At
+# most MAX_PENDING calls are queued; further callers wait asynchronously for
+# a slot instead of piling unbounded work onto the executor.
+
+DB_WORKERS = 2
+MAX_PENDING = 32
+
+logger = logging.getLogger("stonks")
+
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+_slots = asyncio.Semaphore(MAX_PENDING)
+
+
+async def _run(fn: Callable, *args, **kwargs) -> Any:
+    async with _slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(fn, *args, **kwargs))
+
+
+async def init_db():
+    await _run(db.init_db)
+
+
+async def list_metrics() -> List[Dict]:
+    return await _run(db.list_metrics)
+
+
+async def add_subscription(user_id: int, metric_key: str) -> bool:
+    return await _run(db.add_subscription, user_id, metric_key)
+
+
+async def remove_subscription(user_id: int, metric_key: str) -> bool:
+    return await _run(db.remove_subscription, user_id, metric_key)
+
+
+async def list_subscriptions(user_id: int) -> List[str]:
+    return await _run(db.list_subscriptions, user_id)
+
+
+class LoopLagMonitor:
+    """
+    Measures how long the event loop is blocked.
+
+    A coroutine sleeps for `tick` seconds at a time; anything beyond that
+    before it wakes is time the loop spent running something else without
+    yielding. Stats cover the window since the last report and are logged
+    every `report_every` seconds; single stalls over `warn_over` are logged
+    as they happen.
+    """
+
+    def __init__(self, tick: float = 0.1, report_every: float = 60.0, warn_over: float = 0.25):
+        self.tick = tick
+        self.report_every = report_every
+        self.warn_over = warn_over
+        self._reset()
+
+    def _reset(self):
+        self.ticks = 0
+        self.blocked = 0.0
+        self.max_lag = 0.0
+
+    def record(self, lag: float):
+        self.ticks += 1
+        self.blocked += lag
+        self.max_lag = max(self.max_lag, lag)
+        if lag > self.warn_over:
+            logger.warning("Event loop blocked for %.0f ms", lag * 1000)
+
+    def snapshot(self) -> Dict[str, float]:
+        return {"ticks": self.ticks, "blocked": self.blocked, "max_lag": self.max_lag}
+
+    async def run(self, stop: Optional[asyncio.Event] = None):
+        window_start = time.perf_counter()
+        while stop is None or not stop.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(self.tick)
+            self.record(max(0.0, time.perf_counter() - start - self.tick))
+
+            if time.perf_counter() - window_start >= self.report_every:
+                logger.info(
+                    "Event loop lag over %.0fs: blocked %.0f ms total, worst %.0f ms",
+                    self.report_every,
+                    self.blocked * 1000,
+                    self.max_lag * 1000,
+                )
+                self._reset()
+                window_start = time.perf_counter()
@@ -12,18 +12,16 @@ from engine import (
     AVAILABLE_DEPLETION_THRESHOLD,
     AVAILABLE_TIERS,
     DEFAULT_INTERVAL_SECONDS,
-    MIN_INTERVAL_SECONDS,
+    SCHEDULER,
     adapter_intervals,
+    ingest,
+    prewarm_connections,
     run_once,
+    streaming_adapters,
 )
-from db import (
-    list_metrics,
-    add_subscription,
-    remove_subscription,
-    list_subscriptions,
-    subscriptions_for_metric,
-    init_db
-)
+from db import subscriptions_for_metric
+from solstream import AccountStream
+import asyncdb
 
 
 logging.basicConfig(
@@ -34,10 +32,6 @@ logging.basicConfig(
 logger = logging.getLogger("stonks")
 
 
-# Loop ticks at the fastest adapter's cadence; the engine itself decides which
-# adapters are actually due on each tick (see engine._adapter_interval).
-ALERT_INTERVAL_SECONDS = MIN_INTERVAL_SECONDS
-
 load_dotenv()
 
 TOKEN = os.getenv("DISCORD_TOKEN")
@@ -88,11 +82,27 @@ bot = commands.Bot(
 )
 
 
+# Logs how long the event loop is blocked; see asyncdb.LoopLagMonitor.
+loop_lag = asyncdb.LoopLagMonitor()
+_loop_lag_task = None
+
+
 @bot.event
 async def on_ready():
+    global _loop_lag_task
     logger.info(f"Logged in as {bot.user}")
-    init_db()
-    alert_loop.start()
+    await asyncdb.init_db()
+    if _loop_lag_task is None:
+        _loop_lag_task = asyncio.create_task(loop_lag.run())
+    if not alert_loop.is_running():
+        try:
+            await asyncio.to_thread(prewarm_connections)
+        except Exception:
+            logger.exception("Connection prewarm failed")
+        alert_loop.start()
+        for name in streaming_adapters():
+            task = asyncio.create_task(stream_adapter(name))
+            _stream_tasks.add(task)
 
 
 @bot.event
@@ -113,6 +123,7 @@ def subscriber_mentions(alert: dict) -> str:
     """
     Build a mention string for users subscribed to this metric.
     Mentions are added to the alert message in-channel (no DMs needed).
+    Served from db's in-memory subscription index, so safe on the event loop.
     """
     metric_key = alert.get("metric_key")
     if not metric_key:
@@ -154,17 +165,74 @@ async def dm_engine_error(message: str = None) -> None:
         logger.exception("Failed to DM engine error notification")
 
 
-@tasks.loop(seconds=ALERT_INTERVAL_SECONDS)
+# Cycles started by alert_loop that are still running. Held here so the
+# event loop keeps a strong reference to each task until it finishes.
+_cycle_tasks: set = set()
+
+
+@tasks.loop()
 async def alert_loop():
+    """
+    Sleep until the next adapter is due, then start a cycle for everything
+    due without waiting for it, so a slow adapter never delays another's slot.
+    """
     await bot.wait_until_ready()
 
+    await asyncio.sleep(SCHEDULER.seconds_until_next())
+    names = SCHEDULER.pop_due()
+    if not names:
+        return
+
+    task = asyncio.create_task(run_cycle(names))
+    _cycle_tasks.add(task)
+    task.add_done_callback(_cycle_tasks.discard)
+
+
+async def run_cycle(names: list):
     try:
-        alerts = await asyncio.to_thread(run_once)
+        alerts = await asyncio.to_thread(run_once, names)
     except Exception as _:
         logger.exception("Engine error")
         await dm_engine_error()
         return
 
+    await send_alerts(alerts)
+
+
+# Streaming adapters (module-level STREAMING) are never scheduled. Each gets a
+# long-lived AccountStream instead; see solstream.py. Held here for the same
+# reason as _cycle_tasks.
+_stream_tasks: set = set()
+
+
+async def stream_adapter(name: str):
+    mod = ADAPTERS[name]
+
+    async def accounts():
+        # A full fetch on every (re)connect and refresh updates the tracked
+        # accounts and covers whatever changed while the socket was down.
+        metrics = await asyncio.to_thread(mod.fetch)
+        await send_alerts(await asyncio.to_thread(ingest, name, metrics))
+        return mod.stream_accounts()
+
+    def evaluate(updates: dict) -> list:
+        return ingest(name, mod.metrics_from_accounts(updates))
+
+    async def on_update(updates: dict):
+        # Decoding is as much off-loop work as evaluating: one thread hop for both.
+        await send_alerts(await asyncio.to_thread(evaluate, updates))
+
+    stream = AccountStream(
+        mod.STREAM_URL,
+        accounts,
+        on_update,
+        debounce=mod.STREAM_DEBOUNCE_SECONDS,
+        refresh=getattr(mod, "STREAM_REFRESH_SECONDS", None),
+    )
+    await stream.run()
+
+
+async def send_alerts(alerts: list):
     for alert in alerts:
         if alert.get("category") == "engine":
             await dm_engine_error(message=alert.get("value"))
@@ -230,6 +298,9 @@ def _cadence_text() -> str:
     if overrides:
         lines.append("Custom cadence:")
         lines.extend(f"- {name}: every {_format_interval(secs)}" for name, secs in overrides)
+    streaming = streaming_adapters()
+    if streaming:
+        lines.append(f"Live (streamed, not polled): {', '.join(streaming)}")
     return "\n".join(lines)
 
 
@@ -266,7 +337,7 @@ async def info(ctx):
 @bot.command(name="toys")
 async def toys(ctx):
     metrics = [
-        m for m in list_metrics()
+        m for m in await asyncdb.list_metrics()
         if not m["key"].endswith(":anchor")
     ]
 
@@ -297,7 +368,7 @@ async def toys(ctx):
 async def subscribe(ctx, metric_key: str):
     metrics = {
         m["key"]
-        for m in list_metrics()
+        for m in await asyncdb.list_metrics()
         if not m["key"].endswith(":anchor")
     }
 
@@ -307,7 +378,7 @@ async def subscribe(ctx, metric_key: str):
         )
         return
 
-    created = add_subscription(ctx.author.id, metric_key)
+    created = await asyncdb.add_subscription(ctx.author.id, metric_key)
     if created:
         await ctx.send(
             f"Subscribed to `{metric_key}`. I'll tag you in-channel when this yarn ball moves."
@@ -320,7 +391,7 @@ async def subscribe(ctx, metric_key: str):
 async def unsubscribe(ctx, metric_key: str):
     metrics = {
         m["key"]
-        for m in list_metrics()
+        for m in await asyncdb.list_metrics()
         if not m["key"].endswith(":anchor")
     }
 
@@ -330,7 +401,7 @@ async def unsubscribe(ctx, metric_key: str):
         )
         return
 
-    removed = remove_subscription(ctx.author.id, metric_key)
+    removed = await asyncdb.remove_subscription(ctx.author.id, metric_key)
     if removed:
         await ctx.send(
             f"Unsubscribed from `{metric_key}`. I'll stop batting you when this moves."
@@ -341,10 +412,10 @@ async def unsubscribe(ctx, metric_key: str):
 
 @bot.command(name="mytoys", aliases=["subs"])
 async def mytoys(ctx):
+    subscribed = set(await asyncdb.list_subscriptions(ctx.author.id))
     subs = [
-        m for m in list_metrics()
-        if not m["key"].endswith(":anchor")
-        and m["key"] in set(list_subscriptions(ctx.author.id))
+        m for m in await asyncdb.list_metrics()
+        if m["key"] in subscribed
     ]
     if not subs:
         await ctx.send("You aren't stalking any toys yet. Use `$sub <key>` to get tagged.")
@@ -1,19 +1,190 @@
+import os
+import queue
 import sqlite3
 import time
+from contextlib import contextmanager
 from threading import Lock
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Iterable, Iterator, Set, Tuple
 
 
 _DB_FILE = "state.db"
 _LOCK = Lock()
 
+# Connection tuning. WAL lets readers run alongside the single writer, and
+# synchronous=NORMAL only fsyncs at checkpoints (a power cut can drop the last
+# few commits, never corrupt the file). Negative cache_size is in KiB.
+_READ_POOL_SIZE = 4
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+# Per-connection cache of compiled statements, keyed by SQL text.
+_STATEMENT_CACHE_SIZE = 256
+
+# Sample history. Every recorded value (anchors excluded) is appended to
+# samples and folded into hourly and daily min/max/avg rollups as it is
+# written. Raw samples and hourly rollups are pruned by prune_history();
+# daily rollups are kept forever (one row per metric per day).
+ROLLUP_BUCKETS = (3_600, 86_400)
+SAMPLE_RETENTION_SECONDS = 14 * 86_400
+HOURLY_ROLLUP_RETENTION_SECONDS = 180 * 86_400
+
+# Stays under SQLITE_MAX_VARIABLE_NUMBER on old sqlite builds (999).
+_IN_CHUNK = 500
+
+_UPSERT_METRIC = """
+    INSERT INTO metrics (key, name, value, unit, updated_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(key) DO UPDATE SET
+        value = excluded.value,
+        name = excluded.name,
+        unit = excluded.unit,
+        updated_at = excluded.updated_at
+"""
+
+
+def _connect(path: str, *, readonly: bool = False) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        path,
+        check_same_thread=False,
+        cached_statements=_STATEMENT_CACHE_SIZE,
+    )
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    if readonly:
+        conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+class _SubscriptionIndex:
+    """
+    In-memory mirror of the subscriptions table in both directions, so alert
+    dispatch and command handlers never query sqlite for subscriptions.
+    Kept in step by add_subscription, remove_subscription and purge_keys.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[str, str]]):
+        self._lock = Lock()
+        self.by_key: Dict[str, Set[int]] = {}
+        self.by_user: Dict[int, Set[str]] = {}
+        for user_id, metric_key in rows:
+            self.add(int(user_id), metric_key)
+
+    def add(self, user_id: int, metric_key: str):
+        with self._lock:
+            self.by_key.setdefault(metric_key, set()).add(user_id)
+            self.by_user.setdefault(user_id, set()).add(metric_key)
+
+    def remove(self, user_id: int, metric_key: str):
+        with self._lock:
+            self.by_key.get(metric_key, set()).discard(user_id)
+            self.by_user.get(user_id, set()).discard(metric_key)
 
-def _connect():
-    return sqlite3.connect(_DB_FILE)
+    def drop_key(self, metric_key: str):
+        with self._lock:
+            for user_id in self.by_key.pop(metric_key, set()):
+                self.by_user.get(user_id, set()).discard(metric_key)
+
+    def users(self, metric_key: str) -> List[int]:
+        with self._lock:
+            return sorted(self.by_key.get(metric_key, ()))
+
+    def keys(self, user_id: int) -> List[str]:
+        with self._lock:
+            return sorted(self.by_user.get(user_id, ()))
+
+
+class _Connections:
+    """
+    Long-lived connections to one database file: a single writer guarded by
+    _LOCK plus a pool of read-only connections that never wait on it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.writer = _connect(path)
+        # metric key -> metric_ids.id, filled as keys are first written.
+        self.metric_ids: Dict[str, int] = {}
+        # Loaded from the subscriptions table on first use.
+        self.subscriptions: Optional[_SubscriptionIndex] = None
+        self.readers: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        for _ in range(_READ_POOL_SIZE):
+            self.readers.put(_connect(path, readonly=True))
+
+    def close(self):
+        while True:
+            try:
+                self.readers.get_nowait().close()
+            except queue.Empty:
+                break
+        self.writer.close()
+
+
+_conns: Optional[_Connections] = None
+_conns_lock = Lock()
+
+
+def _connections() -> _Connections:
+    # Reopens when _DB_FILE is pointed somewhere else (tests, scripts).
+    global _conns
+    with _conns_lock:
+        if _conns is None or _conns.path != _DB_FILE:
+            if _conns is not None:
+                _conns.close()
+            _conns = _Connections(_DB_FILE)
+        return _conns
+
+
+_index_lock = Lock()
+
+
+def _subscriptions() -> _SubscriptionIndex:
+    conns = _connections()
+    with _index_lock:
+        if conns.subscriptions is None:
+            with _read() as conn:
+                rows = conn.execute("SELECT user_id, metric_key FROM subscriptions").fetchall()
+            conns.subscriptions = _SubscriptionIndex(rows)
+        return conns.subscriptions
+
+
+def close_db():
+    global _conns
+    with _conns_lock:
+        if _conns is not None:
+            _conns.close()
+            _conns = None
+
+
+@contextmanager
+def _write() -> Iterator[sqlite3.Connection]:
+    """Writer connection; commits on success, rolls back on error."""
+    conns = _connections()
+    with _LOCK:
+        try:
+            yield conns.writer
+        except BaseException:
+            conns.writer.rollback()
+            raise
+        conns.writer.commit()
+
+
+@contextmanager
+def _read() -> Iterator[sqlite3.Connection]:
+    conns = _connections()
+    conn = conns.readers.get()
+    try:
+        yield conn
+    finally:
+        conns.readers.put(conn)
 
 
 def init_db():
-    with _LOCK, _connect() as conn:
+    with _write() as conn:
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS metrics (
@@ -43,7 +214,103 @@ def init_db():
             )
             """
         )
-        conn.commit()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS metric_ids (
+                id INTEGER PRIMARY KEY,
+                key TEXT NOT NULL UNIQUE
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS samples (
+                metric_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                value REAL NOT NULL,
+                PRIMARY KEY (metric_id, ts)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rollups (
+                metric_id INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                start_ts INTEGER NOT NULL,
+                min_value REAL NOT NULL,
+                max_value REAL NOT NULL,
+                sum_value REAL NOT NULL,
+                n INTEGER NOT NULL,
+                PRIMARY KEY (metric_id, bucket, start_ts)
+            ) WITHOUT ROWID
+            """
+        )
+
+    # Build the subscription index now rather than on the first alert.
+    _subscriptions()
+
+
+def _metric_ids(conn: sqlite3.Connection, keys: List[str]) -> Dict[str, int]:
+    """Id for each key, allocating new ones. Runs inside the write transaction."""
+    cache = _connections().metric_ids
+    missing = [k for k in dict.fromkeys(keys) if k not in cache]
+    if missing:
+        conn.executemany(
+            "INSERT OR IGNORE INTO metric_ids (key) VALUES (?)",
+            [(k,) for k in missing],
+        )
+        for i in range(0, len(missing), _IN_CHUNK):
+            chunk = missing[i : i + _IN_CHUNK]
+            cur = conn.execute(
+                f"SELECT key, id FROM metric_ids WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            cache.update(cur.fetchall())
+    return {k: cache[k] for k in keys}
+
+
+def _append_history(conn: sqlite3.Connection, samples: List[Tuple[str, float]], ts: int):
+    samples = [(k, v) for k, v in samples if not k.endswith(":anchor")]
+    if not samples:
+        return
+
+    # One sample per metric per second: the first write in a second is kept,
+    # and only new rows are folded into the rollups, so a second write in the
+    # same second cannot be counted twice.
+    samples = list(dict(samples).items())
+    ids = _metric_ids(conn, [k for k, _ in samples])
+    taken = set()
+    id_list = [ids[k] for k, _ in samples]
+    for i in range(0, len(id_list), _IN_CHUNK):
+        chunk = id_list[i : i + _IN_CHUNK]
+        cur = conn.execute(
+            f"SELECT metric_id FROM samples WHERE ts = ? AND metric_id IN ({','.join('?' * len(chunk))})",
+            [ts, *chunk],
+        )
+        taken.update(row[0] for row in cur.fetchall())
+    samples = [(k, v) for k, v in samples if ids[k] not in taken]
+
+    conn.executemany(
+        "INSERT INTO samples (metric_id, ts, value) VALUES (?, ?, ?)",
+        [(ids[k], ts, v) for k, v in samples],
+    )
+    conn.executemany(
+        """
+        INSERT INTO rollups (metric_id, bucket, start_ts, min_value, max_value, sum_value, n)
+        VALUES (?, ?, ?, ?, ?, ?, 1)
+        ON CONFLICT(metric_id, bucket, start_ts) DO UPDATE SET
+            min_value = min(min_value, excluded.min_value),
+            max_value = max(max_value, excluded.max_value),
+            sum_value = sum_value + excluded.sum_value,
+            n = n + 1
+        """,
+        [
+            (ids[k], bucket, ts - ts % bucket, v, v, v)
+            for k, v in samples
+            for bucket in ROLLUP_BUCKETS
+        ],
+    )
 
 
 def record_sample(
@@ -52,26 +319,82 @@ def record_sample(
     value: float,
     unit: Optional[str] = None,
 ):
+    record_samples([(metric_key, name, value, unit)])
+
+
+def record_samples(rows: Iterable[Tuple[str, str, float, Optional[str]]]):
+    """
+    Upsert many (metric_key, name, value, unit) rows and append them to the
+    sample history, all in a single transaction. Later rows win when a key
+    repeats.
+    """
     now = int(time.time())
+    params = [(key, name, value, unit, now) for key, name, value, unit in rows]
+    if not params:
+        return
 
-    with _LOCK, _connect() as conn:
-        conn.execute(
+    with _write() as conn:
+        conn.executemany(_UPSERT_METRIC, params)
+        _append_history(conn, [(p[0], p[2]) for p in params], now)
+
+
+def prune_history(now: Optional[int] = None) -> Dict[str, int]:
+    """
+    Drop raw samples and hourly rollups past their retention window.
+    Returns the number of rows deleted from each.
+    """
+    now = now or int(time.time())
+    with _write() as conn:
+        samples = conn.execute(
+            "DELETE FROM samples WHERE ts < ?",
+            (now - SAMPLE_RETENTION_SECONDS,),
+        ).rowcount
+        hourly = conn.execute(
+            "DELETE FROM rollups WHERE bucket = ? AND start_ts < ?",
+            (3_600, now - HOURLY_ROLLUP_RETENTION_SECONDS),
+        ).rowcount
+    return {"samples": samples, "hourly_rollups": hourly}
+
+
+def sample_history(metric_key: str, since: int) -> List[Tuple[int, float]]:
+    """Raw (ts, value) samples for a key at or after `since`, oldest first."""
+    with _read() as conn:
+        cur = conn.execute(
             """
-            INSERT INTO metrics (key, name, value, unit, updated_at)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(key) DO UPDATE SET
-                value = excluded.value,
-                name = excluded.name,
-                unit = excluded.unit,
-                updated_at = excluded.updated_at
+            SELECT s.ts, s.value
+            FROM samples s JOIN metric_ids m ON m.id = s.metric_id
+            WHERE m.key = ? AND s.ts >= ?
+            ORDER BY s.ts
             """,
-            (metric_key, name, value, unit, now),
+            (metric_key, since),
         )
-        conn.commit()
+        return cur.fetchall()
+
+
+def rollup_history(metric_key: str, bucket: int, since: int) -> List[Dict]:
+    """
+    Rollup buckets (bucket is 3600 or 86400 seconds) starting at or after
+    `since`, oldest first: [{start, min, max, avg, count}].
+    """
+    with _read() as conn:
+        cur = conn.execute(
+            """
+            SELECT r.start_ts, r.min_value, r.max_value, r.sum_value, r.n
+            FROM rollups r JOIN metric_ids m ON m.id = r.metric_id
+            WHERE m.key = ? AND r.bucket = ? AND r.start_ts >= ?
+            ORDER BY r.start_ts
+            """,
+            (metric_key, bucket, since),
+        )
+        rows = cur.fetchall()
+    return [
+        {"start": start, "min": lo, "max": hi, "avg": total / n, "count": n}
+        for start, lo, hi, total, n in rows
+    ]
 
 
 def get_last(metric_key: str) -> Optional[float]:
-    with _LOCK, _connect() as conn:
+    with _read() as conn:
         cur = conn.execute(
             "SELECT value FROM metrics WHERE key = ?",
             (metric_key,),
@@ -80,8 +403,15 @@ def get_last(metric_key: str) -> Optional[float]:
         return float(row[0]) if row else None
 
 
+def load_metric_values() -> Dict[str, float]:
+    """Every key's last value, for seeding in-memory state."""
+    with _read() as conn:
+        cur = conn.execute("SELECT key, value FROM metrics WHERE value IS NOT NULL")
+        return {key: float(value) for key, value in cur.fetchall()}
+
+
 def list_metrics() -> List[Dict]:
-    with _LOCK, _connect() as conn:
+    with _read() as conn:
         cur = conn.execute(
             """
             SELECT key, name, unit
@@ -102,7 +432,7 @@ def list_metrics() -> List[Dict]:
 
 
 def metric_exists(metric_key: str) -> bool:
-    with _LOCK, _connect() as conn:
+    with _read() as conn:
         cur = conn.execute(
             "SELECT 1 FROM metrics WHERE key = ?",
             (metric_key,),
@@ -114,7 +444,7 @@ def add_subscription(user_id: int, metric_key: str) -> bool:
     """
     Returns True if a new subscription was created.
     """
-    with _LOCK, _connect() as conn:
+    with _write() as conn:
         cur = conn.execute(
             """
             INSERT OR IGNORE INTO subscriptions (user_id, metric_key)
@@ -122,30 +452,21 @@ def add_subscription(user_id: int, metric_key: str) -> bool:
             """,
             (str(user_id), metric_key),
         )
-        conn.commit()
-        return cur.rowcount > 0
+        created = cur.rowcount > 0
+    if created:
+        _subscriptions().add(int(user_id), metric_key)
+    return created
 
 
 def list_subscriptions(user_id: int) -> List[str]:
-    with _LOCK, _connect() as conn:
-        cur = conn.execute(
-            """
-            SELECT metric_key
-            FROM subscriptions
-            WHERE user_id = ?
-            ORDER BY metric_key
-            """,
-            (str(user_id),),
-        )
-        rows = cur.fetchall()
-    return [row[0] for row in rows]
+    return _subscriptions().keys(int(user_id))
 
 
 def remove_subscription(user_id: int, metric_key: str) -> bool:
     """
     Returns True if a subscription was removed.
     """
-    with _LOCK, _connect() as conn:
+    with _write() as conn:
         cur = conn.execute(
             """
             DELETE FROM subscriptions
@@ -153,29 +474,20 @@ def remove_subscription(user_id: int, metric_key: str) -> bool:
             """,
             (str(user_id), metric_key),
         )
-        conn.commit()
-        return cur.rowcount > 0
+        removed = cur.rowcount > 0
+    if removed:
+        _subscriptions().remove(int(user_id), metric_key)
+    return removed
 
 
 def subscriptions_for_metric(metric_key: str) -> List[int]:
-    with _LOCK, _connect() as conn:
-        cur = conn.execute(
-            """
-            SELECT user_id
-            FROM subscriptions
-            WHERE metric_key = ?
-            """,
-            (metric_key,),
-        )
-        rows = cur.fetchall()
-
-    return [int(user_id) for (user_id,) in rows]
+    return _subscriptions().users(metric_key)
 
 
 # ICO alert helpers
 
 def ico_alert_state(block_id: str) -> Dict[str, Optional[int]]:
-    with _LOCK, _connect() as conn:
+    with _read() as conn:
         cur = conn.execute(
             """
             SELECT scheduled_notified_at, release_notified_at
@@ -194,7 +506,7 @@ def ico_alert_state(block_id: str) -> Dict[str, Optional[int]]:
 
 def mark_ico_scheduled(block_id: str, ts: Optional[int] = None):
     ts = ts or int(time.time())
-    with _LOCK, _connect() as conn:
+    with _write() as conn:
         conn.execute(
             """
             INSERT INTO ico_alerts (block_id, scheduled_notified_at)
@@ -204,12 +516,11 @@ def mark_ico_scheduled(block_id: str, ts: Optional[int] = None):
             """,
             (block_id, ts),
         )
-        conn.commit()
 
 
 def mark_ico_released(block_id: str, ts: Optional[int] = None):
     ts = ts or int(time.time())
-    with _LOCK, _connect() as conn:
+    with _write() as conn:
         conn.execute(
             """
             INSERT INTO ico_alerts (block_id, release_notified_at)
@@ -219,16 +530,21 @@ def mark_ico_released(block_id: str, ts: Optional[int] = None):
             """,
             (block_id, ts),
         )
-        conn.commit()
 
 
 def purge_keys(db_path: str, keys: List[str]) -> Dict[str, Dict[str, int]]:
     """
-    Delete each key (and its :anchor) from metrics and subscriptions.
-    Returns a summary: {key: {metrics: N, subscriptions: N}}.
+    Delete each key (and its :anchor) from metrics and subscriptions, and
+    its sample history when the db has one.
+    Returns a summary: {key: {metrics: N, subscriptions: N, samples: N}}.
     """
     results: Dict[str, Dict[str, int]] = {}
+    # Keep this process's caches in step when purging the db it has open.
+    live = _conns if _conns is not None and os.path.abspath(_conns.path) == os.path.abspath(db_path) else None
     with sqlite3.connect(db_path) as conn:
+        has_history = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'metric_ids'"
+        ).fetchone() is not None
         for key in keys:
             targets = [key, f"{key}:anchor"]
             metrics_deleted = 0
@@ -240,6 +556,22 @@ def purge_keys(db_path: str, keys: List[str]) -> Dict[str, Dict[str, int]]:
                     "DELETE FROM subscriptions WHERE metric_key = ?", (target,)
                 )
                 subs_deleted += cur.rowcount
+                if live is not None and live.subscriptions is not None:
+                    live.subscriptions.drop_key(target)
+            samples_deleted = 0
+            if has_history:
+                row = conn.execute("SELECT id FROM metric_ids WHERE key = ?", (key,)).fetchone()
+                if row:
+                    cur = conn.execute("DELETE FROM samples WHERE metric_id = ?", row)
+                    samples_deleted = cur.rowcount
+                    conn.execute("DELETE FROM rollups WHERE metric_id = ?", row)
+                    conn.execute("DELETE FROM metric_ids WHERE id = ?", row)
+                    if live is not None:
+                        live.metric_ids.pop(key, None)
             conn.commit()
-            results[key] = {"metrics": metrics_deleted, "subscriptions": subs_deleted}
+            results[key] = {
+                "metrics": metrics_deleted,
+                "subscriptions": subs_deleted,
+                "samples": samples_deleted,
+            }
     return results
@@ -1,18 +1,28 @@
 import importlib
 import os
 import pkgutil
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime, timezone
 from types import ModuleType
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 
 import adapters as _adapters_pkg
+from httputil import deadline, prewarm, take_request_stats
+from scheduler import CATCH_UP_SKIP, AdapterScheduler
+from workers import AdapterProcessPool
 from db import (
     get_last,
     ico_alert_state,
+    load_metric_values,
     mark_ico_released,
+    prune_history,
     mark_ico_scheduled,
     record_sample,
+    record_samples,
 )
 
 
@@ -70,11 +80,13 @@ def _discover_adapters() -> Dict[str, ModuleType]:
 
 ADAPTERS: Dict[str, ModuleType] = _discover_adapters()
 
-PAIRED_CAPS: List[Dict] = [
-    pair
-    for mod in ADAPTERS.values()
-    for pair in getattr(mod, "PAIRED_CAPS", [])
-]
+def paired_caps() -> List[Dict]:
+    """Pair configs from every adapter, read per cycle since adapters may add pairs they discover."""
+    return [
+        pair
+        for mod in ADAPTERS.values()
+        for pair in getattr(mod, "PAIRED_CAPS", [])
+    ]
 
 
 # Per-adapter polling cadence
@@ -88,20 +100,218 @@ def adapter_interval(name: str) -> int:
     return int(getattr(mod, "INTERVAL_SECONDS", DEFAULT_INTERVAL_SECONDS))
 
 
+def adapter_streams(name: str) -> bool:
+    """True if the adapter pushes updates itself (module-level STREAMING) instead of being polled."""
+    return bool(getattr(ADAPTERS.get(name), "STREAMING", False))
+
+
+def streaming_adapters() -> List[str]:
+    return [name for name in ADAPTERS if adapter_streams(name)]
+
+
 def adapter_intervals() -> Dict[str, int]:
-    return {name: adapter_interval(name) for name in ADAPTERS}
+    """Polling cadence of every polled adapter; streaming adapters are not scheduled."""
+    return {name: adapter_interval(name) for name in ADAPTERS if not adapter_streams(name)}
+
+
+# Upper bound on the random delay added to each firing, so adapters sharing a
+# cadence do not all hit the network in the same second. Adapters may override
+# it with a module-level JITTER_SECONDS.
+DEFAULT_JITTER_SECONDS = float(os.getenv("SCHEDULER_JITTER_SECONDS", "0"))
+
+# See scheduler.CATCH_UP_POLICIES.
+SCHEDULER_CATCH_UP = os.getenv("SCHEDULER_CATCH_UP", CATCH_UP_SKIP)
+
 
+def adapter_jitter(name: str) -> float:
+    mod = ADAPTERS.get(name)
+    if mod is None:
+        return DEFAULT_JITTER_SECONDS
+    return float(getattr(mod, "JITTER_SECONDS", DEFAULT_JITTER_SECONDS))
 
-# Drives the bot's tick rate so run_once is called often enough for the
-# fastest adapter to hit its cadence.
-MIN_INTERVAL_SECONDS = min(
-    (adapter_interval(n) for n in ADAPTERS),
-    default=DEFAULT_INTERVAL_SECONDS,
+
+# Every adapter fires on its own grid, starting immediately. The bot sleeps
+# until SCHEDULER.seconds_until_next() and hands whatever is due to run_once.
+SCHEDULER = AdapterScheduler(
+    adapter_intervals(),
+    jitter={name: adapter_jitter(name) for name in ADAPTERS},
+    catch_up=SCHEDULER_CATCH_UP,
 )
 
-# Tracks the monotonic timestamp of each adapter's last fetch attempt.
-# Updated before the fetch runs so a failing adapter does not retry every tick.
-_last_fetch_at: Dict[str, float] = {}
+# Adapters whose run_once is still in progress. Cycles for different adapters
+# may overlap; the same adapter never runs twice at once.
+_busy: set = set()
+_busy_lock = threading.Lock()
+# Signalled whenever adapters leave _busy; ingest waits on it.
+_busy_released = threading.Condition(_busy_lock)
+
+
+# Concurrent fetching
+
+# Upper bound on adapter fetches running at once. Workers spend nearly all of
+# their time blocked on network I/O, so this is not tied to the CPU count.
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "8"))
+
+# Wall-clock budget for one adapter fetch, measured from submission. Adapters
+# may override it with a module-level FETCH_TIMEOUT_SECONDS.
+DEFAULT_FETCH_TIMEOUT_SECONDS = 60
+
+# "thread" runs fetch() directly on the worker pool threads. "process" hands it
+# to a pre-started child process per worker thread, which is killed and
+# replaced when it overruns its deadline; use it when an adapter can hang in a
+# way a thread cannot escape (blocking C calls, stuck sockets).
+ADAPTER_EXECUTION = os.getenv("ADAPTER_EXECUTION", "thread")
+if ADAPTER_EXECUTION not in ("thread", "process"):
+    raise RuntimeError(f"ADAPTER_EXECUTION must be 'thread' or 'process', got {ADAPTER_EXECUTION!r}")
+
+# Grace period on top of the fetch deadline in process mode, so the worker
+# thread gets to kill the child and report before the engine stops waiting.
+_PROCESS_KILL_GRACE_SECONDS = 5
+
+_fetch_pool = ThreadPoolExecutor(
+    max_workers=FETCH_WORKERS,
+    thread_name_prefix="adapter",
+)
+
+# Futures whose fetch overran its deadline. Python threads cannot be
+# cancelled, so an adapter is skipped until its previous fetch has returned.
+_inflight: Dict[str, Future] = {}
+
+# Latency summary of the most recent run_once, for logging and diagnostics:
+# {"total": seconds, "adapters": {name: seconds or None if timed out},
+#  "lag": {name: seconds the fetch started after its scheduled time},
+#  "http": {"sent": N, "coalesced": N, "throttled": N} since the previous
+#           cycle finished}
+LAST_CYCLE: Dict = {"total": 0.0, "adapters": {}, "lag": {}, "http": {}}
+
+# Started on first use so importing the engine (tests, scripts) forks nothing.
+_process_pool: Optional[AdapterProcessPool] = None
+
+
+def adapter_fetch_timeout(name: str) -> float:
+    """The adapter's fetch budget, never longer than its polling interval."""
+    mod = ADAPTERS.get(name)
+    if mod is None:
+        return DEFAULT_FETCH_TIMEOUT_SECONDS
+    budget = float(getattr(mod, "FETCH_TIMEOUT_SECONDS", DEFAULT_FETCH_TIMEOUT_SECONDS))
+    return min(budget, adapter_interval(name))
+
+
+def _get_process_pool() -> AdapterProcessPool:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = AdapterProcessPool(FETCH_WORKERS)
+    return _process_pool
+
+
+def _timed_fetch(name: str, due_by: float) -> Tuple[List[Dict], float]:
+    """
+    Run one fetch that must finish by monotonic time `due_by`. HTTP requests
+    made by the adapter share that deadline (see httputil.deadline), so they
+    give up in time instead of each waiting out its own timeout.
+    """
+    start = time.monotonic()
+    budget = max(0.0, due_by - start)
+    if ADAPTER_EXECUTION == "process":
+        metrics = _get_process_pool().run(ADAPTERS[name].__name__, budget)
+    else:
+        with deadline(budget):
+            metrics = ADAPTERS[name].fetch()
+    return metrics, time.monotonic() - start
+
+
+def _fetch_concurrently(names: List[str]) -> Dict[str, Tuple]:
+    """
+    Run fetch() for each named adapter on the shared worker pool.
+
+    Returns {name: (metrics, error, elapsed)} where exactly one of metrics /
+    error is set. elapsed is None when the adapter overran its deadline.
+    """
+    submitted_at = time.monotonic()
+    futures: Dict[str, Future] = {}
+    for name in names:
+        due_by = submitted_at + adapter_fetch_timeout(name)
+        futures[name] = _fetch_pool.submit(_timed_fetch, name, due_by)
+
+    results: Dict[str, Tuple] = {}
+    for name, fut in futures.items():
+        timeout = adapter_fetch_timeout(name)
+        if ADAPTER_EXECUTION == "process":
+            timeout += _PROCESS_KILL_GRACE_SECONDS
+        remaining = max(0.0, submitted_at + timeout - time.monotonic())
+        try:
+            metrics, elapsed = fut.result(timeout=remaining)
+        except FutureTimeoutError:
+            _inflight[name] = fut
+            results[name] = (None, f"timed out after {timeout:g}s", None)
+        except Exception as e:
+            results[name] = (None, str(e), time.monotonic() - submitted_at)
+        else:
+            results[name] = (metrics, None, elapsed)
+    return results
+
+
+# Connection prewarming
+
+# Open keep-alive connections to every adapter host at startup so the first
+# cycle does not pay for a TLS handshake per request. Off with HTTP_PREWARM=0.
+HTTP_PREWARM = os.getenv("HTTP_PREWARM", "1") != "0"
+
+
+def adapter_origins() -> List[str]:
+    """scheme://host of every URL constant defined by an enabled adapter."""
+    origins: Dict[str, None] = {}
+    for mod in ADAPTERS.values():
+        for value in vars(mod).values():
+            if isinstance(value, dict):
+                candidates = value.values()
+            elif isinstance(value, (list, tuple)):
+                candidates = value
+            else:
+                candidates = [value]
+            for text in candidates:
+                if not isinstance(text, str) or not text.startswith(("http://", "https://")):
+                    continue
+                parts = urlsplit(text)
+                if parts.netloc and "{" not in parts.netloc:
+                    origins[f"{parts.scheme}://{parts.netloc}"] = None
+    return list(origins)
+
+
+def prewarm_connections():
+    """
+    Prewarm adapter hosts; a no-op in process mode, where fetches run in
+    child processes with their own connections.
+    """
+    if not HTTP_PREWARM or ADAPTER_EXECUTION == "process":
+        return
+    start = time.monotonic()
+    opened = prewarm(adapter_origins())
+    print(
+        f"[engine] prewarmed {sum(opened.values())} connections to "
+        f"{sum(1 for n in opened.values() if n)}/{len(opened)} hosts in {time.monotonic() - start:.2f}s"
+    )
+
+
+def _format_cycle(
+    total: float,
+    latencies: Dict[str, Optional[float]],
+    lag: Dict[str, float],
+    http: Dict[str, int],
+) -> str:
+    parts = []
+    for name, secs in latencies.items():
+        part = f"{name} {secs:.2f}s" if secs is not None else f"{name} timeout"
+        if lag.get(name, 0.0) >= 0.01:
+            part += f" (+{lag[name]:.2f}s late)"
+        parts.append(part)
+    line = f"[engine] cycle {total:.2f}s" + (f": {', '.join(parts)}" if parts else "")
+    if http.get("coalesced") or http.get("throttled"):
+        line += (
+            f" [{http['sent']} requests, {http['coalesced']} coalesced,"
+            f" {http.get('throttled', 0)} throttled]"
+        )
+    return line
 
 
 # Caps
@@ -221,18 +431,25 @@ def handle_rate_metric(
     value: float,
     unit: Optional[str],
     adapter: Optional[str] = None,
+    store: Optional["MetricState"] = None,
 ) -> List[Dict]:
     """
     Delta-based alerting for rate metrics with a sticky anchor.
+
+    The anchor is read and written through `store` when given, otherwise
+    straight against the db.
     """
     alerts: List[Dict] = []
 
+    _get_last = store.get_last if store is not None else get_last
+    _record_sample = store.record_sample if store is not None else record_sample
+
     anchor_key = _anchor_key(key)
-    anchor = get_last(anchor_key)
+    anchor = _get_last(anchor_key)
 
     # first observation -> set anchor
     if anchor is None:
-        record_sample(
+        _record_sample(
             metric_key=anchor_key,
             name=f"{name} (anchor)",
             value=value,
@@ -276,7 +493,7 @@ def handle_rate_metric(
         }
     )
 
-    record_sample(
+    _record_sample(
         metric_key=anchor_key,
         name=f"{name} (anchor)",
         value=value,
@@ -446,113 +663,259 @@ def handle_ico_schedule(entries: List[Dict], key: str, adapter: str) -> List[Dic
 
 # Orchestration
 
-def run_once() -> List[Dict]:
+class MetricState:
+    """
+    In-memory copy of every metric's last value, loaded from the metrics table
+    on first use. Evaluation reads and writes here. Writes are flushed to sqlite
+    in one transaction at the end of each cycle, so a crash loses at most the
+    cycle in flight.
+
+    The engine is the only writer, so this copy stays authoritative while the
+    bot runs. Purge keys with the bot stopped, or it will keep their anchors.
+    """
+
+    def __init__(self):
+        self._values: Optional[Dict[str, float]] = None
+        self._dirty: Dict[str, Tuple[str, str, float, Optional[str]]] = {}
+        self._lock = threading.Lock()
+
+    def _loaded(self) -> Dict[str, float]:
+        if self._values is None:
+            self._values = load_metric_values()
+        return self._values
+
+    def get_last(self, key: str) -> Optional[float]:
+        with self._lock:
+            return self._loaded().get(key)
+
+    def record_sample(
+        self,
+        metric_key: str,
+        name: str,
+        value: float,
+        unit: Optional[str] = None,
+    ):
+        with self._lock:
+            self._loaded()[metric_key] = value
+            self._dirty[metric_key] = (metric_key, name, value, unit)
+
+    def flush(self):
+        with self._lock:
+            rows, self._dirty = list(self._dirty.values()), {}
+        if rows:
+            record_samples(rows)
+
+
+STATE = MetricState()
+
+# How often cycles trim expired sample history (see db.prune_history).
+HISTORY_PRUNE_INTERVAL_SECONDS = 3_600
+_last_prune_at: Optional[float] = None
+
+
+def _maybe_prune_history():
+    global _last_prune_at
+    now = time.monotonic()
+    if _last_prune_at is not None and now - _last_prune_at < HISTORY_PRUNE_INTERVAL_SECONDS:
+        return
+    # History is housekeeping: a failed prune (busy or full disk) must not
+    # cost the cycle its alerts, since the values are already stored and
+    # their transitions would never fire again. It is retried next cycle.
+    try:
+        deleted = prune_history()
+    except Exception as e:
+        print(f"[engine] pruning history failed: {e!r}")
+        return
+    _last_prune_at = now
+    if any(deleted.values()):
+        print(f"[engine] pruned history: {deleted}")
+
+
+def run_once(names: Optional[List[str]] = None) -> List[Dict]:
     """
-    Run all fetchers once, store samples, evaluate alerts.
+    Fetch the given adapters concurrently, store samples, evaluate alerts.
+    With no names, runs whatever SCHEDULER has due right now.
+
+    Each fetch gets its own deadline (see adapter_fetch_timeout); an adapter
+    that overruns it is reported as an engine alert and skipped until its
+    worker returns. Evaluation runs in ADAPTERS order once all fetches have
+    finished or timed out.
 
     Alerting models:
     - Rates: delta-based, sticky anchor
     - Caps: state-based (full vs not full)
     - ICOs: scheduled + launch-day alerts
     """
+    if names is None:
+        names = SCHEDULER.pop_due()
+
+    due: List[str] = []
+    with _busy_lock:
+        for adapter_name in ADAPTERS:
+            if adapter_name not in names:
+                continue
+            pending = _inflight.get(adapter_name)
+            if pending is not None:
+                if not pending.done():
+                    print(f"[engine] adapter {adapter_name!r} still running past its deadline, skipping")
+                    continue
+                del _inflight[adapter_name]
+            if adapter_name in _busy:
+                print(f"[engine] adapter {adapter_name!r} still in a previous cycle, skipping")
+                continue
+            _busy.add(adapter_name)
+            due.append(adapter_name)
+
+    try:
+        return _run_cycle(due)
+    finally:
+        with _busy_released:
+            _busy.difference_update(due)
+            _busy_released.notify_all()
+
+
+def ingest(adapter_name: str, metrics: List[Dict]) -> List[Dict]:
+    """
+    Store and evaluate metrics a streaming adapter pushed, exactly as if a
+    cycle had fetched them. Returns the alerts.
+
+    Holds the adapter's _busy slot like run_once, waiting for any cycle of
+    the same adapter to finish first, so its keys are never evaluated twice
+    at once.
+    """
+    with _busy_released:
+        while adapter_name in _busy:
+            _busy_released.wait()
+        _busy.add(adapter_name)
+    try:
+        alerts, _ = _evaluate([adapter_name], {adapter_name: (metrics, None, None)})
+    finally:
+        with _busy_released:
+            _busy.discard(adapter_name)
+            _busy_released.notify_all()
+    return alerts
+
+
+def _run_cycle(due: List[str]) -> List[Dict]:
+    now = time.monotonic()
+
+    results = _fetch_concurrently(due)
+    alerts, latencies = _evaluate(due, results)
+
+    total = time.monotonic() - now
+    LAST_CYCLE["total"] = total
+    LAST_CYCLE["adapters"] = latencies
+    LAST_CYCLE["lag"] = {name: SCHEDULER.lag.get(name, 0.0) for name in due}
+    LAST_CYCLE["http"] = take_request_stats()
+    if due:
+        print(_format_cycle(total, latencies, LAST_CYCLE["lag"], LAST_CYCLE["http"]))
+
+    return alerts
+
+
+def _evaluate(due: List[str], results: Dict[str, Tuple]) -> Tuple[List[Dict], Dict[str, Optional[float]]]:
     alerts: List[Dict] = []
     cap_snapshots: Dict[str, tuple] = {}
+    # Read only now that fetches are done: adapters may add pairs they
+    # discovered during this very fetch.
+    pairs = paired_caps()
     paired_keys = {
         key
-        for pair in PAIRED_CAPS
+        for pair in pairs
         for key in (pair["supply_key"], pair["borrow_key"])
     }
 
-    now = time.monotonic()
+    # Evaluate in discovery order regardless of completion order, so alert
+    # ordering and paired-cap snapshots stay deterministic.
+    latencies: Dict[str, Optional[float]] = {}
+    try:
+        for adapter_name in due:
+            metrics, error, elapsed = results[adapter_name]
+            latencies[adapter_name] = elapsed
+
+            if error is not None:
+                msg = f"Error fetching data from {adapter_name}: {error}"
+                print(msg)
+                alerts.append(
+                    {
+                        "category": "engine",
+                        "level": "major",
+                        "value": msg,
+                    },
+                )
+                continue
 
-    for adapter_name, mod in ADAPTERS.items():
-        interval = adapter_interval(adapter_name)
-        last = _last_fetch_at.get(adapter_name)
-        if last is not None and (now - last) < interval:
-            continue
-        _last_fetch_at[adapter_name] = now
+            for metric in metrics:
+                key = metric["key"]
+                name = metric["name"]
+                value = metric["value"]
+                unit = metric.get("unit")
+                adapter = metric.get("adapter")
 
-        try:
-            metrics = mod.fetch()
-        except Exception as e:
-            msg = f"Error fetching data from {adapter_name}: {e}"
-            print(msg)
-            alerts.append(
-                {
-                    "category": "engine",
-                    "level": "major",
-                    "value": msg,
-                },
-            )
-            continue
+                last_value = STATE.get_last(key)
 
-        for metric in metrics:
-            key = metric["key"]
-            name = metric["name"]
-            value = metric["value"]
-            unit = metric.get("unit")
-            adapter = metric.get("adapter")
+                if unit == "json":
+                    # record a lightweight count so the toy list includes this key
+                    STATE.record_sample(
+                        metric_key=key,
+                        name=name,
+                        value=float(len(value or [])),
+                        unit=unit,
+                    )
+                    alerts.extend(
+                        handle_ico_schedule(value or [], key, adapter)
+                    )
+                    continue
 
-            last_value = get_last(key)
+                # numeric metrics only beyond this point
+                value_f = float(value)
 
-            if unit == "json":
-                # record a lightweight count so the toy list includes this key
-                record_sample(
+                # always record current value
+                STATE.record_sample(
                     metric_key=key,
                     name=name,
-                    value=float(len(value or [])),
+                    value=value_f,
                     unit=unit,
                 )
-                alerts.extend(
-                    handle_ico_schedule(value or [], key, adapter)
-                )
-                continue
-
-            # numeric metrics only beyond this point
-            value_f = float(value)
-
-            # always record current value
-            record_sample(
-                metric_key=key,
-                name=name,
-                value=value_f,
-                unit=unit,
-            )
 
-            if unit == "ratio":
-                cap_snapshots[key] = (value_f, last_value)
-                alerts.extend(
-                    handle_caps_metric(
-                        key=key,
-                        name=name,
-                        value=value_f,
-                        last_value=last_value,
-                        adapter=adapter,
-                        paired_keys=paired_keys,
-                    ),
-                )
-            elif unit == "available":
-                alerts.extend(
-                    handle_available_metric(
-                        key=key,
-                        name=name,
-                        value=value_f,
-                        last_value=last_value,
-                        adapter=adapter,
-                    ),
-                )
-            else:
-                alerts.extend(
-                    handle_rate_metric(
-                        key=key,
-                        name=name,
-                        value=value_f,
-                        unit=unit,
-                        adapter=adapter,
-                    ),
-                )
-
-    for pair in PAIRED_CAPS:
+                if unit == "ratio":
+                    cap_snapshots[key] = (value_f, last_value)
+                    alerts.extend(
+                        handle_caps_metric(
+                            key=key,
+                            name=name,
+                            value=value_f,
+                            last_value=last_value,
+                            adapter=adapter,
+                            paired_keys=paired_keys,
+                        ),
+                    )
+                elif unit == "available":
+                    alerts.extend(
+                        handle_available_metric(
+                            key=key,
+                            name=name,
+                            value=value_f,
+                            last_value=last_value,
+                            adapter=adapter,
+                        ),
+                    )
+                else:
+                    alerts.extend(
+                        handle_rate_metric(
+                            key=key,
+                            name=name,
+                            value=value_f,
+                            unit=unit,
+                            adapter=adapter,
+                            store=STATE,
+                        ),
+                    )
+    finally:
+        STATE.flush()
+    _maybe_prune_history()
+
+    for pair in pairs:
         sk, bk = pair["supply_key"], pair["borrow_key"]
         if sk in cap_snapshots and bk in cap_snapshots:
             s_val, s_last = cap_snapshots[sk]
@@ -569,4 +932,4 @@ def run_once() -> List[Dict]:
                 )
             )
 
-    return alerts
+    return alerts, latencies
@@ -1,39 +1,842 @@
-from typing import Any
+import hashlib
+import json as _json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlsplit
 
 import requests
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:
+    import orjson
+except ImportError:  # optional fast path; stdlib json is the fallback
+    orjson = None
 
 
 DEFAULT_TIMEOUT = 20
 
-# Retry on transient server errors and connection failures.
-# Backoff: 0.5s, 1s, 2s before giving up (1.5s wall time worst-case).
-# Polling runs every 5 min, so this stays well within the cycle.
-_RETRY = Retry(
-    total=3,
-    backoff_factor=0.5,
-    status_forcelist=(500, 502, 503, 504),
-    allowed_methods=("GET", "POST"),
-    raise_on_status=False,
-)
+# Retries
+#
+# _send retries transient failures itself, not through urllib3's Retry, so
+# each attempt passes the host limiter and fits in the caller's deadline:
+#   - connection errors, timeouts and 500/502/503/504: back off 0.5s, 1s, 2s
+#   - 429: wait for Retry-After (or 1s, 2s, 4s), holding off the whole host
+# A retry whose wait would end past the deadline is not attempted; the last
+# response or error goes back to the caller instead.
+RETRIES = 3
+RETRY_BACKOFF_SECONDS = 0.5
+RETRY_STATUSES = (500, 502, 503, 504)
+THROTTLE_BACKOFF_SECONDS = 1.0
+MAX_RETRY_AFTER_SECONDS = 60
+
+
+# Deadlines
+#
+# The engine runs each adapter fetch under deadline(seconds). Every request
+# made inside it, however many an adapter makes in sequence, gets at most the
+# time left: its timeout shrinks to fit, retries stop once their backoff
+# would overrun, and a request that would start after the deadline raises
+# DeadlineExceeded without being sent. Nested deadlines keep the earlier one.
+#
+# The deadline lives in a ContextVar, so it follows the thread (or asyncio
+# task) that set it. An adapter that fans out to its own threads should run
+# them via contextvars.copy_context().run to carry it along.
+
+_deadline: ContextVar[Optional[float]] = ContextVar("httputil_deadline", default=None)
+
+
+class DeadlineExceeded(requests.Timeout):
+    """The enclosing deadline() ran out before the request could be made."""
+
+
+@contextmanager
+def deadline(seconds: float):
+    at = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(at if outer is None else min(at, outer))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None outside one."""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+# Connection pools
+#
+# Each host gets its own pool of up to POOL_MAXSIZE kept-alive connections
+# (configure_host() overrides the size per host). Pools block once every
+# connection is checked out, so a burst of parallel fetches queues for a warm
+# connection instead of opening a throwaway one that is closed again as soon
+# as it is returned. requests' default adapter also only keeps 10 host pools
+# around, fewer than the adapters talk to, so pools were evicted and their
+# TLS sessions lost every cycle; POOL_HOSTS lifts that.
+
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+POOL_HOSTS = 64
+
+# Longest a request waits for a free pooled connection before failing.
+POOL_WAIT_TIMEOUT = 30
+
+# host:port -> {"created": N, "reused": N}
+_pool_stats: Dict[str, Dict[str, float]] = {}
+_pool_stats_lock = threading.Lock()
+
+
+class _CountingPoolMixin:
+    """Counts fresh vs kept-alive connections handed out by the pool."""
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout=POOL_WAIT_TIMEOUT if timeout is None else timeout)
+        with _pool_stats_lock:
+            stats = _pool_stats.setdefault(f"{self.host}:{self.port}", {"created": 0, "reused": 0})
+            stats["reused" if conn.is_connected else "created"] += 1
+        return conn
+
+
+class _CountingHTTPPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _CountingHTTPSPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class _PooledAdapter(HTTPAdapter):
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPPool,
+            "https": _CountingHTTPSPool,
+        }
+
+
+def _pooled_adapter(maxsize: int, hosts: int = 1) -> _PooledAdapter:
+    return _PooledAdapter(
+        pool_connections=hosts,
+        pool_maxsize=maxsize,
+        pool_block=True,
+    )
+
 
 _session = requests.Session()
-_adapter = HTTPAdapter(max_retries=_RETRY)
+_adapter = _pooled_adapter(POOL_MAXSIZE, hosts=POOL_HOSTS)
 _session.mount("http://", _adapter)
 _session.mount("https://", _adapter)
 
 
-def get_json(url: str, *, timeout: float = DEFAULT_TIMEOUT, **kwargs) -> Any:
-    r = _session.get(url, timeout=timeout, **kwargs)
-    r.raise_for_status()
-    return r.json()
+def configure_host(
+    origin: str,
+    *,
+    maxsize: Optional[int] = None,
+    rate: Optional[float] = None,
+    burst: Optional[float] = None,
+):
+    """
+    Per-host settings for `origin` (e.g. "https://api.kamino.finance"):
+    its own pool size, and/or a token-bucket rate limit of `rate` requests
+    per second with bursts of up to `burst` (default: max(1, rate)).
+    """
+    if maxsize is not None:
+        _session.mount(origin.rstrip("/") + "/", _pooled_adapter(maxsize))
+    host = urlsplit(origin).netloc
+    with _limiters_lock:
+        config = _host_config.setdefault(host, {})
+        config.update({k: v for k, v in (("maxsize", maxsize), ("rate", rate), ("burst", burst)) if v is not None})
+        _limiters.pop(host, None)
+
+
+def pool_stats() -> Dict[str, Dict[str, float]]:
+    """Per-host connection counters since startup."""
+    with _pool_stats_lock:
+        return {host: dict(stats) for host, stats in _pool_stats.items()}
+
+
+def _prewarm_origin(origin: str, connections: int, timeout: float) -> int:
+    # Best effort: whatever goes wrong here, the first real request retries it.
+    try:
+        return _prewarm_connections(origin, connections, timeout)
+    except Exception as e:
+        print(f"[httputil] prewarm {origin} failed: {e!r}")
+        return 0
+
+
+def _prewarm_connections(origin: str, connections: int, timeout: float) -> int:
+    settings = _session.merge_environment_settings(origin, {}, None, None, None)
+    if settings["proxies"].get(urlsplit(origin).scheme):
+        return 0  # the connection is to the proxy, not something we can warm here
+
+    adapter = _session.get_adapter(origin)
+    request = requests.Request("GET", origin).prepare()
+    pool = adapter.get_connection_with_tls_context(request, settings["verify"], cert=settings["cert"])
+
+    opened = 0
+    conns = []
+    try:
+        for _ in range(min(connections, pool.pool.maxsize)):
+            conn = pool._get_conn(timeout=timeout)
+            conns.append(conn)
+            if conn.is_connected:
+                continue
+            conn.timeout = timeout
+            try:
+                conn.connect()
+            except Exception:
+                conn.close()
+                break
+            opened += 1
+    finally:
+        for conn in conns:
+            pool._put_conn(conn)
+    return opened
+
+
+def prewarm(origins: Iterable[str], *, connections: int = 2, timeout: float = 5.0) -> Dict[str, int]:
+    """
+    Open (and TLS-handshake) up to `connections` pooled connections to each
+    origin ahead of the first request. Returns the number opened per origin;
+    unreachable origins just get 0.
+    """
+    origins = list(dict.fromkeys(origins))
+    if not origins:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(origins), 16), thread_name_prefix="prewarm") as ex:
+        opened = ex.map(lambda o: _prewarm_origin(o, connections, timeout), origins)
+        return dict(zip(origins, opened))
+
+
+# Rate limiting
+#
+# Every request to a host passes through its _HostLimiter: an optional token
+# bucket (configure_host(rate=...)) plus an AIMD concurrency limit. The limit
+# starts at the host's pool size, halves on a 429, a 5xx or a failed request
+# (at most once per second, so one burst of failures counts once) and grows
+# back by roughly one per round of successes. Until a 429's Retry-After has
+# passed, no caller sends anything to that host.
+
+_DECREASE_COOLDOWN_SECONDS = 1.0
+
+
+class _HostLimiter:
+
+    def __init__(self, max_concurrency: int, rate: Optional[float] = None, burst: Optional[float] = None):
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate or 0.0)
+        self.tokens = self.burst
+        self.refilled_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.decreased_at = float("-inf")
+        self.in_flight = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, until: Optional[float] = None) -> bool:
+        """Take a slot; False if none came free before monotonic time `until`."""
+        with self._cond:
+            start = time.monotonic()
+            waited = False
+            while True:
+                now = time.monotonic()
+                if self.rate is not None:
+                    self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+                    self.refilled_at = now
+                if now < self.blocked_until:
+                    timeout = self.blocked_until - now
+                elif self.in_flight >= int(self.limit):
+                    timeout = None
+                elif self.rate is not None and self.tokens < 1:
+                    timeout = (1 - self.tokens) / self.rate
+                else:
+                    break
+                if until is not None:
+                    if now >= until:
+                        return False
+                    timeout = until - now if timeout is None else min(timeout, until - now)
+                waited = True
+                self._cond.wait(timeout)
+            if waited:
+                self.waited += 1
+                self.wait_seconds += now - start
+            self.in_flight += 1
+            if self.rate is not None:
+                self.tokens -= 1
+            return True
+
+    def release(self, overloaded: bool, retry_after: Optional[float] = None):
+        with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if retry_after is not None:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            if overloaded:
+                if now - self.decreased_at >= _DECREASE_COOLDOWN_SECONDS:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.decreased_at = now
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+# host -> {"maxsize": N, "rate": R, "burst": B}, from configure_host()
+_host_config: Dict[str, Dict[str, float]] = {}
+_limiters: Dict[str, _HostLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _limiter(host: str) -> _HostLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            config = _host_config.get(host, {})
+            limiter = _limiters[host] = _HostLimiter(
+                int(config.get("maxsize", POOL_MAXSIZE)),
+                rate=config.get("rate"),
+                burst=config.get("burst"),
+            )
+        return limiter
+
+
+def limiter_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Per host: current concurrency limit, requests in flight, and how many
+    requests had to wait for a slot (and for how long in total).
+    """
+    with _limiters_lock:
+        return {
+            host: {
+                "limit": limiter.limit,
+                "in_flight": limiter.in_flight,
+                "waited": limiter.waited,
+                "wait_seconds": limiter.wait_seconds,
+            }
+            for host, limiter in _limiters.items()
+        }
+
+
+def _retry_after(r: requests.Response, attempt: int) -> float:
+    value = r.headers.get("Retry-After")
+    delay = THROTTLE_BACKOFF_SECONDS * 2 ** attempt
+    if value:
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                pass
+    return min(max(0.0, delay), MAX_RETRY_AFTER_SECONDS)
+
+
+def _send(method: str, url: str, *, timeout: float, **kwargs) -> requests.Response:
+    limiter = _limiter(urlsplit(url).netloc)
+    at = _deadline.get()
+    attempt = 0
+    while True:
+        if not limiter.acquire(until=at):
+            raise DeadlineExceeded(f"deadline passed waiting to send {method} {url}")
+        request_timeout = timeout if at is None else min(timeout, at - time.monotonic())
+        if request_timeout <= 0:
+            limiter.release(overloaded=False)
+            raise DeadlineExceeded(f"deadline passed before {method} {url}")
+
+        _bump_request("sent")
+        overloaded, retry_after, error = True, None, None
+        try:
+            r = _session.request(method, url, timeout=request_timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        else:
+            overloaded = r.status_code == 429 or r.status_code >= 500
+            if r.status_code == 429:
+                _bump_request("throttled")
+                retry_after = _retry_after(r, attempt)
+            elif r.status_code == 503 and "Retry-After" in r.headers:
+                retry_after = _retry_after(r, attempt)
+        finally:
+            limiter.release(overloaded, retry_after)
+
+        retryable = error is not None or r.status_code == 429 or r.status_code in RETRY_STATUSES
+        if retryable and attempt < RETRIES:
+            wait = retry_after if retry_after is not None else RETRY_BACKOFF_SECONDS * 2 ** attempt
+            if at is None or time.monotonic() + wait < at:
+                if retry_after is None:
+                    time.sleep(wait)  # a 429's wait happens in the limiter
+                attempt += 1
+                continue
+        if error is not None:
+            raise error
+        return r
+
+
+# Response cache
+#
+# Opt-in per call with cache_ttl (seconds). A fresh entry is returned without
+# touching the network. A stale one that carried an ETag or Last-Modified is
+# revalidated with a conditional request, and a 304 extends it for another
+# cache_ttl. Entries are evicted least-recently-used once the cached bodies
+# exceed CACHE_MAX_BYTES.
+#
+# Cached values are shared between callers: treat them as read-only.
+
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+
+@dataclass
+class _CacheEntry:
+    value: Any
+    size: int
+    expires_at: float
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+class _ResponseCache:
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: "OrderedDict[Tuple, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Tuple, entry: _CacheEntry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old.size
+            if entry.size > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self.bytes += entry.size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.size
 
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+_cache = _ResponseCache(CACHE_MAX_BYTES)
+
+
+# Disk cache
+#
+# Cached responses are also written, zlib-compressed, to a small sqlite file
+# (HTTP_CACHE_FILE; empty disables it) so they outlive a restart. A memory
+# miss falls back to the file: an entry still within its TTL is served as is,
+# and an expired one still has its validators for a cheap conditional
+# refresh. A fresh process therefore only refetches what actually expired,
+# spread out over time the way the original fetches were, instead of
+# everything in its first second. Expiry is stored as wall-clock time.
+#
+# Entries more than DISK_CACHE_KEEP_STALE_SECONDS past expiry are dropped
+# when the file is opened, as are the oldest ones beyond DISK_CACHE_MAX_BYTES.
+
+HTTP_CACHE_FILE = os.getenv("HTTP_CACHE_FILE", "http_cache.db")
+DISK_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DISK_CACHE_KEEP_STALE_SECONDS = 86400
+
+
+class _DiskCache:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT
+                )
+                """
+            )
+            self._prune()
+
+    def _prune(self):
+        self._conn.execute(
+            "DELETE FROM responses WHERE expires_at < ?",
+            (time.time() - DISK_CACHE_KEEP_STALE_SECONDS,),
+        )
+        # Keep the most recently expiring entries that fit in the budget.
+        self._conn.execute(
+            """
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(LENGTH(body)) OVER (ORDER BY expires_at DESC) AS total
+                    FROM responses
+                ) WHERE total > ?
+            )
+            """,
+            (DISK_CACHE_MAX_BYTES,),
+        )
+
+    # The cache is optional: a locked database (several worker processes
+    # share the file), a full disk or a corrupt file is logged and treated as
+    # a miss or a skipped write, never as a failed request.
+
+    def _execute(self, sql: str, params: tuple = ()) -> Optional[sqlite3.Cursor]:
+        with self._lock:
+            try:
+                return self._conn.execute(sql, params)
+            except sqlite3.Error as e:
+                print(f"[httputil] disk cache {self.path!r}: {e}")
+                return None
+
+    def get(self, key: str) -> Optional[Tuple[bytes, float, Optional[str], Optional[str]]]:
+        """(body, seconds until expiry, etag, last_modified) or None."""
+        cursor = self._execute(
+            "SELECT body, expires_at, etag, last_modified FROM responses WHERE key = ?",
+            (key,),
+        )
+        try:
+            row = cursor.fetchone() if cursor is not None else None
+        except sqlite3.Error as e:
+            print(f"[httputil] disk cache {self.path!r}: {e}")
+            row = None
+        if row is None:
+            return None
+        body, expires_at, etag, last_modified = row
+        try:
+            body = zlib.decompress(body)
+        except zlib.error:
+            return None
+        return body, expires_at - time.time(), etag, last_modified
+
+    def put(self, key: str, body: bytes, ttl: float, etag: Optional[str], last_modified: Optional[str]):
+        self._execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+            (key, zlib.compress(body), len(body), time.time() + ttl, etag, last_modified),
+        )
+
+    def touch(self, key: str, ttl: float):
+        self._execute("UPDATE responses SET expires_at = ? WHERE key = ?", (time.time() + ttl, key))
+
+    def clear(self):
+        self._execute("DELETE FROM responses")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_disk: Optional[_DiskCache] = None
+_disk_lock = threading.Lock()
+
+
+def _disk_cache() -> Optional[_DiskCache]:
+    """The disk cache for HTTP_CACHE_FILE, (re)opened on first use or change."""
+    global _disk
+    with _disk_lock:
+        if not HTTP_CACHE_FILE:
+            return None
+        if _disk is None or _disk.path != HTTP_CACHE_FILE:
+            if _disk is not None:
+                _disk.close()
+            try:
+                _disk = _DiskCache(HTTP_CACHE_FILE)
+            except sqlite3.Error as e:
+                print(f"[httputil] disk cache {HTTP_CACHE_FILE!r} unavailable: {e}")
+                return None
+        return _disk
+
+
+def _disk_key(key: Tuple) -> str:
+    return _json.dumps(key)
+
+
+def _restore(key: Tuple, url: str) -> Optional[_CacheEntry]:
+    disk = _disk_cache()
+    stored = disk.get(_disk_key(key)) if disk is not None else None
+    if stored is None:
+        return None
+    body, ttl_left, etag, last_modified = stored
+    try:
+        value = _decode(body, url)
+    except ValueError:
+        return None
+    entry = _CacheEntry(
+        value=value,
+        size=len(body),
+        expires_at=time.monotonic() + ttl_left,
+        etag=etag,
+        last_modified=last_modified,
+    )
+    _cache.put(key, entry)
+    return entry
+
+# host -> {"hits": N, "misses": N, "revalidated": N, "restored": N}
+_cache_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+def _count(host: str, field: str):
+    with _stats_lock:
+        stats = _cache_stats.setdefault(
+            host, {"hits": 0, "misses": 0, "revalidated": 0, "restored": 0}
+        )
+        stats[field] += 1
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """Per-host cache counters since startup (or the last clear_cache)."""
+    with _stats_lock:
+        return {host: dict(stats) for host, stats in _cache_stats.items()}
+
+
+def clear_cache():
+    _cache.clear()
+    disk = _disk_cache()
+    if disk is not None:
+        disk.clear()
+    with _stats_lock:
+        _cache_stats.clear()
+
+
+def _cache_key(method: str, url: str, params: Any, body: Any) -> Tuple:
+    if isinstance(params, dict):
+        params = sorted(params.items())
+    params_text = _json.dumps(params, sort_keys=True, default=str)
+    body_hash = hashlib.sha256(
+        _json.dumps(body, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return (method, url, params_text, body_hash)
+
+
+# Request coalescing
+#
+# Identical requests (same cache key) that overlap in time share one network
+# round trip: the first caller fetches, later callers block until it finishes
+# and receive the same decoded value or exception. All of our POSTs are
+# read-only queries, so both methods are coalesced. Shared values are, again,
+# read-only.
+
+
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+_flights: Dict[Tuple, _Flight] = {}
+_flights_lock = threading.Lock()
+
+# {"sent": N, "coalesced": N, "throttled": N} since the last take_request_stats()
+_request_stats: Dict[str, int] = {"sent": 0, "coalesced": 0, "throttled": 0}
+
+
+def take_request_stats() -> Dict[str, int]:
+    """Return request counters and reset them; the engine calls this per cycle."""
+    global _request_stats
+    with _stats_lock:
+        stats, _request_stats = _request_stats, {"sent": 0, "coalesced": 0, "throttled": 0}
+    return stats
+
+
+def _bump_request(field: str):
+    with _stats_lock:
+        _request_stats[field] += 1
+
+
+def _singleflight(key: Tuple, fn: Callable[[], Any]) -> Any:
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        _bump_request("coalesced")
+        left = remaining()
+        if not flight.done.wait(None if left is None else max(0.0, left)):
+            raise DeadlineExceeded("deadline passed waiting for a coalesced request")
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    try:
+        flight.value = fn()
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+    return flight.value
+
+
+def _request_json(
+    method: str,
+    url: str,
+    *,
+    timeout: float,
+    cache_ttl: Optional[float],
+    json: Any = None,
+    **kwargs,
+) -> Any:
+    if json is not None:
+        kwargs["json"] = json
+    key = _cache_key(method, url, kwargs.get("params"), json)
+    return _singleflight(
+        key,
+        lambda: _fetch_json(key, method, url, timeout=timeout, cache_ttl=cache_ttl, **kwargs),
+    )
+
+
+def _fetch_json(
+    key: Tuple,
+    method: str,
+    url: str,
+    *,
+    timeout: float,
+    cache_ttl: Optional[float],
+    **kwargs,
+) -> Any:
+    if cache_ttl is None:
+        r = _send(method, url, timeout=timeout, **kwargs)
+        r.raise_for_status()
+        return _decode(r.content, url)
+
+    host = urlsplit(url).netloc
+    entry = _cache.get(key)
+    if entry is None:
+        entry = _restore(key, url)
+        if entry is not None:
+            _count(host, "restored")
+    now = time.monotonic()
+    if entry is not None and now < entry.expires_at:
+        _count(host, "hits")
+        return entry.value
+
+    headers = dict(kwargs.pop("headers", None) or {})
+    if entry is not None:
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+    r = _send(method, url, timeout=timeout, headers=headers, **kwargs)
+    if r.status_code == 304 and entry is not None:
+        _count(host, "revalidated")
+        entry.expires_at = time.monotonic() + cache_ttl
+        disk = _disk_cache()
+        if disk is not None:
+            disk.touch(_disk_key(key), cache_ttl)
+        return entry.value
 
-def post_json(url: str, *, json: Any = None, timeout: float = DEFAULT_TIMEOUT, **kwargs) -> Any:
-    r = _session.post(url, json=json, timeout=timeout, **kwargs)
     r.raise_for_status()
-    return r.json()
+    _count(host, "misses")
+    value = _decode(r.content, url)
+    etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+    _cache.put(key, _CacheEntry(
+        value=value,
+        size=len(r.content),
+        expires_at=time.monotonic() + cache_ttl,
+        etag=etag,
+        last_modified=last_modified,
+    ))
+    disk = _disk_cache()
+    if disk is not None:
+        disk.put(_disk_key(key), r.content, cache_ttl, etag, last_modified)
+    return value
+
+
+# JSON decoding
+#
+# Bodies are decoded from raw bytes with orjson when it is installed, and
+# with the stdlib otherwise. orjson rejects a few things the stdlib accepts
+# (NaN, Infinity), so a body it refuses gets a second try with the stdlib.
+# Decode time and body size are accumulated per URL (without query string).
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+# url -> {"calls": N, "bytes": N, "seconds": S}
+_decode_stats: Dict[str, Dict[str, float]] = {}
+
+
+def _decode(body: bytes, url: str) -> Any:
+    start = time.perf_counter()
+    if orjson is not None:
+        try:
+            value = orjson.loads(body)
+        except orjson.JSONDecodeError:
+            value = _json.loads(body)
+    else:
+        value = _json.loads(body)
+    elapsed = time.perf_counter() - start
+
+    url = url.split("?", 1)[0]
+    with _stats_lock:
+        stats = _decode_stats.setdefault(url, {"calls": 0, "bytes": 0, "seconds": 0.0})
+        stats["calls"] += 1
+        stats["bytes"] += len(body)
+        stats["seconds"] += elapsed
+    return value
+
+
+def decode_stats() -> Dict[str, Dict[str, float]]:
+    """Per-URL decode counters since startup, most decode time first."""
+    with _stats_lock:
+        items = sorted(_decode_stats.items(), key=lambda kv: kv[1]["seconds"], reverse=True)
+        return {url: dict(stats) for url, stats in items}
+
+
+def get_json(
+    url: str,
+    *,
+    timeout: float = DEFAULT_TIMEOUT,
+    cache_ttl: Optional[float] = None,
+    **kwargs,
+) -> Any:
+    return _request_json("GET", url, timeout=timeout, cache_ttl=cache_ttl, **kwargs)
+
+
+def post_json(
+    url: str,
+    *,
+    json: Any = None,
+    timeout: float = DEFAULT_TIMEOUT,
+    cache_ttl: Optional[float] = None,
+    **kwargs,
+) -> Any:
+    return _request_json("POST", url, json=json, timeout=timeout, cache_ttl=cache_ttl, **kwargs)
 
 
 def to_float(x: Any) -> float:
@@ -0,0 +1,218 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence
+
+from httputil import DEFAULT_TIMEOUT, post_json
+
+
+# Latency-ranked JSON-RPC endpoint pools.
+#
+# A chain can have several interchangeable RPC endpoints. Each call goes to
+# the best-ranked one, where rank is the EWMA latency inflated by the EWMA
+# error rate. If that endpoint has not answered by its own p95 latency, one
+# hedged duplicate goes to the next-best and whichever answers first wins.
+# An endpoint that fails outright is failed over to the next one straight
+# away. The losing request is not cancelled (threads cannot be); it finishes
+# in the background and still feeds the stats.
+#
+# Errors decay with ERROR_HALF_LIFE_SECONDS, so an endpoint that was ranked
+# last for failing gets picked again once it has been quiet for a while.
+#
+# A response carrying a JSON-RPC "error" (a provider's rate limit, "header not
+# found" on a node that is behind) counts as a failure like a transport error
+# does: it is failed over and held against the endpoint's rank. For a batch,
+# any errored item fails the whole response.
+
+LATENCY_ALPHA = 0.2
+ERROR_ALPHA = 0.2
+ERROR_HALF_LIFE_SECONDS = 300
+ERROR_PENALTY = 10           # a 10% error rate doubles an endpoint's score
+LATENCY_WINDOW = 100         # recent latencies kept for the p95 hedge delay
+HEDGE_MIN_SAMPLES = 10       # below this, hedge after DEFAULT_HEDGE_DELAY
+DEFAULT_HEDGE_DELAY = 1.0
+
+RPC_WORKERS = int(os.getenv("RPC_WORKERS", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=RPC_WORKERS, thread_name_prefix="rpc")
+
+
+def endpoints_from_env(name: str, default: Sequence[str]) -> List[str]:
+    """Comma-separated endpoint list from env var `name`, else `default`."""
+    raw = os.getenv(name, "")
+    urls = [u.strip() for u in raw.split(",") if u.strip()]
+    return urls or list(default)
+
+
+class RpcError(RuntimeError):
+    """An endpoint answered with a JSON-RPC error object."""
+
+    def __init__(self, url: str, error: Any):
+        super().__init__(f"{url}: {error}")
+        self.url = url
+        self.error = error
+
+
+def _rpc_error(response: Any) -> Any:
+    items = response if isinstance(response, list) else [response]
+    for item in items:
+        if isinstance(item, dict) and item.get("error") is not None:
+            return item["error"]
+    return None
+
+
+class _Endpoint:
+
+    def __init__(self, url: str):
+        self.url = url
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.error_at = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.wins = 0
+        self.recent: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def errors_now(self, now: float) -> float:
+        return self.error_rate * 0.5 ** ((now - self.error_at) / ERROR_HALF_LIFE_SECONDS)
+
+    def score(self, now: float) -> float:
+        # Untried endpoints score 0 so each gets a first call; one that has
+        # only ever failed is scored as if it answered at the hedge delay.
+        latency = self.latency
+        if latency is None:
+            latency = DEFAULT_HEDGE_DELAY if self.calls else 0.0
+        return latency * (1 + ERROR_PENALTY * self.errors_now(now))
+
+    def hedge_delay(self) -> float:
+        if len(self.recent) < HEDGE_MIN_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        ordered = sorted(self.recent)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+class RpcPool:
+    """
+    A set of interchangeable JSON-RPC endpoints for one chain.
+
+    call() posts a JSON-RPC payload (single or batch) and returns the decoded
+    response from whichever endpoint answered first without an error. If
+    every endpoint fails, the last error is raised (RpcError for an error
+    response).
+    """
+
+    def __init__(
+        self,
+        urls: Sequence[str],
+        *,
+        send: Callable[..., Any] = post_json,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not urls:
+            raise ValueError("RpcPool needs at least one endpoint")
+        self._endpoints = [_Endpoint(u) for u in dict.fromkeys(urls)]
+        self._send = send
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.hedged = 0
+
+    def ranked(self) -> List[str]:
+        return [ep.url for ep in self._ranked()]
+
+    def _ranked(self) -> List[_Endpoint]:
+        now = self._clock()
+        with self._lock:
+            # sorted() is stable: ties keep the configured order.
+            return sorted(self._endpoints, key=lambda ep: ep.score(now))
+
+    def _record(self, ep: _Endpoint, latency: Optional[float]):
+        now = self._clock()
+        with self._lock:
+            ep.calls += 1
+            failed = 1.0 if latency is None else 0.0
+            ep.error_rate = ep.errors_now(now) * (1 - ERROR_ALPHA) + failed * ERROR_ALPHA
+            ep.error_at = now
+            if latency is None:
+                ep.errors += 1
+                return
+            ep.recent.append(latency)
+            ep.latency = latency if ep.latency is None else (
+                ep.latency * (1 - LATENCY_ALPHA) + latency * LATENCY_ALPHA
+            )
+
+    def _attempt(self, ep: _Endpoint, payload: Any, timeout: float) -> Any:
+        start = time.perf_counter()
+        try:
+            result = self._send(ep.url, json=payload, timeout=timeout)
+            error = _rpc_error(result)
+            if error is not None:
+                raise RpcError(ep.url, error)
+        except Exception:
+            self._record(ep, None)
+            raise
+        self._record(ep, time.perf_counter() - start)
+        return result
+
+    def _submit(self, ep: _Endpoint, payload: Any, timeout: float) -> Future:
+        # Carry the caller's context (and so its httputil deadline) along.
+        ctx = contextvars.copy_context()
+        return _executor.submit(ctx.run, self._attempt, ep, payload, timeout)
+
+    def call(self, payload: Any, *, timeout: float = DEFAULT_TIMEOUT) -> Any:
+        ranked = self._ranked()
+        pending: Dict[Future, _Endpoint] = {self._submit(ranked[0], payload, timeout): ranked[0]}
+        untried = ranked[1:]
+        hedged = False
+        error: Optional[BaseException] = None
+
+        while pending:
+            # Only a lone, unhedged request gets a hedge timer; it restarts
+            # when a failed primary hands over to the next endpoint.
+            hedge_after = None
+            if untried and not hedged and len(pending) == 1:
+                hedge_after = next(iter(pending.values())).hedge_delay()
+
+            done, _ = wait(pending, timeout=hedge_after, return_when=FIRST_COMPLETED)
+            if not done:
+                ep = untried.pop(0)
+                pending[self._submit(ep, payload, timeout)] = ep
+                hedged = True
+                with self._lock:
+                    self.hedged += 1
+                continue
+
+            for fut in done:
+                ep = pending.pop(fut)
+                try:
+                    result = fut.result()
+                except Exception as e:
+                    error = e
+                    if untried:
+                        nxt = untried.pop(0)
+                        pending[self._submit(nxt, payload, timeout)] = nxt
+                    continue
+                with self._lock:
+                    ep.wins += 1
+                return result
+
+        raise error
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per endpoint, best first: EWMA latency/error rate, p95, call counts."""
+        now = self._clock()
+        with self._lock:
+            ordered = sorted(self._endpoints, key=lambda ep: ep.score(now))
+            return {
+                ep.url: {
+                    "latency": ep.latency,
+                    "error_rate": ep.errors_now(now),
+                    "p95": ep.hedge_delay() if len(ep.recent) >= HEDGE_MIN_SAMPLES else None,
+                    "calls": ep.calls,
+                    "errors": ep.errors,
+                    "wins": ep.wins,
+                }
+                for ep in ordered
+            }
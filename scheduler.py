@@ -0,0 +1,87 @@
+import heapq
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# What to do when an adapter's next slot is already in the past by the time it
+# is rescheduled (the process was suspended, or a cycle held the loop up):
+#   skip:  drop the missed slots and stay on the original grid
+#   reset: start a fresh grid one interval after now
+CATCH_UP_SKIP = "skip"
+CATCH_UP_RESET = "reset"
+CATCH_UP_POLICIES = (CATCH_UP_SKIP, CATCH_UP_RESET)
+
+
+class AdapterScheduler:
+    """
+    Min-heap of adapters keyed on next fire time.
+
+    Each adapter runs on its own grid (start, start + interval, ...), so a
+    slow fetch never shifts later slots. Jitter delays an individual firing by
+    up to `jitter` seconds without moving the grid. Lag, i.e. how late a
+    firing was popped relative to its scheduled time, is kept per adapter.
+    """
+
+    def __init__(
+        self,
+        intervals: Dict[str, float],
+        *,
+        jitter: Optional[Dict[str, float]] = None,
+        catch_up: str = CATCH_UP_SKIP,
+        clock: Callable[[], float] = time.monotonic,
+        rng: Callable[[float, float], float] = random.uniform,
+    ):
+        if catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"catch_up must be one of {CATCH_UP_POLICIES}, got {catch_up!r}")
+        self._intervals = dict(intervals)
+        self._jitter = dict(jitter or {})
+        self._catch_up = catch_up
+        self._clock = clock
+        self._rng = rng
+        self._lock = threading.Lock()
+        # (fire_at, slot, name); slot is the un-jittered grid time.
+        self._heap: List[Tuple[float, float, str]] = []
+        self.lag: Dict[str, float] = {}
+
+        start = clock()
+        for name in self._intervals:
+            self._push(name, start)
+
+    def _push(self, name: str, slot: float) -> None:
+        spread = self._jitter.get(name, 0.0)
+        fire_at = slot + (self._rng(0.0, spread) if spread > 0 else 0.0)
+        heapq.heappush(self._heap, (fire_at, slot, name))
+
+    def _next_slot(self, name: str, slot: float, now: float) -> float:
+        interval = self._intervals[name]
+        nxt = slot + interval
+        if nxt > now:
+            return nxt
+        if self._catch_up == CATCH_UP_RESET:
+            return now + interval
+        missed = int((now - slot) // interval)
+        return slot + (missed + 1) * interval
+
+    def seconds_until_next(self, now: Optional[float] = None) -> float:
+        now = self._clock() if now is None else now
+        with self._lock:
+            if not self._heap:
+                return float("inf")
+            return max(0.0, self._heap[0][0] - now)
+
+    def pop_due(self, now: Optional[float] = None) -> List[str]:
+        """
+        Pop every adapter whose fire time has passed, record its lag, and
+        schedule its next slot. Returned in fire-time order.
+        """
+        now = self._clock() if now is None else now
+        due: List[str] = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                fire_at, slot, name = heapq.heappop(self._heap)
+                self.lag[name] = now - fire_at
+                due.append(name)
+                self._push(name, self._next_slot(name, slot, now))
+        return due
@@ -0,0 +1,71 @@
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+# Allow running this script directly from repo root: `uv run python scripts/bench_abi.py ...`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from adapters import euler
+
+
+def _vault_info_payload(words: int, apy: float) -> bytes:
+    """getVaultInfoFull-shaped return data: irmInfo at word 61, interestRateInfo[1] at 67."""
+    out = [0] * words
+    out[0] = 32                               # outer tuple offset
+    out[euler._W_IRM_OFFSET] = 60 * 32        # irmInfo, relative to struct start (word 1)
+    out[61 + 4] = 6 * 32                      # interestRateInfo, relative to irmInfo
+    out[67] = 1                               # array length
+    out[68 + 3] = int(apy * euler.EULER_APY_SCALE)
+    return b"".join(euler._word(w) for w in out)
+
+
+def _legacy(data: bytes) -> float:
+    """The pre-view path: hex string, then one Python int per word."""
+    raw = ("0x" + data.hex())[2:]
+    words = [int(raw[i : i + 64], 16) for i in range(0, len(raw), 64)]
+    return euler._borrow_apy(words)
+
+
+def _view(data: bytes) -> float:
+    return euler._borrow_apy(euler._Words(memoryview(data)))
+
+
+def _per_call_us(fn, data: bytes, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn(data)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def _peak_bytes(fn, data: bytes) -> int:
+    tracemalloc.start()
+    fn(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare full-word and view-based decoding of a Euler VaultLens result.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--words", type=int, nargs="+", default=[160, 400], help="Result sizes in 32-byte words")
+    parser.add_argument("--iterations", type=int, default=20_000, help="Decodes per timing")
+    args = parser.parse_args()
+
+    print(f"{'words':>6}  {'legacy':>10}  {'view':>10}  {'legacy peak':>12}  {'view peak':>10}")
+    for words in args.words:
+        data = _vault_info_payload(words, 0.05)
+        assert abs(_legacy(data) - _view(data)) < 1e-12
+        print(
+            f"{words:>6}  {_per_call_us(_legacy, data, args.iterations):>8.2f}us"
+            f"  {_per_call_us(_view, data, args.iterations):>8.2f}us"
+            f"  {_peak_bytes(_legacy, data):>10} B  {_peak_bytes(_view, data):>8} B"
+        )
+
+
+if __name__ == "__main__":
+    main()
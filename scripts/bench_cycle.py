@@ -0,0 +1,109 @@
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import types
+
+# Allow running this script directly from repo root: `uv run python scripts/bench_cycle.py ...`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import engine
+
+
+DEFAULT_SIZES = [10, 1_000, 10_000]
+
+
+def _metrics(n: int, value: float) -> list:
+    # Rate metrics are the worst case: each one also reads/writes its :anchor.
+    return [
+        {
+            "key": f"bench:{i}:borrow:rate",
+            "name": f"Bench {i} Borrow APY",
+            "value": value,
+            "unit": "rate",
+            "adapter": "bench",
+        }
+        for i in range(n)
+    ]
+
+
+class _ConnectPerCall:
+    """db.py before batching: a fresh connection, and a commit per write, on every access."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def get_last(self, key):
+        with sqlite3.connect(self.path) as conn:
+            row = conn.execute("SELECT value FROM metrics WHERE key = ?", (key,)).fetchone()
+            return float(row[0]) if row else None
+
+    def record_sample(self, metric_key, name, value, unit=None):
+        with sqlite3.connect(self.path) as conn:
+            conn.execute(db._UPSERT_METRIC, (metric_key, name, value, unit, int(time.time())))
+            conn.commit()
+
+
+def _per_call_cycle(metrics: list):
+    """What run_once did before batching: the accesses of one rate metric, one by one."""
+    old = _ConnectPerCall(db._DB_FILE)
+    for m in metrics:
+        old.get_last(m["key"])
+        old.record_sample(metric_key=m["key"], name=m["name"], value=m["value"], unit=m["unit"])
+        old.get_last(f"{m['key']}:anchor")
+
+
+def _batched_cycle(metrics: list):
+    adapter = types.SimpleNamespace(__name__="adapters.bench", fetch=lambda: metrics)
+    engine.ADAPTERS = {"bench": adapter}
+    engine.run_once(["bench"])
+
+
+def _fresh_state():
+    engine.STATE = engine.MetricState()
+
+
+def _time(fn, metrics: list) -> float:
+    start = time.perf_counter()
+    fn(metrics)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark one engine cycle's sqlite cost at various metric counts.",
+        epilog=(
+            "Both modes run against a throwaway state.db seeded by a warm-up cycle,\n"
+            "so every key already has a row and an anchor.\n"
+            "\n"
+            "Examples:\n"
+            "  uv run python scripts/bench_cycle.py\n"
+            "  uv run python scripts/bench_cycle.py --sizes 10 100 --skip-per-call\n"
+        ),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Metric key counts")
+    parser.add_argument("--skip-per-call", action="store_true", help="Only time the batched path")
+    args = parser.parse_args()
+
+    print(f"{'keys':>8}  {'per-call':>10}  {'batched':>10}  {'speedup':>8}")
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db._DB_FILE = os.path.join(tmp, "state.db")
+            db.init_db()
+            _fresh_state()
+            _batched_cycle(_metrics(n, 0.05))  # warm-up: rows + anchors exist
+
+            per_call = None if args.skip_per_call else _time(_per_call_cycle, _metrics(n, 0.05))
+            batched = _time(_batched_cycle, _metrics(n, 0.05))
+
+        per_call_text = f"{per_call:>9.3f}s" if per_call is not None else f"{'-':>10}"
+        speedup = f"{per_call / batched:>7.1f}x" if per_call is not None else f"{'-':>8}"
+        print(f"{n:>8}  {per_call_text}  {batched:>9.3f}s  {speedup}")
+
+
+if __name__ == "__main__":
+    main()
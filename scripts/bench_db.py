@@ -0,0 +1,130 @@
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+# Allow running this script directly from repo root: `uv run python scripts/bench_db.py ...`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+
+class _ConnectPerCall:
+    """The pre-WAL db.py access pattern: fresh connection and one global lock per call."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def get_last(self, key):
+        with self.lock, sqlite3.connect(self.path) as conn:
+            row = conn.execute("SELECT value FROM metrics WHERE key = ?", (key,)).fetchone()
+            return float(row[0]) if row else None
+
+    def record_sample(self, metric_key, name, value, unit=None):
+        with self.lock, sqlite3.connect(self.path) as conn:
+            conn.execute(db._UPSERT_METRIC, (metric_key, name, value, unit, int(time.time())))
+            conn.commit()
+
+    def subscriptions_for_metric(self, key):
+        with self.lock, sqlite3.connect(self.path) as conn:
+            rows = conn.execute("SELECT user_id FROM subscriptions WHERE metric_key = ?", (key,)).fetchall()
+        return [int(u) for (u,) in rows]
+
+
+def _seed(keys: int):
+    db.record_samples([(f"bench:{i}", f"Bench {i}", float(i), "rate") for i in range(keys)])
+    for i in range(0, keys, 10):
+        db.add_subscription(i, f"bench:{i}")
+
+
+def _ops_per_sec(fn, n: int) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return n / (time.perf_counter() - start)
+
+
+def _read_latency_under_write(impl, keys: int, seconds: float) -> list:
+    """Time subscriptions_for_metric calls while another thread writes nonstop."""
+    stop = threading.Event()
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            impl.record_sample(f"bench:{i % keys}", "Bench", float(i), "rate")
+            i += 1
+
+    t = threading.Thread(target=writer)
+    t.start()
+    latencies = []
+    end = time.monotonic() + seconds
+    i = 0
+    while time.monotonic() < end:
+        start = time.perf_counter()
+        impl.subscriptions_for_metric(f"bench:{i % keys}")
+        latencies.append(time.perf_counter() - start)
+        i += 1
+    stop.set()
+    t.join()
+    return latencies
+
+
+def _pct(values: list, q: float) -> float:
+    return statistics.quantiles(values, n=100)[int(q) - 1] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare db.py's persistent WAL connections with connect-per-call access.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--keys", type=int, default=1_000, help="Metric rows to seed")
+    parser.add_argument("--ops", type=int, default=2_000, help="Calls per throughput measurement")
+    parser.add_argument("--seconds", type=float, default=3.0, help="Duration of the read-under-write test")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db._DB_FILE = os.path.join(tmp, "state.db")
+        db.init_db()
+        _seed(args.keys)
+
+        # The old layout kept sqlite's default rollback journal, so give it
+        # its own copy rather than letting it inherit WAL from state.db.
+        legacy = os.path.join(tmp, "legacy.db")
+        with sqlite3.connect(db._DB_FILE) as src, sqlite3.connect(legacy) as dst:
+            src.backup(dst)
+            dst.execute("PRAGMA journal_mode=DELETE")
+        old = _ConnectPerCall(legacy)
+
+        print(f"{'operation':<28} {'per-call':>12} {'persistent':>12}")
+        for label, old_fn, new_fn in (
+            ("get_last", lambda i: old.get_last(f"bench:{i % args.keys}"),
+                         lambda i: db.get_last(f"bench:{i % args.keys}")),
+            ("record_sample", lambda i: old.record_sample(f"bench:{i % args.keys}", "Bench", 1.0, "rate"),
+                              lambda i: db.record_sample(f"bench:{i % args.keys}", "Bench", 1.0, "rate")),
+            ("subscriptions_for_metric", lambda i: old.subscriptions_for_metric(f"bench:{i % args.keys}"),
+                                         lambda i: db.subscriptions_for_metric(f"bench:{i % args.keys}")),
+        ):
+            print(
+                f"{label:<28} {_ops_per_sec(old_fn, args.ops):>8.0f} op/s "
+                f"{_ops_per_sec(new_fn, args.ops):>8.0f} op/s"
+            )
+
+        print()
+        print(f"subscriptions_for_metric latency while a writer thread runs ({args.seconds:g}s):")
+        for label, impl in (("per-call", old), ("persistent", db)):
+            lat = _read_latency_under_write(impl, args.keys, args.seconds)
+            print(
+                f"  {label:<11} n={len(lat):<7} p50={_pct(lat, 50):.3f}ms "
+                f"p99={_pct(lat, 99):.3f}ms max={max(lat) * 1000:.3f}ms"
+            )
+        db.close_db()
+
+
+if __name__ == "__main__":
+    main()
@@ -16,7 +16,10 @@ def main():
         description="Purge metric keys from state.db.",
         epilog=(
             "Each key (and its :anchor sibling for rate metrics) is removed from\n"
-            "the metrics table. All user subscriptions to that key are also deleted.\n"
+            "the metrics table. All user subscriptions to that key and its sample\n"
+            "history are also deleted.\n"
+            "Stop the bot first: it keeps metric state in memory and would otherwise\n"
+            "carry purged anchors forward.\n"
             "\n"
             "Examples:\n"
             "  uv run python scripts/purge_metrics.py euler:sentora:syrupusdc:pyusd:supply:cap_util\n"
@@ -39,7 +42,8 @@ def main():
         print(
             f"{key}{anchor_note}: "
             f"{counts['metrics']} metric row(s), "
-            f"{counts['subscriptions']} subscription(s) removed"
+            f"{counts['subscriptions']} subscription(s), "
+            f"{counts['samples']} history sample(s) removed"
         )
 
 
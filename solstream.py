@@ -0,0 +1,157 @@
+import asyncio
+import base64
+import json
+import random
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+
+
+# Push-based Solana account updates over accountSubscribe.
+#
+# An AccountStream keeps one websocket open, subscribes to every account
+# accounts() returns, and hands the raw account data of whatever changed to
+# on_update(). Reserves and similar accounts change on nearly every slot they
+# are touched in, so updates are batched: the first change after a quiet
+# period opens a `debounce`-second window, and when it closes on_update gets
+# the latest data of every account that changed inside it.
+#
+# A dropped connection is retried with exponential backoff, which resets once
+# a connection has all its subscriptions confirmed. accounts() is called again
+# on every (re)connect, which is where callers take a fresh snapshot to cover
+# whatever changed while the socket was down, and every `refresh` seconds
+# while it stays up, so accounts that appear or go away are (un)subscribed.
+
+DEBOUNCE_SECONDS = 2.0
+RECONNECT_MIN_SECONDS = 1.0
+RECONNECT_MAX_SECONDS = 60.0
+HEARTBEAT_SECONDS = 30.0
+COMMITMENT = "confirmed"
+
+
+def ws_url(http_url: str) -> str:
+    """The websocket URL Solana RPCs serve next to their HTTP endpoint."""
+    if http_url.startswith("https://"):
+        return "wss://" + http_url[len("https://"):]
+    if http_url.startswith("http://"):
+        return "ws://" + http_url[len("http://"):]
+    return http_url
+
+
+class AccountStream:
+
+    def __init__(
+        self,
+        url: str,
+        accounts: Callable[[], Awaitable[List[str]]],
+        on_update: Callable[[Dict[str, bytes]], Awaitable[None]],
+        *,
+        debounce: float = DEBOUNCE_SECONDS,
+        refresh: Optional[float] = None,
+    ):
+        self.url = url
+        self._accounts = accounts
+        self._on_update = on_update
+        self._debounce = debounce
+        self._refresh = refresh
+        self._backoff = RECONNECT_MIN_SECONDS
+        self._pending: Dict[str, bytes] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.connects = 0
+        self.notifications = 0
+
+    async def run(self):
+        """Stream until cancelled, reconnecting on any error."""
+        async with aiohttp.ClientSession() as session:
+            while True:
+                try:
+                    await self._run_once(session)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"[solstream] {self.url}: {e!r}, reconnecting in {self._backoff:.0f}s")
+                await asyncio.sleep(self._backoff * random.uniform(0.8, 1.2))
+                self._backoff = min(RECONNECT_MAX_SECONDS, self._backoff * 2)
+
+    async def _run_once(self, session: aiohttp.ClientSession):
+        async with session.ws_connect(self.url, heartbeat=HEARTBEAT_SECONDS) as ws:
+            loop = asyncio.get_running_loop()
+            requests: Dict[int, tuple] = {}       # request id -> (method, account)
+            subscriptions: Dict[str, int] = {}    # account -> subscription id
+            by_subscription: Dict[int, str] = {}
+            next_id = 0
+
+            async def sync(wanted: List[str]):
+                nonlocal next_id
+                for account in wanted:
+                    if account in subscriptions or ("accountSubscribe", account) in requests.values():
+                        continue
+                    requests[next_id] = ("accountSubscribe", account)
+                    await ws.send_json({
+                        "jsonrpc": "2.0",
+                        "id": next_id,
+                        "method": "accountSubscribe",
+                        "params": [account, {"encoding": "base64", "commitment": COMMITMENT}],
+                    })
+                    next_id += 1
+                for account in set(subscriptions) - set(wanted):
+                    subscription = subscriptions.pop(account)
+                    by_subscription.pop(subscription, None)
+                    requests[next_id] = ("accountUnsubscribe", account)
+                    await ws.send_json({
+                        "jsonrpc": "2.0", "id": next_id, "method": "accountUnsubscribe", "params": [subscription],
+                    })
+                    next_id += 1
+
+            await sync(await self._accounts())
+            self.connects += 1
+            confirmed = False
+            refresh_at = None if self._refresh is None else loop.time() + self._refresh
+
+            while True:
+                timeout = None if refresh_at is None else max(0.0, refresh_at - loop.time())
+                try:
+                    msg = await ws.receive(timeout=timeout)
+                except asyncio.TimeoutError:
+                    await sync(await self._accounts())
+                    refresh_at = loop.time() + self._refresh
+                    continue
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    break
+                data = json.loads(msg.data)
+                if "id" in data:
+                    method, account = requests.pop(data["id"], (None, None))
+                    if "error" in data:
+                        raise RuntimeError(f"{method} failed for {account}: {data['error']}")
+                    if method == "accountSubscribe":
+                        subscriptions[account] = data["result"]
+                        by_subscription[data["result"]] = account
+                    if not confirmed and not requests:
+                        # A healthy connection again: the next drop starts
+                        # from the shortest backoff.
+                        confirmed = True
+                        self._backoff = RECONNECT_MIN_SECONDS
+                        print(f"[solstream] {self.url}: subscribed to {len(subscriptions)} accounts")
+                elif data.get("method") == "accountNotification":
+                    params = data["params"]
+                    account = by_subscription.get(params["subscription"])
+                    value = params["result"]["value"]
+                    if account is None or value is None:
+                        continue
+                    self.notifications += 1
+                    self._push(account, base64.b64decode(value["data"][0]))
+            raise ConnectionError(f"websocket closed ({ws.close_code})")
+
+    def _push(self, account: str, data: bytes):
+        self._pending[account] = data
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self._debounce)
+        updates, self._pending = self._pending, {}
+        self._flush_task = None
+        try:
+            await self._on_update(updates)
+        except Exception as e:
+            print(f"[solstream] update handler failed: {e!r}")
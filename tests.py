@@ -1,9 +1,32 @@
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import math
 import os
 import sqlite3
+import sys
 import tempfile
+import threading
+import time
+import types
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
+import requests
+
+import asyncdb
+import db
+import engine
+import httputil
+import rpcpool
+import solstream
+import workers
+from adapters import euler, kamino
 from engine import ADAPTERS
+from scheduler import CATCH_UP_RESET, AdapterScheduler
 from db import purge_keys
 
 
@@ -82,6 +105,22 @@ def _keys_in_db(conn, table, column) -> set:
     return {row[0] for row in cur.fetchall()}
 
 
+class _StateDbTestCase(unittest.TestCase):
+    """Runs each test against a fresh, initialised state.db in a temp file."""
+
+    def setUp(self):
+        self.tmp = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+        self.tmp.close()
+        patcher = mock.patch.object(db, "_DB_FILE", self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        db.init_db()
+
+    def tearDown(self):
+        db.close_db()
+        os.unlink(self.tmp.name)
+
+
 class TestPurgeMetrics(unittest.TestCase):
 
     def setUp(self):
@@ -181,5 +220,1422 @@ class TestPurgeMetrics(unittest.TestCase):
         self.assertEqual(results[key]["subscriptions"], 1)
 
 
+def _fake_adapter(name, metrics, delay=0.0, gate=None):
+    def fetch():
+        if gate is not None:
+            gate.wait()
+        time.sleep(delay)
+        return [dict(m, adapter=name) for m in metrics]
+    return types.SimpleNamespace(__name__=f"adapters.{name}", fetch=fetch)
+
+
+class TestRunOnce(_StateDbTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for target, value in (
+            ("_inflight", {}),
+            ("_busy", set()),
+            ("STATE", engine.MetricState()),
+        ):
+            patcher = mock.patch.object(engine, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _run(self, adapters):
+        with mock.patch.object(engine, "ADAPTERS", adapters):
+            return engine.run_once(list(adapters))
+
+    def test_fetches_run_in_parallel(self):
+        rate = {"key": "k", "name": "K", "value": 0.05, "unit": "rate"}
+        adapters = {
+            f"a{i}": _fake_adapter(f"a{i}", [dict(rate, key=f"a{i}:rate")], delay=0.3)
+            for i in range(4)
+        }
+        start = time.monotonic()
+        self._run(adapters)
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(set(engine.LAST_CYCLE["adapters"]), set(adapters))
+
+    def test_alerts_follow_adapter_order(self):
+        rate = {"name": "K", "value": 0.05, "unit": "rate"}
+        adapters = {
+            "slow": _fake_adapter("slow", [dict(rate, key="slow:rate")], delay=0.2),
+            "fast": _fake_adapter("fast", [dict(rate, key="fast:rate")]),
+        }
+        alerts = self._run(adapters)
+        self.assertEqual([a["metric_key"] for a in alerts], ["slow:rate", "fast:rate"])
+
+    def test_overrunning_adapter_becomes_engine_alert(self):
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+        hung = _fake_adapter("hung", [], gate=gate)
+        hung.FETCH_TIMEOUT_SECONDS = 0.1
+        adapters = {
+            "hung": hung,
+            "ok": _fake_adapter("ok", [{"key": "ok:rate", "name": "OK", "value": 0.05, "unit": "rate"}]),
+        }
+        alerts = self._run(adapters)
+        engine_alerts = [a for a in alerts if a["category"] == "engine"]
+        self.assertEqual(len(engine_alerts), 1)
+        self.assertIn("hung", engine_alerts[0]["value"])
+        self.assertIsNone(engine.LAST_CYCLE["adapters"]["hung"])
+        self.assertIn("ok:rate", {a.get("metric_key") for a in alerts})
+
+        # Still hung on the next cycle: skipped without a second alert.
+        self.assertEqual(self._run(adapters), [])
+
+    def test_failed_prune_keeps_the_cycle_alerts(self):
+        rate = {"key": "k:rate", "name": "K", "value": 0.05, "unit": "rate"}
+        with mock.patch.object(engine, "_last_prune_at", None), \
+                mock.patch.object(engine, "prune_history", side_effect=sqlite3.OperationalError("database is locked")), \
+                contextlib.redirect_stdout(io.StringIO()) as out:
+            alerts = self._run({"a": _fake_adapter("a", [rate])})
+            self.assertIsNone(engine._last_prune_at)
+        self.assertEqual([a["metric_key"] for a in alerts], ["k:rate"])
+        self.assertIn("pruning history failed", out.getvalue())
+
+    def test_fetch_runs_under_its_deadline(self):
+        seen = {}
+
+        def fetch():
+            seen["left"] = httputil.remaining()
+            return []
+
+        adapter = types.SimpleNamespace(__name__="adapters.a", fetch=fetch, FETCH_TIMEOUT_SECONDS=5)
+        self._run({"a": adapter})
+        self.assertTrue(4 < seen["left"] <= 5)
+
+    def test_adapter_origins_from_url_constants(self):
+        a = _fake_adapter("a", [])
+        a.LIVE_URL = "https://api.example.com/v1/live"
+        a.RPC_URLS = {1: "https://rpc.example.org/1", 2: "https://rpc.example.org/2"}
+        a.TEMPLATE_URL = "https://{chain}.example.net/x"
+        a.NAME = "not a url"
+        with mock.patch.object(engine, "ADAPTERS", {"a": a}):
+            self.assertEqual(
+                engine.adapter_origins(),
+                ["https://api.example.com", "https://rpc.example.org"],
+            )
+
+    def test_pairs_added_during_fetch_count_on_the_first_cycle(self):
+        supply_key, borrow_key = "d:x:y:supply:cap_util", "d:x:y:borrow:cap_util"
+        adapter = _fake_adapter("d", [
+            {"key": supply_key, "name": "D Supply Cap Utilization", "value": 0.5, "unit": "ratio"},
+            {"key": borrow_key, "name": "D Borrow Cap Utilization", "value": 0.5, "unit": "ratio"},
+        ])
+        adapter.PAIRED_CAPS = []
+        fetch = adapter.fetch
+
+        def discovering_fetch():
+            # Like Euler discovery: the pair only exists once fetch has run.
+            adapter.PAIRED_CAPS[:] = [{
+                "pair_name": "D X/Y", "supply_key": supply_key, "borrow_key": borrow_key, "adapter": "d",
+            }]
+            return fetch()
+
+        adapter.fetch = discovering_fetch
+        for key in (supply_key, borrow_key):
+            engine.STATE.record_sample(metric_key=key, name="D", value=1.0, unit="ratio")
+        engine.STATE.flush()
+
+        with mock.patch.object(engine, "ADAPTERS", {"d": adapter}):
+            alerts = engine.run_once(["d"])
+
+        self.assertEqual([(a["level"], a["metric_key"]) for a in alerts], [("major", supply_key)])
+
+    def test_ingest_waits_for_a_running_cycle_of_the_adapter(self):
+        metric = {"key": "s:x:borrow:available", "name": "S", "value": 50, "unit": "available", "adapter": "s"}
+        engine._busy.add("s")   # a run_once(["s"]) in progress
+        done = threading.Event()
+        worker = threading.Thread(target=lambda: (engine.ingest("s", [metric]), done.set()))
+        worker.start()
+        self.assertFalse(done.wait(0.2))
+        with engine._busy_released:
+            engine._busy.discard("s")
+            engine._busy_released.notify_all()
+        self.assertTrue(done.wait(5))
+        worker.join()
+        self.assertNotIn("s", engine._busy)
+
+    def test_streaming_adapter_is_not_scheduled_and_ingests(self):
+        polled = _fake_adapter("a", [])
+        streamed = _fake_adapter("s", [])
+        streamed.STREAMING = True
+        with mock.patch.object(engine, "ADAPTERS", {"a": polled, "s": streamed}):
+            self.assertEqual(list(engine.adapter_intervals()), ["a"])
+            self.assertEqual(engine.streaming_adapters(), ["s"])
+
+            metric = {"key": "s:x:borrow:available", "name": "S", "unit": "available", "adapter": "s"}
+            self.assertEqual(engine.ingest("s", [dict(metric, value=50)]), [])
+            alerts = engine.ingest("s", [dict(metric, value=200_000)])
+
+        self.assertEqual([a["metric_key"] for a in alerts], ["s:x:borrow:available"])
+        self.assertEqual(engine.STATE.get_last("s:x:borrow:available"), 200_000)
+
+
+class TestBot(unittest.TestCase):
+
+    def test_on_ready_starts_the_alert_loop(self):
+        import bot
+
+        loop = mock.Mock()
+        loop.is_running.return_value = False
+        with mock.patch.object(bot.asyncdb, "init_db", mock.AsyncMock()), \
+                mock.patch.object(bot.loop_lag, "run", mock.AsyncMock()), \
+                mock.patch.object(bot, "_loop_lag_task", None), \
+                mock.patch.object(bot, "alert_loop", loop), \
+                mock.patch.object(bot, "streaming_adapters", lambda: []), \
+                mock.patch.object(bot, "prewarm_connections", side_effect=OSError("no network")):
+            asyncio.run(bot.on_ready())
+        loop.start.assert_called_once()
+
+    def test_stream_updates_are_decoded_off_the_event_loop(self):
+        import bot
+
+        threads = []
+        mod = types.SimpleNamespace(
+            STREAM_URL="ws://unused",
+            STREAM_DEBOUNCE_SECONDS=0,
+            metrics_from_accounts=lambda updates: threads.append(threading.current_thread()) or [],
+        )
+        streams = []
+
+        class Stream:
+            def __init__(self, url, accounts, on_update, **kwargs):
+                self.on_update = on_update
+                streams.append(self)
+
+            async def run(self):
+                await self.on_update({"Res1": b""})
+
+        ingest = mock.Mock(side_effect=lambda name, metrics: threads.append(threading.current_thread()) or [])
+        with mock.patch.dict(bot.ADAPTERS, {"s": mod}), \
+                mock.patch.object(bot, "AccountStream", Stream), \
+                mock.patch.object(bot, "ingest", ingest):
+            asyncio.run(bot.stream_adapter("s"))
+        self.assertEqual(len(threads), 2)
+        self.assertIs(threads[0], threads[1])
+        self.assertIsNot(threads[0], threading.main_thread())
+
+
+class TestBatchedPersistence(_StateDbTestCase):
+
+    def test_record_samples_round_trips_through_load_metric_values(self):
+        db.record_samples([(f"k{i}", f"K{i}", float(i), "rate") for i in range(1200)])
+        last = db.load_metric_values()
+        self.assertEqual(len(last), 1200)
+        self.assertEqual(last["k1199"], 1199.0)
+
+    def test_later_rows_win(self):
+        db.record_samples([("k", "K", 1.0, "rate"), ("k", "K", 2.0, "rate")])
+        self.assertEqual(db.get_last("k"), 2.0)
+
+    def test_reads_do_not_wait_for_the_writer(self):
+        db.record_samples([("k", "K", 1.0, "rate")])
+        with db._LOCK:  # as if the engine were mid-commit
+            self.assertEqual(db.get_last("k"), 1.0)
+            self.assertEqual(db.list_metrics()[0]["key"], "k")
+
+    def test_uses_wal(self):
+        with db._read() as conn:
+            mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+
+    def test_cycle_commits_once(self):
+        adapter = _fake_adapter("a", [
+            {"key": f"a:{i}:rate", "name": "A", "value": 0.05, "unit": "rate"}
+            for i in range(50)
+        ])
+        with mock.patch.object(engine, "ADAPTERS", {"a": adapter}), \
+                mock.patch.object(engine, "STATE", engine.MetricState()), \
+                mock.patch.object(engine, "_last_prune_at", time.monotonic()), \
+                mock.patch.object(db, "_read", wraps=db._read) as read, \
+                mock.patch.object(db, "_write", wraps=db._write) as write:
+            engine.run_once(["a"])
+            engine.run_once(["a"])
+        self.assertEqual(read.call_count, 1)    # state loaded once
+        self.assertEqual(write.call_count, 2)   # one commit per cycle
+        self.assertEqual(db.get_last("a:49:rate:anchor"), 0.05)
+
+    def test_metric_state_seeds_from_db_and_flushes_latest(self):
+        db.record_samples([("k", "K", 1.0, "rate")])
+        state = engine.MetricState()
+        self.assertEqual(state.get_last("k"), 1.0)
+        state.record_sample("k", "K", 2.0, "rate")
+        state.record_sample("k", "K", 3.0, "rate")
+        self.assertEqual(state.get_last("k"), 3.0)
+        self.assertEqual(db.get_last("k"), 1.0)
+        state.flush()
+        self.assertEqual(db.get_last("k"), 3.0)
+
+
+
+class TestSampleHistory(_StateDbTestCase):
+
+    def _record_at(self, ts, rows):
+        with mock.patch.object(db.time, "time", return_value=ts):
+            db.record_samples(rows)
+
+    def test_samples_append_and_skip_anchors(self):
+        self._record_at(7_200, [("k", "K", 1.0, "rate"), ("k:anchor", "K (anchor)", 1.0, "rate")])
+        self._record_at(7_500, [("k", "K", 3.0, "rate")])
+        self.assertEqual(db.sample_history("k", 0), [(7_200, 1.0), (7_500, 3.0)])
+        self.assertEqual(db.sample_history("k:anchor", 0), [])
+        self.assertEqual(db.get_last("k"), 3.0)
+
+    def test_rollups_track_min_max_avg(self):
+        for ts, v in ((3_600, 2.0), (3_900, 6.0), (4_200, 1.0), (7_200, 5.0)):
+            self._record_at(ts, [("k", "K", v, "rate")])
+        hourly = db.rollup_history("k", 3_600, 0)
+        self.assertEqual(
+            [(b["start"], b["min"], b["max"], b["avg"], b["count"]) for b in hourly],
+            [(3_600, 1.0, 6.0, 3.0, 3), (7_200, 5.0, 5.0, 5.0, 1)],
+        )
+        daily = db.rollup_history("k", 86_400, 0)
+        self.assertEqual(daily[0]["count"], 4)
+
+    def test_repeat_writes_in_one_second_count_once(self):
+        self._record_at(3_600, [("k", "K", 2.0, "rate"), ("k", "K", 4.0, "rate")])
+        self._record_at(3_600, [("k", "K", 8.0, "rate")])
+        self.assertEqual(db.sample_history("k", 0), [(3_600, 4.0)])
+        hourly = db.rollup_history("k", 3_600, 0)
+        self.assertEqual(
+            [(b["min"], b["max"], b["avg"], b["count"]) for b in hourly],
+            [(4.0, 4.0, 4.0, 1)],
+        )
+
+    def test_repeat_batches_past_one_lookup_chunk_count_once(self):
+        rows = [(f"k{i}", f"K{i}", float(i), "rate") for i in range(db._IN_CHUNK * 2 + 1)]
+        self._record_at(3_600, rows)
+        self._record_at(3_600, rows)
+        self.assertEqual(db.rollup_history(rows[-1][0], 3_600, 0)[0]["count"], 1)
+
+    def test_prune_drops_expired_rows_only(self):
+        self._record_at(1_000, [("k", "K", 1.0, "rate")])
+        now = 1_000 + db.SAMPLE_RETENTION_SECONDS + 1
+        self._record_at(now, [("k", "K", 2.0, "rate")])
+        deleted = db.prune_history(now)
+        self.assertEqual(deleted["samples"], 1)
+        self.assertEqual(db.sample_history("k", 0), [(now, 2.0)])
+        self.assertEqual(db.rollup_history("k", 86_400, 0)[0]["count"], 1)
+
+    def test_purge_removes_history(self):
+        self._record_at(1_000, [("k", "K", 1.0, "rate")])
+        results = purge_keys(self.tmp.name, ["k"])
+        self.assertEqual(results["k"]["samples"], 1)
+        self.assertEqual(db.rollup_history("k", 3_600, 0), [])
+
+
+class TestSubscriptionIndex(_StateDbTestCase):
+
+    def test_index_loads_existing_rows(self):
+        with sqlite3.connect(self.tmp.name) as conn:
+            _insert_subscription(conn, 7, "k")
+            conn.commit()
+        db.close_db()  # force a fresh load
+        self.assertEqual(db.subscriptions_for_metric("k"), [7])
+        self.assertEqual(db.list_subscriptions(7), ["k"])
+
+    def test_add_remove_keep_index_in_step(self):
+        self.assertTrue(db.add_subscription(1, "k"))
+        self.assertFalse(db.add_subscription(1, "k"))
+        db.add_subscription(2, "k")
+        db.add_subscription(1, "j")
+        self.assertEqual(db.subscriptions_for_metric("k"), [1, 2])
+        self.assertEqual(db.list_subscriptions(1), ["j", "k"])
+
+        self.assertTrue(db.remove_subscription(1, "k"))
+        self.assertEqual(db.subscriptions_for_metric("k"), [2])
+        self.assertEqual(db.list_subscriptions(1), ["j"])
+
+    def test_lookups_do_not_touch_sqlite(self):
+        db.add_subscription(1, "k")
+        with mock.patch.object(db, "_read") as read:
+            db.subscriptions_for_metric("k")
+            db.list_subscriptions(1)
+        read.assert_not_called()
+
+    def test_purge_updates_index(self):
+        db.add_subscription(1, "k")
+        purge_keys(self.tmp.name, ["k"])
+        self.assertEqual(db.subscriptions_for_metric("k"), [])
+        self.assertEqual(db.list_subscriptions(1), [])
+
+
+class TestAsyncDb(_StateDbTestCase):
+
+    def test_loop_keeps_running_while_writer_is_busy(self):
+        async def scenario():
+            monitor = asyncdb.LoopLagMonitor(tick=0.01, report_every=3600)
+            stop = asyncio.Event()
+            watcher = asyncio.create_task(monitor.run(stop))
+
+            db._LOCK.acquire()  # engine mid-commit
+            threading.Timer(0.3, db._LOCK.release).start()
+            start = time.perf_counter()
+            created = await asyncdb.add_subscription(1, "k")
+            waited = time.perf_counter() - start
+
+            stop.set()
+            await watcher
+            return created, waited, monitor.snapshot()
+
+        created, waited, stats = asyncio.run(scenario())
+        self.assertTrue(created)
+        self.assertGreaterEqual(waited, 0.25)
+        self.assertGreater(stats["ticks"], 10)
+        self.assertLess(stats["max_lag"], 0.1)
+        self.assertEqual(db.subscriptions_for_metric("k"), [1])
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so client connection reuse shows
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length) if length else b""
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path, dict(self.headers)))
+        self.server.respond(self)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubServer:
+    """Local HTTP server; `respond(handler)` writes each response."""
+
+    def __init__(self, respond):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.respond = respond
+        self.httpd.requests = []
+        self.httpd.lock = threading.Lock()
+        threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True).start()
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def url(self, path="/"):
+        return f"http://127.0.0.1:{self.httpd.server_port}{path}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class TestHttpUtil(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch.object(httputil, "HTTP_CACHE_FILE", os.path.join(tmp.name, "http_cache.db"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: httputil._disk_cache().close())
+        httputil.clear_cache()
+        self.hits = 0
+
+        def respond(handler):
+            self.hits += 1
+            if handler.headers.get("If-None-Match") == '"v1"':
+                handler.send_response(304)
+                handler.end_headers()
+                return
+            handler.send_json({"n": self.hits, "path": handler.path}, headers={"ETag": '"v1"'})
+
+        self.server = StubServer(respond)
+        self.addCleanup(self.server.close)
+
+    def test_uncached_by_default(self):
+        httputil.get_json(self.server.url())
+        httputil.get_json(self.server.url())
+        self.assertEqual(self.hits, 2)
+
+    def test_fresh_entry_skips_network(self):
+        first = httputil.get_json(self.server.url(), cache_ttl=60)
+        second = httputil.get_json(self.server.url(), cache_ttl=60)
+        self.assertEqual(first, second)
+        self.assertEqual(self.hits, 1)
+        host = f"127.0.0.1:{self.server.httpd.server_port}"
+        self.assertEqual(httputil.cache_stats()[host], {"hits": 1, "misses": 1, "revalidated": 0, "restored": 0})
+
+    def test_key_includes_params_and_body(self):
+        httputil.get_json(self.server.url(), params={"a": 1}, cache_ttl=60)
+        httputil.get_json(self.server.url(), params={"a": 2}, cache_ttl=60)
+        httputil.post_json(self.server.url(), json={"q": 1}, cache_ttl=60)
+        httputil.post_json(self.server.url(), json={"q": 2}, cache_ttl=60)
+        self.assertEqual(self.hits, 4)
+
+    def test_stale_entry_revalidates_with_etag(self):
+        first = httputil.get_json(self.server.url(), cache_ttl=0)
+        second = httputil.get_json(self.server.url(), cache_ttl=0)
+        self.assertEqual(first, second)
+        self.assertEqual(self.hits, 2)
+        self.assertEqual(self.server.requests[-1][2].get("If-None-Match"), '"v1"')
+
+    def test_entries_survive_a_restart_via_disk(self):
+        first = httputil.get_json(self.server.url(), cache_ttl=60)
+        httputil._cache.clear()   # a new process starts with an empty memory cache
+        self.assertEqual(httputil.get_json(self.server.url(), cache_ttl=60), first)
+        self.assertEqual(self.hits, 1)
+        host = f"127.0.0.1:{self.server.httpd.server_port}"
+        self.assertEqual(httputil.cache_stats()[host]["restored"], 1)
+
+    def test_disk_cache_errors_fall_through_to_the_network(self):
+        disk = httputil._disk_cache()
+        with mock.patch.object(disk, "_conn") as conn:
+            conn.execute.side_effect = sqlite3.OperationalError("database is locked")
+            httputil.get_json(self.server.url(), cache_ttl=60)
+            httputil._cache.clear()   # nothing could be restored: fetch again
+            self.assertEqual(httputil.get_json(self.server.url(), cache_ttl=60)["n"], 2)
+        self.assertEqual(self.hits, 2)
+
+    def test_expired_disk_entry_revalidates(self):
+        first = httputil.get_json(self.server.url(), cache_ttl=0)
+        httputil._cache.clear()
+        self.assertEqual(httputil.get_json(self.server.url(), cache_ttl=60), first)
+        self.assertEqual(self.server.requests[-1][2].get("If-None-Match"), '"v1"')
+
+        httputil._cache.clear()   # the 304 extended the stored entry as well
+        httputil.get_json(self.server.url(), cache_ttl=60)
+        self.assertEqual(self.hits, 2)
+
+    def test_concurrent_identical_requests_share_one_round_trip(self):
+        gate = threading.Event()
+        slow = StubServer(lambda h: (gate.wait(5), h.send_json({"ok": True})))
+        self.addCleanup(slow.close)
+        httputil.take_request_stats()
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(httputil.post_json(slow.url(), json={"id": 1})))
+            for _ in range(5)
+        ]
+        for th in threads:
+            th.start()
+        time.sleep(0.2)
+        gate.set()
+        for th in threads:
+            th.join()
+
+        self.assertEqual(len(slow.requests), 1)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertEqual(httputil.take_request_stats(), {"sent": 1, "coalesced": 4, "throttled": 0})
+
+    def test_coalesced_callers_share_errors(self):
+        gate = threading.Event()
+        failing = StubServer(lambda h: (gate.wait(5), h.send_json({}, status=404)))
+        self.addCleanup(failing.close)
+
+        errors = []
+
+        def call():
+            try:
+                httputil.get_json(failing.url())
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for th in threads:
+            th.start()
+        time.sleep(0.2)
+        gate.set()
+        for th in threads:
+            th.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(len(failing.requests), 1)
+
+    def test_decode_records_bytes_and_time_per_url(self):
+        httputil.get_json(self.server.url("/a?x=1"))
+        httputil.get_json(self.server.url("/a?x=2"))
+        stats = httputil.decode_stats()[self.server.url("/a")]
+        self.assertEqual(stats["calls"], 2)
+        self.assertGreater(stats["bytes"], 0)
+
+    def test_stdlib_fallback_without_fast_backend(self):
+        with mock.patch.object(httputil, "orjson", None):
+            self.assertEqual(httputil._decode(b'{"a": [1, 2.5]}', "u"), {"a": [1, 2.5]})
+
+    @unittest.skipIf(httputil.orjson is None, "orjson not installed")
+    def test_fast_backend_falls_back_on_nan(self):
+        self.assertTrue(httputil._decode(b'{"a": NaN}', "u")["a"] != 0)
+
+    def _pool(self):
+        return httputil.pool_stats()[f"127.0.0.1:{self.server.httpd.server_port}"]
+
+    def test_connections_are_kept_alive(self):
+        httputil.get_json(self.server.url("/a"))
+        httputil.get_json(self.server.url("/b"))
+        self.assertEqual(self._pool()["created"], 1)
+        self.assertEqual(self._pool()["reused"], 1)
+
+    def test_prewarm_opens_connections_for_later_requests(self):
+        origin = self.server.url("").rstrip("/")
+        self.assertEqual(httputil.prewarm([origin], connections=2), {origin: 2})
+        httputil.get_json(self.server.url("/a"))
+        self.assertEqual(self._pool(), {"created": 2, "reused": 1})
+
+    def test_prewarm_failure_counts_as_zero(self):
+        origin = "https://broken.example.com"
+        with mock.patch.object(httputil._session, "get_adapter", side_effect=requests.exceptions.SSLError("bad cert")):
+            self.assertEqual(httputil.prewarm([origin]), {origin: 0})
+
+    def test_requests_wait_for_a_free_connection(self):
+        origin = self.server.url("").rstrip("/")
+        httputil.configure_host(origin, maxsize=1)
+        self.addCleanup(httputil._session.adapters.pop, origin + "/")
+
+        def respond(handler):
+            time.sleep(0.2)
+            handler.send_json({})
+
+        self.server.httpd.respond = respond
+        threads = [threading.Thread(target=httputil.get_json, args=(self.server.url(f"/{i}"),)) for i in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(self._pool()["created"], 1)
+        self.assertEqual(httputil.limiter_stats()[f"127.0.0.1:{self.server.httpd.server_port}"]["waited"], 1)
+
+    def test_throttled_request_waits_for_retry_after(self):
+        def respond(handler):
+            if len(self.server.requests) == 1:
+                handler.send_json({"error": "slow down"}, status=429, headers={"Retry-After": "0.2"})
+            else:
+                handler.send_json({"ok": True})
+
+        self.server.httpd.respond = respond
+        httputil.take_request_stats()
+        start = time.monotonic()
+        self.assertEqual(httputil.get_json(self.server.url("/a")), {"ok": True})
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual(httputil.take_request_stats()["throttled"], 1)
+
+    def test_unavailable_request_waits_for_retry_after(self):
+        def respond(handler):
+            if len(self.server.requests) == 1:
+                handler.send_json({"error": "maintenance"}, status=503, headers={"Retry-After": "0.1"})
+            else:
+                handler.send_json({"ok": True})
+
+        self.server.httpd.respond = respond
+        start = time.monotonic()
+        self.assertEqual(httputil.get_json(self.server.url("/a")), {"ok": True})
+        elapsed = time.monotonic() - start
+        self.assertGreaterEqual(elapsed, 0.1)
+        self.assertLess(elapsed, httputil.RETRY_BACKOFF_SECONDS)
+
+    def test_server_errors_are_retried(self):
+        def respond(handler):
+            status = 503 if len(self.server.requests) == 1 else 200
+            handler.send_json({"attempt": len(self.server.requests)}, status=status)
+
+        self.server.httpd.respond = respond
+        self.assertEqual(httputil.get_json(self.server.url("/a")), {"attempt": 2})
+
+    def test_deadline_shrinks_request_timeout(self):
+        def respond(handler):
+            time.sleep(0.5)
+            handler.send_json({})
+
+        self.server.httpd.respond = respond
+        start = time.monotonic()
+        with httputil.deadline(0.2), self.assertRaises(requests.Timeout):
+            httputil.get_json(self.server.url("/slow"))
+        self.assertLess(time.monotonic() - start, 0.45)
+
+    def test_no_retry_or_request_past_deadline(self):
+        self.server.httpd.respond = lambda handler: handler.send_json({}, status=503)
+        with httputil.deadline(0.3), self.assertRaises(requests.HTTPError):
+            httputil.get_json(self.server.url("/a"))   # 0.5s backoff would overrun
+        self.assertEqual(len(self.server.requests), 1)
+
+        with httputil.deadline(0), self.assertRaises(httputil.DeadlineExceeded):
+            httputil.get_json(self.server.url("/b"))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_concurrency_limit_halves_on_overload_and_recovers(self):
+        limiter = httputil._HostLimiter(8)
+        limiter.acquire()
+        limiter.release(overloaded=True)
+        self.assertEqual(limiter.limit, 4)
+        limiter.acquire()
+        limiter.release(overloaded=True)   # same burst of failures: no second cut
+        self.assertEqual(limiter.limit, 4)
+        for _ in range(40):
+            limiter.acquire()
+            limiter.release(overloaded=False)
+        self.assertEqual(limiter.limit, 8)
+
+    def test_token_bucket_paces_requests(self):
+        limiter = httputil._HostLimiter(8, rate=20, burst=1)
+        start = time.monotonic()
+        for _ in range(5):
+            limiter.acquire()
+            limiter.release(overloaded=False)
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+
+    def test_lru_eviction_by_bytes(self):
+        cache = httputil._ResponseCache(max_bytes=100)
+        for i in range(3):
+            cache.put(("k", i), httputil._CacheEntry(i, 40, 0, None, None))
+        self.assertIsNone(cache.get(("k", 0)))
+        self.assertEqual(cache.bytes, 80)
+
+
+def _aggregate3_result(returns):
+    """Hex eth_call result of Multicall3.aggregate3 with the given return data."""
+    w = euler._word
+    items = []
+    for data in returns:
+        body = data or b""
+        items.append(w(data is not None) + w(0x40) + w(len(body)) + body + b"\0" * (-len(body) % 32))
+    heads, offset = [], 32 * len(items)
+    for item in items:
+        heads.append(w(offset))
+        offset += len(item)
+    return "0x" + (w(0x20) + w(len(items)) + b"".join(heads) + b"".join(items)).hex()
+
+
+class _FakeRpc:
+    """Stands in for an RpcPool: records payloads, answers from `respond(payload)`."""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.payloads = []
+
+    def call(self, payload, timeout=None):
+        if isinstance(payload, list):   # a batch: one answer per request, by id
+            self.payloads.extend(payload)
+            return [{"jsonrpc": "2.0", "id": p["id"], "result": self.respond(p)} for p in payload]
+        self.payloads.append(payload)
+        return {"jsonrpc": "2.0", "id": 1, "result": self.respond(payload)}
+
+
+class TestEuler(unittest.TestCase):
+
+    def _patch_rpc(self, respond):
+        rpc = _FakeRpc(respond)
+        patcher = mock.patch.object(euler, "_rpc_pool", lambda chain_id: rpc)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return rpc
+
+    def test_amount_cap_resolution(self):
+        self.assertEqual(euler._resolve_amount_cap(0), 2 ** 256 - 1)
+        self.assertEqual(euler._resolve_amount_cap((100 << 6) | 6), 10 ** 6)
+        self.assertEqual(euler._resolve_amount_cap((250 << 6) | 18), 25 * 10 ** 17)
+
+    def test_vault_caps_in_one_aggregate_call(self):
+        w = euler._word
+        vaults = ["0x" + "11" * 20, "0x" + "22" * 20]
+        rpc = self._patch_rpc(lambda payload: _aggregate3_result([
+            w(19_000_000),
+            w((100 << 6) | 6) + w((50 << 6) | 6), w(400_000), w(100_000),
+            w(0) + w(0), w(7), w(3),
+        ]))
+        caps = euler._vault_caps(1, vaults)
+
+        self.assertEqual(len(rpc.payloads), 1)
+        call = rpc.payloads[0]["params"][0]
+        self.assertEqual(call["to"], euler.MULTICALL3)
+        self.assertTrue(call["data"].startswith("0x" + euler._AGGREGATE3.hex()))
+        self.assertEqual(caps[vaults[0]], {
+            "total_assets": 400_000, "total_borrows": 100_000,
+            "supply_cap": 10 ** 6, "borrow_cap": 5 * 10 ** 5,
+        })
+        self.assertEqual(euler._supply_cap_ratio(caps[vaults[0]]), 0.4)
+        self.assertAlmostEqual(euler._borrow_cap_ratio(caps[vaults[1]]), 0.0)   # uncapped
+
+    def test_only_vaults_with_new_logs_are_reread(self):
+        w = euler._word
+        a, b = "0x" + "aa" * 20, "0x" + "bb" * 20
+        # The logs node may lag the head: it only knows blocks up to "synced".
+        chain = {"head": 102, "synced": 1_000, "logs": []}
+
+        def respond(payload):
+            method = payload["method"]
+            if method == "eth_blockNumber":
+                return hex(chain["head"])
+            if method == "eth_getBlockByNumber":
+                number = int(payload["params"][0], 16)
+                return {"number": hex(number), "hash": f"0xh{number}"} if number <= chain["synced"] else None
+            if method == "eth_getLogs":
+                return [{"address": addr} for addr in chain["logs"]]
+            data = payload["params"][0]["data"]
+            vaults = int(data[2 + 8 + 64 : 2 + 8 + 128], 16) // 3
+            number = int(payload["params"][1]["blockHash"][3:])   # reads carry the block they were pinned to
+            per_vault = [w(0) + w(0), w(number), w(0)]
+            return _aggregate3_result([w(number)] + per_vault * vaults)
+
+        rpc = self._patch_rpc(respond)
+        patcher = mock.patch.object(euler, "_last_reads", {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        def eth_calls():
+            return [p for p in rpc.payloads if p["method"] == "eth_call"]
+
+        def last_logs_range():
+            query = [p for p in rpc.payloads if p["method"] == "eth_getLogs"][-1]["params"][0]
+            return int(query["fromBlock"], 16), int(query["toBlock"], 16)
+
+        # Reads trail the head by CONFIRMATIONS and are pinned to the block hash.
+        first = euler._read_changed(1, [a, b], euler._vault_caps)
+        self.assertEqual(first[a]["total_assets"], 100)
+        self.assertEqual(eth_calls()[-1]["params"][1], {"blockHash": "0xh100", "requireCanonical": True})
+
+        chain["head"] = 107
+        self.assertEqual(euler._read_changed(1, [a, b], euler._vault_caps), first)
+        self.assertEqual(len(eth_calls()), 1)
+        self.assertEqual(last_logs_range(), (101, 105))
+
+        chain["head"], chain["logs"] = 112, [b.upper().replace("0X", "0x")]
+        third = euler._read_changed(1, [a, b], euler._vault_caps)
+        self.assertEqual(len(eth_calls()), 2)
+        self.assertNotIn("aa" * 20, eth_calls()[-1]["params"][0]["data"])
+        self.assertEqual((third[a]["total_assets"], third[b]["total_assets"]), (100, 110))
+
+        # A node that has not seen the target yet answers with empty logs;
+        # those must not move the state past blocks it never served.
+        chain["head"], chain["synced"], chain["logs"] = 120, 115, []
+        self.assertEqual(euler._read_changed(1, [a, b], euler._vault_caps), third)
+        chain["synced"], chain["logs"] = 1_000, [a]
+        fifth = euler._read_changed(1, [a, b], euler._vault_caps)
+        self.assertEqual(last_logs_range(), (111, 118))
+        self.assertEqual(fifth[a]["total_assets"], 118)
+
+        # A delisted vault is dropped without a re-read; a newly listed one
+        # forces a full read. Either way the chain keeps a single state.
+        calls = len(eth_calls())
+        self.assertEqual(set(euler._read_changed(1, [a], euler._vault_caps)), {a})
+        self.assertEqual(len(eth_calls()), calls)
+        c = "0x" + "cc" * 20
+        chain["head"] = 125
+        self.assertEqual(set(euler._read_changed(1, [a, c], euler._vault_caps)), {a, c})
+        self.assertEqual(len(eth_calls()), calls + 1)
+        self.assertEqual(list(euler._last_reads), [(1, "_vault_caps")])
+
+    def _vault_info(self, apy, irm_word=61):
+        words = [0] * max(160, irm_word + 12)
+        words[0] = 32
+        words[euler._W_IRM_OFFSET] = (irm_word - 1) * 32
+        words[irm_word + 4] = 6 * 32
+        words[irm_word + 6] = 1
+        words[irm_word + 7 + 3] = int(apy * euler.EULER_APY_SCALE)
+        return memoryview(b"".join(euler._word(w) for w in words))
+
+    def test_borrow_apy_reads_through_dynamic_offsets(self):
+        words = euler._Words(self._vault_info(0.0725))
+        self.assertAlmostEqual(euler._borrow_apy(words), 0.0725)
+
+    def test_offset_past_the_data_raises(self):
+        truncated = self._vault_info(0.05, irm_word=200)[: 160 * 32]
+        with self.assertRaises(IndexError):
+            euler._borrow_apy(euler._Words(truncated))
+
+    def test_reverted_call_raises(self):
+        w = euler._word
+        self._patch_rpc(lambda payload: _aggregate3_result([w(1), None, w(1), w(1)]))
+        with self.assertRaises(RuntimeError):
+            euler._vault_caps(1, ["0x" + "11" * 20])
+
+    def test_chunk_size_halves_on_failure_and_grows_when_fast(self):
+        sizes = []
+
+        def aggregate3(chain_id, calls, block="latest"):
+            sizes.append(len(calls))
+            if len(calls) > 100:
+                raise requests.HTTPError("413 payload too large")
+            return 1, [memoryview(euler._word(i)) for i in range(len(calls))]
+
+        with mock.patch.object(euler, "_aggregate3", aggregate3), \
+                mock.patch.object(euler, "_chunk_calls", {}), \
+                mock.patch.object(euler, "_chunk_ceiling", {}), \
+                mock.patch.object(euler, "_chunk_floor", {}):
+            calls = [("0x" + "11" * 20, euler._TOTAL_ASSETS)] * 450
+            returns = euler._aggregate3_chunked(1, calls)
+
+        self.assertEqual([euler._uint(r, 0) for r in returns[:2]], [0, 1])
+        self.assertEqual(len(returns), 450)
+        # Failures fall back to the last size that worked; growth closes in on the limit.
+        self.assertEqual(sizes, [200, 100, 150, 100, 125, 100, 112, 100, 50])
+
+    def test_discovered_vaults_emit_rates_and_pairs(self):
+        w = euler._word
+        perspective, debt, coll = "0x" + "99" * 20, "0x" + "d0" * 20, "0x" + "c0" * 20
+        odd = "0x" + "e0" * 20   # a non-EVK collateral whose cap reads revert
+        usdc, wsteth = "0x" + "01" * 20, "0x" + "02" * 20
+        spy = int(math.log1p(0.05) / euler.SECONDS_PER_YEAR * euler.EULER_APY_SCALE)
+
+        def addresses(*addrs):
+            return w(0x20) + w(len(addrs)) + b"".join(euler._address_word(a) for a in addrs)
+
+        def string(s):
+            return w(0x20) + w(len(s)) + s.encode().ljust(32, b"\0")
+
+        chain = {
+            (perspective, euler._VERIFIED_ARRAY): addresses(debt),
+            (debt, euler._LTV_LIST): addresses(coll, odd),
+            (coll, euler._LTV_LIST): addresses(),
+            (odd, euler._LTV_LIST): None,
+            (odd, euler._ASSET): None,
+            (odd, euler._CAPS): None,
+            (odd, euler._TOTAL_ASSETS): None,
+            (odd, euler._TOTAL_BORROWS): None,
+            (odd, euler._INTEREST_RATE): None,
+            (debt, euler._ASSET): euler._address_word(usdc),
+            (coll, euler._ASSET): euler._address_word(wsteth),
+            (usdc, euler._SYMBOL): string("USDC"),
+            (wsteth, euler._SYMBOL): b"wstETH".ljust(32, b"\0"),   # bytes32 symbol
+            (debt, euler._CAPS): w((100 << 6) | 6) + w((50 << 6) | 6),
+            (debt, euler._TOTAL_ASSETS): w(0),
+            (debt, euler._TOTAL_BORROWS): w(250_000),
+            (debt, euler._INTEREST_RATE): w(spy),
+            (coll, euler._CAPS): w((100 << 6) | 6) + w(0),
+            (coll, euler._TOTAL_ASSETS): w(800_000),
+            (coll, euler._TOTAL_BORROWS): w(0),
+            (coll, euler._INTEREST_RATE): w(0),
+        }
+
+        def aggregate3(chain_id, calls, block="latest"):
+            return 1, [None if chain[(t.lower(), s)] is None else memoryview(chain[(t.lower(), s)]) for t, s in calls]
+
+        with mock.patch.object(euler, "_aggregate3", aggregate3), \
+                mock.patch.object(euler, "_read_changed", lambda c, v, reader: reader(c, v)), \
+                mock.patch.object(euler, "_discovered", {}), \
+                mock.patch.object(euler, "_discovered_pairs", {}), \
+                mock.patch.object(euler, "PAIRED_CAPS", list(euler.SENTORA_PAIRS)):
+            metrics = {m["key"]: m for m in euler._discovered_metrics(1, [(perspective, "prime")])}
+            pairs = euler.PAIRED_CAPS[len(euler.SENTORA_PAIRS):]
+
+            # Rediscovered without the vault: its pair stops being evaluated.
+            chain[(perspective, euler._VERIFIED_ARRAY)] = addresses()
+            euler._discovered.clear()
+            self.assertEqual(euler._discovered_metrics(1, [(perspective, "prime")]), [])
+            self.assertEqual(euler.PAIRED_CAPS, euler.SENTORA_PAIRS)
+
+        # Keys carry each vault's address prefix; the reverting collateral is skipped.
+        self.assertEqual(set(metrics), {
+            "euler:prime:usdc-d0d0d0:borrow:rate",
+            "euler:prime:wsteth-c0c0c0:usdc-d0d0d0:supply:cap_util",
+            "euler:prime:wsteth-c0c0c0:usdc-d0d0d0:borrow:cap_util",
+        })
+        self.assertAlmostEqual(metrics["euler:prime:usdc-d0d0d0:borrow:rate"]["value"], 0.05, places=9)
+        self.assertAlmostEqual(metrics["euler:prime:wsteth-c0c0c0:usdc-d0d0d0:supply:cap_util"]["value"], 0.8)
+        self.assertAlmostEqual(metrics["euler:prime:wsteth-c0c0c0:usdc-d0d0d0:borrow:cap_util"]["value"], 0.5)
+        self.assertEqual([p["pair_name"] for p in pairs], ["Euler Prime wstETH/USDC"])
+
+
+def _reserve_account(
+    decimals=6, available=0, borrowed=0, fees=0, referrer_fees=0, pending_fees=0,
+    deposit_limit=0, borrow_limit=0, util_pct=0, name="", status=0,
+):
+    """A klend Reserve account laid out per the IDL, amounts in whole tokens."""
+    data = bytearray(8624)
+    # Past 18 decimals the account is deliberately misread; amounts go in raw.
+    scale, sf = 10 ** decimals if decimals <= 18 else 1, 2 ** 60
+
+    def put(offset, value, size):
+        data[offset : offset + size] = int(value).to_bytes(size, "little")
+
+    # Offsets written out from the IDL rather than taken from kamino, so a
+    # wrong constant there fails these tests instead of agreeing with itself.
+    put(224, available * scale, 8)                 # liquidity.availableAmount
+    put(232, borrowed * scale * sf, 16)            # liquidity.borrowedAmountSf
+    put(272, decimals, 8)                          # liquidity.mintDecimals
+    put(344, fees * scale * sf, 16)                # liquidity.accumulatedProtocolFeesSf
+    put(360, referrer_fees * scale * sf, 16)       # liquidity.accumulatedReferrerFeesSf
+    put(376, pending_fees * scale * sf, 16)        # liquidity.pendingReferrerFeesSf
+    data[4856] = status                            # config.status
+    put(5016, deposit_limit * scale, 8)            # config.depositLimit
+    put(5024, borrow_limit * scale, 8)             # config.borrowLimit
+    data[5032 : 5032 + len(name)] = name.encode()  # config.tokenInfo.name
+    data[5501] = util_pct                          # config.utilizationLimitBlockBorrowingAbovePct
+    return bytes(data)
+
+
+def _reserve_slice(account):
+    return account[kamino._RESERVE_SLICE_OFFSET : kamino._RESERVE_SLICE_OFFSET + kamino._RESERVE_SLICE_LENGTH]
+
+
+def _decoded(**fields):
+    return kamino._decode_reserves({"R": _reserve_slice(_reserve_account(**fields))})["R"]
+
+
+class TestKamino(unittest.TestCase):
+
+    def test_reserves_read_in_one_call_per_hundred(self):
+        reserves = [f"Reserve{i}" for i in range(150)]
+        rpc = _FakeRpc(lambda payload: {"value": [
+            {"data": [base64.b64encode(_reserve_slice(_reserve_account(available=i))).decode(), "base64"]}
+            for i in range(len(payload["params"][0]))
+        ]})
+        with mock.patch.object(kamino, "_RPC", rpc):
+            slices = kamino._fetch_reserve_slices(reserves)
+
+        self.assertEqual([len(p["params"][0]) for p in rpc.payloads], [100, 50])
+        self.assertEqual({p["method"] for p in rpc.payloads}, {"getMultipleAccounts"})
+        self.assertEqual(rpc.payloads[0]["params"][1]["dataSlice"], {"offset": 224, "length": 5278})
+        self.assertEqual(kamino._decode_reserves(slices)["Reserve149"]["available"], 49)
+
+    def test_missing_reserve_raises(self):
+        rpc = _FakeRpc(lambda payload: {"value": [None]})
+        with mock.patch.object(kamino, "_RPC", rpc), self.assertRaises(RuntimeError):
+            kamino._fetch_reserve_slices(["Gone"])
+
+    def test_decode_reserve(self):
+        reserve = _decoded(
+            available=40_000_000, borrowed=60_000_000, fees=10_000, referrer_fees=2_000, pending_fees=1_000,
+            deposit_limit=150_000_000, borrow_limit=80_000_000, util_pct=90, name="PYUSD",
+        )
+        self.assertEqual(reserve["decimals"], 6)
+        self.assertEqual(reserve["available"], 40_000_000)
+        self.assertEqual(reserve["total_borrows"], 60_000_000)
+        self.assertEqual(reserve["total_supply"], 99_987_000)
+        self.assertEqual(reserve["deposit_limit"], 150_000_000)
+        self.assertEqual(reserve["borrow_limit"], 80_000_000)
+        self.assertEqual(reserve["util_limit_pct"], 90)
+        self.assertEqual(reserve["symbol"], "PYUSD")
+        self.assertEqual(kamino._decode_reserves({"R": _reserve_slice(_reserve_account(status=2))}), {})
+
+    def test_borrowable_takes_the_binding_constraint(self):
+        def borrowable(**fields):
+            return kamino._borrowable(_decoded(**fields))
+
+        # Cap binds: 80M - 60M.
+        self.assertEqual(borrowable(available=40_000_000, borrowed=60_000_000, borrow_limit=80_000_000), 20_000_000)
+        # Utilization limit binds: 70% of 100M supply - 60M.
+        self.assertAlmostEqual(
+            borrowable(available=40_000_000, borrowed=60_000_000, borrow_limit=80_000_000, util_pct=70),
+            10_000_000, places=3,
+        )
+        # Vault liquidity binds.
+        self.assertEqual(borrowable(available=5_000_000, borrowed=60_000_000, borrow_limit=80_000_000), 5_000_000)
+        # Over the cap: nothing, never negative.
+        self.assertEqual(borrowable(available=40_000_000, borrowed=90_000_000, borrow_limit=80_000_000), 0.0)
+
+    def test_market_discovery_is_cached(self):
+        accounts = {
+            "AAA1usdc": _reserve_account(available=100, borrow_limit=1_000, name="USDC"),
+            "BBB2usdc": _reserve_account(available=200, borrow_limit=1_000, name="USDC"),
+            # Retired reserves may hold anything; status is checked first.
+            "CCC3old": _reserve_account(decimals=2 ** 64 - 1, name="OLD", status=1),
+            "DDD4odd": _reserve_account(available=400, borrow_limit=1_000, util_pct=150, name="ODD"),
+        }
+
+        def encoded(pubkey):
+            return [base64.b64encode(_reserve_slice(accounts[pubkey])).decode(), "base64"]
+
+        def respond(payload):
+            if payload["method"] == "getProgramAccounts":
+                return [{"pubkey": p, "account": {"data": encoded(p)}} for p in accounts]
+            return {"value": [{"data": encoded(p)} for p in payload["params"][0]]}
+
+        rpc = _FakeRpc(respond)
+        with mock.patch.object(kamino, "_RPC", rpc), mock.patch.object(kamino, "_discovered", {}), \
+                contextlib.redirect_stdout(io.StringIO()) as out:
+            first = kamino._market_metrics("Market1", "prime")
+            accounts["AAA1usdc"] = _reserve_account(available=150, borrow_limit=1_000, name="USDC")
+            second = kamino._market_metrics("Market1", "prime")
+
+        self.assertEqual([p["method"] for p in rpc.payloads], ["getProgramAccounts", "getMultipleAccounts"])
+        filters = rpc.payloads[0]["params"][1]["filters"]
+        self.assertIn({"memcmp": {"offset": 32, "bytes": "Market1"}}, filters)
+        self.assertEqual(sorted(rpc.payloads[1]["params"][0]), ["AAA1usdc", "BBB2usdc", "CCC3old", "DDD4odd"])
+        # Two USDC reserves are told apart; the obsolete and the implausible
+        # reserve are skipped, and only the latter is logged.
+        self.assertEqual({m["key"]: m["value"] for m in first}, {
+            "kamino:prime:usdc-aaa1:borrow:available": 100,
+            "kamino:prime:usdc-bbb2:borrow:available": 200,
+        })
+        self.assertEqual([m["value"] for m in second], [150, 200])
+        self.assertNotIn("CCC3old", out.getvalue())
+        self.assertIn("skipping reserve DDD4odd", out.getvalue())
+
+    def test_pushed_accounts_become_metrics(self):
+        with mock.patch.object(kamino, "_tracked", {"Res1": ("kamino:x:usdc:borrow:available", "USDC")}):
+            metrics = kamino.metrics_from_accounts({
+                "Res1": _reserve_account(available=100, borrow_limit=1_000),
+                "Untracked": _reserve_account(available=5),
+            })
+        self.assertEqual([(m["key"], m["value"]) for m in metrics], [("kamino:x:usdc:borrow:available", 100)])
+
+    def test_huge_decimals_are_skipped_before_scaling(self):
+        slices = {
+            "Retired": _reserve_slice(_reserve_account(available=1, decimals=2 ** 64 - 1, status=1)),
+            "Shifted": _reserve_slice(_reserve_account(available=1, decimals=2 ** 40)),
+            "Fine": _reserve_slice(_reserve_account(available=5, borrow_limit=10)),
+        }
+        start = time.monotonic()
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            decoded = kamino._decode_reserves(slices)
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(list(decoded), ["Fine"])
+        self.assertEqual(out.getvalue().count("skipping reserve"), 1)
+        self.assertIn("Shifted", out.getvalue())
+
+    def test_hand_picked_and_pushed_reserves_follow_one_rule(self):
+        accounts = {
+            "Res1": _reserve_account(available=100, borrow_limit=1_000),
+            "Res2": _reserve_account(available=200, borrow_limit=1_000, status=1),
+        }
+        rpc = _FakeRpc(lambda payload: {"value": [
+            {"data": [base64.b64encode(_reserve_slice(accounts[r])).decode(), "base64"]}
+            for r in payload["params"][0]
+        ]})
+        with mock.patch.object(kamino, "_RPC", rpc), mock.patch.object(kamino, "MARKETS", {}), \
+                mock.patch.object(kamino, "RESERVES", {"Res1": "USDe", "Res2": "sUSDe"}), \
+                mock.patch.object(kamino, "_tracked", {}):
+            fetched = kamino.fetch()
+            pushed = kamino.metrics_from_accounts(accounts)
+            tracked = kamino.stream_accounts()
+        # Both stay tracked, but a retired hand-picked reserve is reported by neither path.
+        self.assertEqual(tracked, ["Res1", "Res2"])
+        self.assertEqual([m["key"] for m in fetched], ["kamino:ethena:usde:borrow:available"])
+        self.assertEqual(pushed, fetched)
+
+    def test_short_slice_raises(self):
+        with self.assertRaises(RuntimeError):
+            kamino._decode_reserves({"R": b"\0" * 16})
+
+
+class TestAccountStream(unittest.TestCase):
+
+    def test_updates_are_debounced_and_reconnects_resubscribe(self):
+        from aiohttp import web
+
+        def notification(subscription, data):
+            return {
+                "jsonrpc": "2.0",
+                "method": "accountNotification",
+                "params": {
+                    "subscription": subscription,
+                    "result": {"context": {"slot": 1}, "value": {"data": [base64.b64encode(data).decode(), "base64"]}},
+                },
+            }
+
+        async def scenario():
+            subscribed = []
+
+            async def handler(request):
+                ws = web.WebSocketResponse()
+                await ws.prepare(request)
+                subs = {}
+                for _ in range(2):
+                    msg = await ws.receive_json()
+                    subscribed.append(msg["params"][0])
+                    subs[msg["params"][0]] = 100 + msg["id"]
+                    await ws.send_json({"jsonrpc": "2.0", "id": msg["id"], "result": 100 + msg["id"]})
+                for i in range(3):
+                    await ws.send_json(notification(subs["A"], b"a%d" % i))
+                await ws.send_json(notification(subs["B"], b"b0"))
+                await asyncio.sleep(0.3)
+                await ws.close()   # the client should reconnect and resubscribe
+                return ws
+
+            app = web.Application()
+            app.router.add_get("/", handler)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = runner.addresses[0][1]
+
+            connects, updates = [], []
+
+            async def accounts():
+                connects.append(1)
+                return ["A", "B"]
+
+            async def on_update(batch):
+                updates.append(batch)
+
+            stream = solstream.AccountStream(f"ws://127.0.0.1:{port}/", accounts, on_update, debounce=0.1)
+            with mock.patch.object(solstream, "RECONNECT_MIN_SECONDS", 0.05):
+                task = asyncio.create_task(stream.run())
+                for _ in range(100):
+                    if len(connects) >= 2:
+                        break
+                    await asyncio.sleep(0.05)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+            await runner.cleanup()
+            return subscribed, connects, updates, stream
+
+        subscribed, connects, updates, stream = asyncio.run(scenario())
+        self.assertGreaterEqual(len(connects), 2)
+        self.assertEqual(subscribed[:4], ["A", "B", "A", "B"])
+        # Three updates to A and one to B in one window: one batch, latest data wins.
+        self.assertEqual(updates[0], {"A": b"a2", "B": b"b0"})
+        self.assertGreaterEqual(stream.notifications, 4)
+
+    def test_refresh_resubscribes_and_healthy_connects_reset_backoff(self):
+        from aiohttp import web
+
+        async def scenario():
+            requests_seen = []
+
+            async def handler(request):
+                ws = web.WebSocketResponse()
+                await ws.prepare(request)
+                async for msg in ws:
+                    data = json.loads(msg.data)
+                    requests_seen.append((data["method"], data["params"][0]))
+                    result = True if data["method"] == "accountUnsubscribe" else 100 + data["id"]
+                    await ws.send_json({"jsonrpc": "2.0", "id": data["id"], "result": result})
+                return ws
+
+            app = web.Application()
+            app.router.add_get("/", handler)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+
+            wanted = [["A", "B"], ["A", "C"]]
+
+            async def accounts():
+                return wanted.pop(0) if len(wanted) > 1 else wanted[0]
+
+            async def on_update(batch):
+                pass
+
+            stream = solstream.AccountStream(
+                f"ws://127.0.0.1:{runner.addresses[0][1]}/", accounts, on_update, refresh=0.1,
+            )
+            stream._backoff = solstream.RECONNECT_MAX_SECONDS   # as after several drops
+            task = asyncio.create_task(stream.run())
+            for _ in range(100):
+                if ("accountUnsubscribe", 101) in requests_seen:
+                    break
+                await asyncio.sleep(0.02)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            await runner.cleanup()
+            return requests_seen, stream
+
+        requests_seen, stream = asyncio.run(scenario())
+        self.assertEqual(requests_seen[:4], [
+            ("accountSubscribe", "A"),
+            ("accountSubscribe", "B"),
+            ("accountSubscribe", "C"),
+            ("accountUnsubscribe", 101),   # B's subscription id
+        ])
+        self.assertEqual(stream._backoff, solstream.RECONNECT_MIN_SECONDS)
+
+    def test_ws_url(self):
+        self.assertEqual(solstream.ws_url("https://rpc.example.com/key"), "wss://rpc.example.com/key")
+        self.assertEqual(solstream.ws_url("http://localhost:8899"), "ws://localhost:8899")
+
+
+def _rpc_server(name, delay=0.0, status=200, error=None):
+    """Stand-in JSON-RPC endpoint answering with its own name (or `error`) after `delay`."""
+    def respond(handler):
+        time.sleep(delay)
+        body = {"jsonrpc": "2.0", "id": 1}
+        body.update({"error": error} if error is not None else {"result": name})
+        handler.send_json(body, status=status)
+    return StubServer(respond)
+
+
+class TestRpcPool(unittest.TestCase):
+
+    def setUp(self):
+        for target, value in (("RETRIES", 0), ("RETRY_BACKOFF_SECONDS", 0)):
+            patcher = mock.patch.object(httputil, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _servers(self, *specs):
+        servers = [_rpc_server(name, **kw) for name, kw in specs]
+        for s in servers:
+            self.addCleanup(s.close)
+        return servers
+
+    def test_calls_move_to_the_fastest_endpoint(self):
+        slow, fast = self._servers(("slow", {"delay": 0.1}), ("fast", {}))
+        pool = rpcpool.RpcPool([slow.url(), fast.url()])
+        results = [pool.call({"method": "ping"})["result"] for _ in range(4)]
+        self.assertEqual(results, ["slow", "fast", "fast", "fast"])
+        self.assertEqual(pool.ranked(), [fast.url(), slow.url()])
+
+    def test_slow_primary_is_hedged(self):
+        slow, backup = self._servers(("slow", {"delay": 0.5}), ("backup", {}))
+        pool = rpcpool.RpcPool([slow.url(), backup.url()])
+        start = time.monotonic()
+        with mock.patch.object(rpcpool, "DEFAULT_HEDGE_DELAY", 0.05):
+            self.assertEqual(pool.call({"method": "ping"})["result"], "backup")
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertEqual(pool.hedged, 1)
+
+    def test_failing_endpoint_fails_over_and_ranks_last(self):
+        broken, good = self._servers(("broken", {"status": 500}), ("good", {"delay": 0.05}))
+        pool = rpcpool.RpcPool([broken.url(), good.url()])
+        self.assertEqual(pool.call({"method": "ping"})["result"], "good")
+        self.assertEqual(pool.ranked(), [good.url(), broken.url()])
+        self.assertEqual(pool.stats()[broken.url()]["errors"], 1)
+
+    def test_error_response_fails_over_and_ranks_last(self):
+        lagging, good = self._servers(
+            ("lagging", {"error": {"code": -32000, "message": "header not found"}}),
+            ("good", {"delay": 0.05}),
+        )
+        pool = rpcpool.RpcPool([lagging.url(), good.url()])
+        self.assertEqual(pool.call({"method": "eth_call"})["result"], "good")
+        self.assertEqual(pool.ranked(), [good.url(), lagging.url()])
+        self.assertEqual(pool.stats()[lagging.url()]["wins"], 0)
+        self.assertEqual(pool.stats()[lagging.url()]["errors"], 1)
+
+        with self.assertRaises(rpcpool.RpcError):
+            rpcpool.RpcPool([lagging.url()]).call({"method": "eth_call"})
+
+    def test_all_endpoints_failing_raises(self):
+        a, b = self._servers(("a", {"status": 500}), ("b", {"status": 502}))
+        with self.assertRaises(requests.HTTPError):
+            rpcpool.RpcPool([a.url(), b.url()]).call({"method": "ping"})
+
+
+class FakeClock:
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestAdapterScheduler(unittest.TestCase):
+
+    def _scheduler(self, intervals, **kwargs):
+        self.clock = FakeClock()
+        return AdapterScheduler(intervals, clock=self.clock, **kwargs)
+
+    def test_everything_due_at_start(self):
+        sched = self._scheduler({"a": 60, "b": 300})
+        self.assertEqual(sched.seconds_until_next(), 0)
+        self.assertEqual(sorted(sched.pop_due()), ["a", "b"])
+        self.assertEqual(sched.seconds_until_next(), 60)
+
+    def test_each_adapter_keeps_its_own_cadence(self):
+        sched = self._scheduler({"a": 60, "b": 150})
+        sched.pop_due()
+        fired = []
+        for _ in range(10):
+            self.clock.now += sched.seconds_until_next()
+            fired.extend((round(self.clock.now - 1000), n) for n in sched.pop_due())
+        self.assertEqual(
+            fired[:6],
+            [(60, "a"), (120, "a"), (150, "b"), (180, "a"), (240, "a"), (300, "a")],
+        )
+
+    def test_late_pop_does_not_drift_and_records_lag(self):
+        sched = self._scheduler({"a": 60})
+        sched.pop_due()
+        self.clock.now += 65
+        self.assertEqual(sched.pop_due(), ["a"])
+        self.assertAlmostEqual(sched.lag["a"], 5)
+        self.assertAlmostEqual(sched.seconds_until_next(), 55)
+
+    def test_catch_up_skip_stays_on_grid(self):
+        sched = self._scheduler({"a": 60})
+        sched.pop_due()
+        self.clock.now += 200
+        sched.pop_due()
+        self.assertAlmostEqual(sched.seconds_until_next(), 40)
+
+    def test_catch_up_reset_starts_new_grid(self):
+        sched = self._scheduler({"a": 60}, catch_up=CATCH_UP_RESET)
+        sched.pop_due()
+        self.clock.now += 200
+        sched.pop_due()
+        self.assertAlmostEqual(sched.seconds_until_next(), 60)
+
+    def test_jitter_delays_firing_without_moving_grid(self):
+        sched = self._scheduler({"a": 60}, jitter={"a": 10}, rng=lambda lo, hi: hi)
+        self.assertAlmostEqual(sched.seconds_until_next(), 10)
+        self.clock.now += 10
+        sched.pop_due()
+        self.assertAlmostEqual(sched.seconds_until_next(), 60)
+
+
+_STUB_ADAPTER = """
+import os, time
+
+def fetch():
+    with open(os.path.join(os.path.dirname(__file__), "mode")) as f:
+        mode = f.read()
+    if mode == "hang":
+        time.sleep(3600)
+    if mode == "error":
+        raise ValueError("boom")
+    return [{"key": "stub:rate", "pid": os.getpid()}]
+"""
+
+
+class TestAdapterProcessPool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        with open(os.path.join(cls.tmpdir.name, "stub_adapter.py"), "w") as f:
+            f.write(_STUB_ADAPTER)
+        # Workers fork from a forkserver that snapshots sys.path when it starts.
+        sys.path.insert(0, cls.tmpdir.name)
+        cls.pool = workers.AdapterProcessPool(1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        cls.tmpdir.cleanup()
+
+    def _run(self, mode, timeout=10):
+        # Workers do not see later environment changes, so the stub reads its
+        # behaviour from a file next to it.
+        with open(os.path.join(self.tmpdir.name, "mode"), "w") as f:
+            f.write(mode)
+        return self.pool.run("stub_adapter", timeout)
+
+    def test_returns_metrics(self):
+        metrics = self._run("ok")
+        self.assertEqual(metrics[0]["key"], "stub:rate")
+        self.assertNotEqual(metrics[0]["pid"], os.getpid())
+
+    def test_error_propagates(self):
+        with self.assertRaisesRegex(RuntimeError, "boom"):
+            self._run("error")
+
+    def test_hung_worker_is_killed_and_recycled(self):
+        before = self.pool.recycled
+        with self.assertRaises(workers.WorkerTimeout):
+            self._run("hang", timeout=0.5)
+        self.assertEqual(self.pool.recycled, before + 1)
+        self.assertEqual(self._run("ok")[0]["key"], "stub:rate")
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,115 @@
+import importlib
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Dict, List
+
+import httputil
+
+
+# Process-isolated adapter execution.
+#
+# Threads cannot be cancelled: an adapter stuck in a socket read or inside a C
+# extension pins its engine worker thread forever. Here each fetch() runs in a
+# long-lived child process instead, and a child that overruns its budget is
+# killed and replaced. Children come from a forkserver so they never inherit
+# the bot's event loop or engine threads.
+
+_START_METHOD = "forkserver"
+
+
+class WorkerTimeout(RuntimeError):
+    """Raised when an adapter fetch overran its budget and its worker was killed."""
+
+
+class WorkerCrashed(RuntimeError):
+    """Raised when a worker process died before returning a result."""
+
+
+def _worker_main(conn) -> None:
+    """
+    Child loop: receive an adapter module path and time budget, run its
+    fetch() under that HTTP deadline, send back ("ok", metrics) or
+    ("error", message). Exits when the pipe closes.
+    """
+    while True:
+        try:
+            module, budget = conn.recv()
+        except EOFError:
+            return
+        try:
+            mod = importlib.import_module(module)
+            with httputil.deadline(budget):
+                conn.send(("ok", mod.fetch()))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child_conn = ctx.Pipe()
+        self.proc = ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.proc.start()
+        child_conn.close()
+
+    def kill(self) -> None:
+        self.proc.kill()
+        self.proc.join()
+        self.conn.close()
+
+
+class AdapterProcessPool:
+    """
+    Fixed-size pool of pre-started worker processes.
+
+    run() is safe to call from several threads at once; each call borrows one
+    idle worker for the duration of the fetch.
+    """
+
+    def __init__(self, size: int):
+        self._ctx = multiprocessing.get_context(_START_METHOD)
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self.recycled = 0
+        for _ in range(size):
+            self._idle.put(_Worker(self._ctx))
+
+    def _replace(self, worker: _Worker) -> None:
+        worker.kill()
+        with self._lock:
+            self.recycled += 1
+        self._idle.put(_Worker(self._ctx))
+
+    def run(self, module: str, timeout: float) -> List[Dict]:
+        """
+        Run <module>.fetch() in a worker (e.g. module="adapters.euler"),
+        waiting at most `timeout` seconds including the wait for an idle worker.
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise WorkerTimeout(f"no idle worker within {timeout:g}s") from None
+
+        try:
+            worker.conn.send((module, max(0.0, deadline - time.monotonic())))
+            if not worker.conn.poll(max(0.0, deadline - time.monotonic())):
+                self._replace(worker)
+                raise WorkerTimeout(f"killed after {timeout:g}s")
+            status, payload = worker.conn.recv()
+        except (EOFError, OSError):
+            self._replace(worker)
+            raise WorkerCrashed(f"worker process for {module!r} died") from None
+
+        self._idle.put(worker)
+        if status == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                return